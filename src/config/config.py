@@ -28,3 +28,235 @@ with open(PATH_PRG / 'config/monitored_computers.json', 'r', encoding='utf-8') a
     MONITORED_COMPUTERS = json.load(f)
 
 MAX_TELEGRAM_MESSAGE_LENGTH = int(getenv("MAX_TELEGRAM_MESSAGE_LENGTH", "4096"))
+
+# GESTIONE GRAFICI DI CONFRONTO
+# Timeout (secondi) per la raccolta dei dati di ciascun computer
+COMPARE_HOST_TIMEOUT = float(getenv("COMPARE_HOST_TIMEOUT", "15"))
+# Validità (secondi) dello storico CPU/RAM in cache prima di essere riscaricato
+HISTORY_MAX_AGE = int(getenv("HISTORY_MAX_AGE", "300"))
+
+# GESTIONE PRE-RACCOLTA IN BACKGROUND
+PRECOLLECT_ENABLED = getenv("PRECOLLECT_ENABLED", "1") == "1"
+# Elenco "comando:intervallo_secondi" da pre-raccogliere su ogni computer.
+# "cpu_history" aggiorna lo storico CPU/RAM usato dai grafici, "procstats" i campioni /proc per iostat/vmstat,
+# gli altri sono comandi di linux_admin.sh
+PRECOLLECT_TARGETS = {}
+for _item in getenv("PRECOLLECT_TARGETS", "resources:120,loadavg:60,services:600,updates:3600,cpu_history:600,procstats:15").split(","):
+    _name, _, _interval = _item.strip().partition(":")
+    if _name:
+        PRECOLLECT_TARGETS[_name] = int(_interval or "300")
+# Ogni quanti secondi lo scheduler controlla se ci sono raccolte da avviare
+PRECOLLECT_TICK = int(getenv("PRECOLLECT_TICK", "10"))
+# Variazione casuale massima dell'intervallo (frazione), per non interrogare tutti i computer insieme
+PRECOLLECT_JITTER = float(getenv("PRECOLLECT_JITTER", "0.2"))
+# Numero massimo di raccolte contemporanee sullo stesso computer
+PRECOLLECT_MAX_PER_HOST = int(getenv("PRECOLLECT_MAX_PER_HOST", "1"))
+# Intervallo massimo (secondi) raggiunto dal back-off per i computer non raggiungibili
+PRECOLLECT_MAX_BACKOFF = int(getenv("PRECOLLECT_MAX_BACKOFF", "3600"))
+
+# GESTIONE CACHE DEI RISULTATI DEI COMANDI
+# Elenco "comando:ttl_secondi" dei comandi i cui risultati cambiano raramente
+COMMAND_CACHE_TTL = {}
+for _item in getenv("COMMAND_CACHE_TTL", "hardware:3600,info_kernel_os:86400,packages:1800,dns:600,ssh:300").split(","):
+    _name, _, _ttl = _item.strip().partition(":")
+    if _name:
+        COMMAND_CACHE_TTL[_name] = int(_ttl or "300")
+# Numero massimo di risultati conservati (oltre il limite vengono eliminati i meno usati)
+COMMAND_CACHE_MAX_ENTRIES = int(getenv("COMMAND_CACHE_MAX_ENTRIES", "256"))
+# Comandi che modificano il sistema remoto: invalidano la cache del computer su cui vengono eseguiti.
+# Vuoto di proposito: tutte le azioni di linux_admin.sh sono in sola lettura ("updates" elenca gli
+# aggiornamenti con apt list/dnf check-update senza installarli, "packages" legge i pacchetti installati).
+# Le modifiche fatte fuori dal bot sono coperte solo dalla durata in COMMAND_CACHE_TTL; va compilato
+# se allo script vengono aggiunte azioni che cambiano lo stato (es. installazione aggiornamenti, riavvio servizi)
+MUTATING_COMMANDS = set(filter(None, getenv("MUTATING_COMMANDS", "").split(",")))
+
+# GESTIONE CAMPIONI /proc (iostat/vmstat istantanei)
+# Età massima (secondi) dell'ultimo campione per rispondere senza nuove letture
+PROCSTATS_MAX_AGE = int(getenv("PROCSTATS_MAX_AGE", "60"))
+
+# GESTIONE VISUALIZZATORE JOURNAL
+# Voci di log mostrate per ogni pagina
+JOURNAL_PAGE_SIZE = int(getenv("JOURNAL_PAGE_SIZE", "20"))
+# Pagine conservate in memoria per ogni utente e computer (le più vecchie vengono scartate)
+JOURNAL_MAX_PAGES = int(getenv("JOURNAL_MAX_PAGES", "20"))
+# Numero massimo di nuove voci scaricate a ogni richiesta di aggiornamento
+JOURNAL_NEW_LIMIT = int(getenv("JOURNAL_NEW_LIMIT", "100"))
+
+# GESTIONE RICERCA NEI LOG DI TUTTI I COMPUTER
+# Numero massimo di risultati raccolti: raggiunto il limite la ricerca si interrompe
+FLEET_SEARCH_LIMIT = int(getenv("FLEET_SEARCH_LIMIT", "200"))
+# Tempo massimo (secondi) concesso a journalctl su ogni computer
+FLEET_SEARCH_TIME_LIMIT = int(getenv("FLEET_SEARCH_TIME_LIMIT", "20"))
+# Dimensione del buffer tra i computer e il bot (voci in attesa di essere elaborate)
+FLEET_SEARCH_BUFFER = int(getenv("FLEET_SEARCH_BUFFER", "50"))
+
+# GESTIONE SCHEDULER DELLE OPERAZIONI REMOTE
+# Operazioni remote contemporanee massime per singolo computer e in totale
+SCHEDULER_MAX_PER_HOST = int(getenv("SCHEDULER_MAX_PER_HOST", "2"))
+SCHEDULER_MAX_GLOBAL = int(getenv("SCHEDULER_MAX_GLOBAL", "16"))
+# Lunghezza massima della coda per classe di priorità: oltre il limite le richieste vengono rifiutate subito
+SCHEDULER_QUEUE_LIMITS = {}
+for _item in getenv("SCHEDULER_QUEUE_LIMITS", "interactive:20,monitor:20,background:50,fanout:100").split(","):
+    _name, _, _limit = _item.strip().partition(":")
+    if _name:
+        SCHEDULER_QUEUE_LIMITS[_name] = int(_limit or "50")
+
+# GESTIONE STATO DI SALUTE DEI COMPUTER (CIRCUIT BREAKER)
+# Errori di connessione consecutivi dopo i quali il computer viene considerato irraggiungibile
+HEALTH_FAILURE_THRESHOLD = int(getenv("HEALTH_FAILURE_THRESHOLD", "2"))
+# Secondi dopo i quali una richiesta reale può ritentare la connessione a un computer irraggiungibile
+HEALTH_OPEN_COOLDOWN = int(getenv("HEALTH_OPEN_COOLDOWN", "60"))
+# Ogni quanti secondi i computer irraggiungibili vengono sondati in background
+HEALTH_PROBE_INTERVAL = int(getenv("HEALTH_PROBE_INTERVAL", "20"))
+
+# SESSIONE REMOTA PERSISTENTE
+# Se attivo, i comandi di linux_admin.sh passano da un worker (scripts/admin_worker.sh) che resta attivo su ogni computer
+REMOTE_SESSION_ENABLED = getenv("REMOTE_SESSION_ENABLED", "false").lower() in ("1", "true", "yes")
+# Secondi di inattività dopo i quali il worker remoto termina
+REMOTE_SESSION_IDLE_TIMEOUT = int(getenv("REMOTE_SESSION_IDLE_TIMEOUT", "300"))
+# Tempo massimo di attesa della risposta del worker per un comando
+REMOTE_SESSION_TIMEOUT = int(getenv("REMOTE_SESSION_TIMEOUT", "120"))
+# Secondi prima di riprovare ad avviare il worker su un computer dove non è disponibile
+REMOTE_SESSION_RETRY = int(getenv("REMOTE_SESSION_RETRY", "600"))
+
+# INVIO DEGLI SCRIPT AI COMPUTER MONITORATI
+# Se attivo, gli script vengono copiati su ogni computer (solo quando cambiano) invece di richiedere il progetto clonato
+SCRIPT_DEPLOY_ENABLED = getenv("SCRIPT_DEPLOY_ENABLED", "true").lower() in ("1", "true", "yes")
+# Cartella remota (relativa alla home dell'utente SSH) in cui vengono salvate le versioni degli script
+SCRIPT_DEPLOY_DIR = getenv("SCRIPT_DEPLOY_DIR", ".linuxadminbot")
+
+# SNAPSHOT DEI COMPUTER
+# Sezioni lette in un'unica esecuzione remota (file di /proc e /sys, spazio su disco)
+SNAPSHOT_SECTIONS = [s.strip() for s in getenv(
+    "SNAPSHOT_SECTIONS", "pagesize,uptime,loadavg,stat,vmstat,meminfo,diskstats,net_dev,thermal,df"
+).split(",") if s.strip()]
+
+# DASHBOARD DEI COMPUTER
+# Ogni quanti secondi il messaggio della dashboard viene aggiornato
+DASHBOARD_INTERVAL = int(getenv("DASHBOARD_INTERVAL", "30"))
+# Secondi senza interazioni nella chat dopo i quali l'aggiornamento si ferma
+DASHBOARD_IDLE_TIMEOUT = int(getenv("DASHBOARD_IDLE_TIMEOUT", "600"))
+# Tempo massimo di attesa dello snapshot di un computer a ogni aggiornamento
+DASHBOARD_HOST_TIMEOUT = int(getenv("DASHBOARD_HOST_TIMEOUT", "10"))
+
+# SELEZIONE DEL COMPUTER
+# Numero di computer mostrati per pagina nel menu di selezione
+PICKER_PAGE_SIZE = int(getenv("PICKER_PAGE_SIZE", "8"))
+# Secondi per cui lo stato di un computer (raggiungibile o no) viene riutilizzato senza un nuovo ping
+PICKER_STATUS_MAX_AGE = int(getenv("PICKER_STATUS_MAX_AGE", "60"))
+
+# MOTORE DEGLI ALERT
+# Regole predefinite per metrica: "metrica:soglia/rientro/durata", ad esempio "ram:95/85/60".
+# L'alert scatta quando il valore resta sopra la soglia per almeno "durata" secondi e rientra quando
+# resta sotto il valore di rientro per lo stesso tempo. Ogni computer può sovrascriverle con "alerts"
+# in monitored_computers.json, ad esempio {"alerts": {"cpu": {"trigger": 90, "clear": 75, "sustain": 120}}}
+ALERT_RULES = {}
+for _item in getenv("ALERT_RULES", "ram:95/85/60,cpu:95/85/60").split(","):
+    _name, _, _values = _item.strip().partition(":")
+    if _name and _values:
+        _trigger, _clear, _sustain = (float(v) for v in _values.split("/"))
+        ALERT_RULES[_name] = {"trigger": _trigger, "clear": _clear, "sustain": _sustain}
+# Ogni quanti secondi viene inviato il riepilogo degli alert attivi (0 per disattivarlo)
+ALERT_DIGEST_INTERVAL = int(getenv("ALERT_DIGEST_INTERVAL", "900"))
+
+# RILEVAMENTO DELLE ANOMALIE
+ANOMALY_ENABLED = getenv("ANOMALY_ENABLED", "1") == "1"
+# Ogni quanti secondi viene analizzato lo storico CPU/RAM di tutti i computer
+ANOMALY_INTERVAL = int(getenv("ANOMALY_INTERVAL", "600"))
+# Scostamento dalla mediana, in multipli della deviazione assoluta mediana (MAD), oltre il quale il valore è anomalo
+ANOMALY_THRESHOLD = float(getenv("ANOMALY_THRESHOLD", "4"))
+# Scostamento minimo (punti percentuali) perché un valore sia segnalato, per ignorare variazioni irrilevanti
+ANOMALY_MIN_DELTA = float(getenv("ANOMALY_MIN_DELTA", "15"))
+# Campioni minimi della stessa ora del giorno per usare la base oraria (altrimenti si usa quella dell'intera giornata)
+ANOMALY_MIN_SAMPLES = int(getenv("ANOMALY_MIN_SAMPLES", "6"))
+# Età massima (secondi) dell'ultimo campione perché venga valutato
+ANOMALY_MAX_AGE = int(getenv("ANOMALY_MAX_AGE", "1800"))
+
+# GESTIONE GRAFICI
+# Dimensione massima (byte) di un'immagine inviata a Telegram: oltre viene ridotta la risoluzione
+GRAPH_MAX_BYTES = int(getenv("GRAPH_MAX_BYTES", str(5 * 1024 * 1024)))
+# Lato massimo (pixel) delle immagini: Telegram ridimensiona comunque le foto a 1280 pixel
+GRAPH_MAX_SIDE = int(getenv("GRAPH_MAX_SIDE", "1280"))
+# Formati provati per ogni grafico oltre al PNG a colori pieni, tenendo il più leggero:
+# "png8" (PNG a 256 colori, adatto ai colori piatti), "jpeg" e "webp"
+GRAPH_FORMATS = [f.strip() for f in getenv("GRAPH_FORMATS", "png8,jpeg").split(",") if f.strip()]
+# Qualità (1-95) per JPEG e WebP
+GRAPH_QUALITY = int(getenv("GRAPH_QUALITY", "85"))
+# Ogni quanti grafici misurare i byte risparmiati rispetto al PNG a piena risoluzione (0 = mai):
+# la misura richiede una codifica PNG in più quando l'immagine viene ridimensionata
+GRAPH_BASELINE_SAMPLE = int(getenv("GRAPH_BASELINE_SAMPLE", "10"))
+# Dimensione massima (byte) letta da un file di log remoto
+REMOTE_LOG_MAX_BYTES = int(getenv("REMOTE_LOG_MAX_BYTES", str(1024 * 1024)))
+# Motore di disegno per tipo di grafico ("tipo:motore"): "pillow" è un disegno raster leggero per le torte,
+# "matplotlib" il motore completo. Le serie temporali usano sempre matplotlib; grafici a barre non ce ne sono
+CHART_BACKENDS = {}
+for _item in getenv("CHART_BACKENDS", "pie:pillow").split(","):
+    _name, _, _backend = _item.strip().partition(":")
+    if _name and _backend:
+        CHART_BACKENDS[_name] = _backend
+# Numero massimo di figure matplotlib pre-costruite (una per numero di fette) riutilizzate per i grafici a torta.
+# Servono solo con "pie:matplotlib" (o come ripiego se il disegno con Pillow fallisce): vengono costruite alla
+# prima torta disegnata con matplotlib, quindi con il valore predefinito "pie:pillow" la cache resta vuota
+PIE_TEMPLATE_CACHE_SIZE = int(getenv("PIE_TEMPLATE_CACHE_SIZE", "6"))
+
+# GESTIONE DELLE RISORSE (connessioni SSH e task in background)
+# Numero massimo di connessioni SSH aperte contemporaneamente verso lo stesso computer (monitoraggi compresi)
+LIFECYCLE_MAX_CONNECTIONS_PER_HOST = int(getenv("LIFECYCLE_MAX_CONNECTIONS_PER_HOST", "8"))
+# Ogni quanti secondi si controlla che non ci siano connessioni aperte fuori dal registro (0 per disattivare)
+LIFECYCLE_LEAK_CHECK_INTERVAL = int(getenv("LIFECYCLE_LEAK_CHECK_INTERVAL", "300"))
+# Secondi concessi ai task in background per terminare all'arresto del bot
+LIFECYCLE_SHUTDOWN_TIMEOUT = float(getenv("LIFECYCLE_SHUTDOWN_TIMEOUT", "5"))
+
+# DIAGNOSTICA DEL BOT
+# Attiva il controllo continuo del ritardo del loop asyncio (1 per attivare, 0 per disattivare)
+WATCHDOG_ENABLED = getenv("WATCHDOG_ENABLED", "1") == "1"
+# Ogni quanti secondi il loop segnala di essere attivo
+WATCHDOG_INTERVAL = float(getenv("WATCHDOG_INTERVAL", "0.1"))
+# Ritardo (secondi) oltre il quale il loop è considerato bloccato e viene salvato lo stack del codice bloccante
+WATCHDOG_LAG_THRESHOLD = float(getenv("WATCHDOG_LAG_THRESHOLD", "0.5"))
+# Durata massima (secondi) di un campionamento richiesto con /profilo
+PROFILE_MAX_SECONDS = int(getenv("PROFILE_MAX_SECONDS", "60"))
+# Intervallo (secondi) tra due campioni degli stack durante il campionamento
+PROFILE_SAMPLE_INTERVAL = float(getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# TRACCIAMENTO DELLE RICHIESTE
+# Registra le fasi di ogni richiesta (verifica admin, SSH, elaborazione, risposta) su file JSONL (1 per attivare)
+TRACE_ENABLED = getenv("TRACE_ENABLED", "1") == "1"
+# File delle tracce, una riga JSON per richiesta. Si analizza con: python tools/trace_report.py
+TRACE_FILE = getenv("TRACE_FILE", str(PATH_PRG / "logs/traces.jsonl"))
+# Dimensione massima (byte) del file delle tracce prima della rotazione, e numero di file precedenti conservati
+TRACE_MAX_BYTES = int(getenv("TRACE_MAX_BYTES", str(5 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(getenv("TRACE_BACKUP_COUNT", "3"))
+
+# CODA DEI MESSAGGI IN USCITA
+# Messaggi al secondo inviati al massimo dal bot, in totale (Telegram ne consente circa 30)
+OUTBOX_GLOBAL_RATE = float(getenv("OUTBOX_GLOBAL_RATE", "25"))
+# Messaggi al secondo verso la stessa chat privata, e quanti ne possono partire di fila prima del rallentamento
+OUTBOX_CHAT_RATE = float(getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = int(getenv("OUTBOX_CHAT_BURST", "3"))
+# Messaggi al minuto verso lo stesso gruppo (Telegram ne consente circa 20)
+OUTBOX_GROUP_RATE_PER_MIN = float(getenv("OUTBOX_GROUP_RATE_PER_MIN", "20"))
+# Tentativi ripetuti dopo un errore di flood control (RetryAfter) prima di rinunciare all'invio
+OUTBOX_MAX_RETRIES = int(getenv("OUTBOX_MAX_RETRIES", "3"))
+
+# STATO PERSISTENTE
+# Salva su disco selezioni, monitoraggi, dashboard, stato dei computer e cache, per riprenderli dopo un riavvio (1 per attivare)
+STATE_ENABLED = getenv("STATE_ENABLED", "1") == "1"
+# Database SQLite dello stato
+STATE_DB = getenv("STATE_DB", str(PATH_PRG / "bot_state.db"))
+# Ogni quanti secondi le modifiche accumulate in memoria vengono scritte sul database, in un'unica transazione
+STATE_FLUSH_INTERVAL = float(getenv("STATE_FLUSH_INTERVAL", "2"))
+# Al riavvio riavvia i monitoraggi che erano attivi (1) oppure li dimentica (0)
+STATE_RESTORE_MONITORS = getenv("STATE_RESTORE_MONITORS", "1") == "1"
+
+# CADENZA DEI MONITORAGGI
+# Intervallo minimo e massimo (secondi) tra due controlli degli script di monitoraggio: "tipo:minimo/massimo".
+# Lo script controlla di rado finché il valore resta lontano dalla soglia, sempre più spesso avvicinandosi
+# e al minimo durante un incidente. Ogni computer può sovrascriverli con "monitor" in monitored_computers.json,
+# ad esempio {"monitor": {"cpu": {"min_interval": 2, "max_interval": 30}}}
+MONITOR_INTERVALS = {}
+for _item in getenv("MONITOR_INTERVALS", "ram:5/60,cpu:5/60").split(","):
+    _name, _, _values = _item.strip().partition(":")
+    if _name and _values:
+        _min_interval, _max_interval = (int(v) for v in _values.split("/"))
+        MONITOR_INTERVALS[_name] = {"min_interval": _min_interval, "max_interval": _max_interval}
@@ -0,0 +1,216 @@
+import time
+import html
+from asyncio.log import logger
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from telegram.ext import Application, ContextTypes
+from config.config import MONITORED_COMPUTERS, ALERT_RULES, ALERT_DIGEST_INTERVAL
+from .utils import find_computer_by_name, format_age
+from .outbox import SEND_ALERT, SEND_REFRESH
+
+# Marcatore della riga con il valore misurato, emessa dagli script di monitoraggio a ogni controllo:
+# "===SAMPLE=== <metrica> <valore>"
+SAMPLE_MARKER = "===SAMPLE==="
+
+# Stati di un incidente
+STATE_OK = "ok"
+STATE_PENDING = "pending"      # sopra soglia, in attesa che la condizione duri abbastanza
+STATE_FIRING = "firing"        # alert attivo (notificato)
+STATE_RESOLVING = "resolving"  # sotto il valore di rientro, in attesa che la condizione duri abbastanza
+
+# Regola di allerta di una metrica su un computer
+@dataclass
+class AlertRule:
+    trigger: float
+    clear: float
+    sustain: float
+
+# Stato di una metrica di un computer e dell'eventuale incidente in corso
+@dataclass
+class Incident:
+    host: str
+    metric: str
+    state: str = STATE_OK
+    since: float = 0.0           # inizio della condizione corrente (sopra soglia o in rientro)
+    started: float = 0.0         # inizio dell'incidente notificato
+    value: float = 0.0
+    peak: float = 0.0
+    details: str = ""            # ultimo dettaglio ricevuto (es. tabella dei processi)
+
+# Cambio di stato da notificare: "firing" o "resolved"
+@dataclass
+class AlertEvent:
+    kind: str
+    incident: Incident
+    rule: AlertRule
+    duration: float = 0.0
+
+# Restituisce la regola per la metrica del computer: quella predefinita, eventualmente sovrascritta
+# dalla sezione "alerts" del computer in monitored_computers.json
+def get_alert_rule(host: str, metric: str) -> Optional[AlertRule]:
+    values = dict(ALERT_RULES.get(metric, {}))
+    computer = find_computer_by_name(MONITORED_COMPUTERS, host)
+    if computer:
+        values.update(computer.get("alerts", {}).get(metric, {}))
+    if "trigger" not in values:
+        return None
+    return AlertRule(float(values["trigger"]), float(values.get("clear", values["trigger"])), float(values.get("sustain", 0)))
+
+# Motore degli alert: riceve i campioni di tutti i computer e segnala solo i cambi di stato degli incidenti.
+# L'isteresi (soglia di attivazione e di rientro distinte) e la durata minima evitano notifiche ripetute
+# per valori che oscillano attorno alla soglia.
+# I campioni arrivano solo dagli script di monitoraggio, non dagli snapshot di snapshot.HOST_SNAPSHOTS:
+# gli iscritti esistono solo finché il loro monitoraggio è attivo, che campiona già ogni pochi secondi,
+# mentre gli snapshot arrivano con gli intervalli di PRECOLLECT_TARGETS (minuti) e misurano la CPU senza
+# contare l'attesa di I/O, a differenza di cpu_monitor.sh: mescolarli altererebbe la durata minima e le soglie
+class AlertEngine:
+    def __init__(self):
+        self.incidents: Dict[Tuple[str, str], Incident] = {}
+        # Chat iscritte agli alert di ogni metrica di ogni computer: {(host, metrica): {user_id: chat_id}}
+        self.subscribers: Dict[Tuple[str, str], Dict[int, int]] = {}
+        # Cambi di stato avvenuti dall'ultimo riepilogo
+        self.transitions_since_digest: List[AlertEvent] = []
+
+    def subscribe(self, host: str, metric: str, user_id: int, chat_id: int):
+        self.subscribers.setdefault((host, metric), {})[user_id] = chat_id
+
+    def unsubscribe(self, host: str, metric: str, user_id: int):
+        subscribers = self.subscribers.get((host, metric), {})
+        subscribers.pop(user_id, None)
+        # Senza iscritti lo stato della metrica non serve più
+        if not subscribers:
+            self.subscribers.pop((host, metric), None)
+            self.incidents.pop((host, metric), None)
+
+    # Chat a cui notificare gli alert della metrica del computer
+    def chats_for(self, host: str, metric: str) -> List[int]:
+        return sorted(set(self.subscribers.get((host, metric), {}).values()))
+
+    # Registra un campione e restituisce l'evento da notificare, se lo stato dell'incidente è cambiato
+    def observe(self, host: str, metric: str, value: float, details: str = "", now: Optional[float] = None) -> Optional[AlertEvent]:
+        rule = get_alert_rule(host, metric)
+        if rule is None:
+            return None
+        now = time.time() if now is None else now
+        incident = self.incidents.setdefault((host, metric), Incident(host, metric))
+        incident.value = value
+        if details:
+            incident.details = details
+
+        if incident.state in (STATE_OK, STATE_PENDING):
+            if value < rule.trigger:
+                incident.state = STATE_OK
+                return None
+            if incident.state == STATE_OK:
+                incident.state, incident.since, incident.peak = STATE_PENDING, now, value
+            incident.peak = max(incident.peak, value)
+            if now - incident.since >= rule.sustain:
+                incident.state, incident.started = STATE_FIRING, incident.since
+                return self._record(AlertEvent("firing", incident, rule, now - incident.started))
+            return None
+
+        # Incidente attivo: si chiude solo dopo essere rimasto sotto il valore di rientro abbastanza a lungo
+        incident.peak = max(incident.peak, value)
+        if value > rule.clear:
+            incident.state = STATE_FIRING
+            return None
+        if incident.state == STATE_FIRING:
+            incident.state, incident.since = STATE_RESOLVING, now
+        if now - incident.since >= rule.sustain:
+            event = AlertEvent("resolved", incident, rule, now - incident.started)
+            self.incidents[(host, metric)] = Incident(host, metric)
+            return self._record(event)
+        return None
+
+    def _record(self, event: AlertEvent) -> AlertEvent:
+        self.transitions_since_digest.append(event)
+        return event
+
+    # Incidenti attualmente attivi (notificati e non ancora rientrati)
+    def active_incidents(self) -> List[Incident]:
+        return [i for i in self.incidents.values() if i.state in (STATE_FIRING, STATE_RESOLVING)]
+
+# Istanza condivisa da tutti i monitoraggi
+ALERT_ENGINE = AlertEngine()
+
+# Converte una riga "===SAMPLE=== metrica valore" in (metrica, valore); None se la riga non è un campione
+def parse_sample_line(line: str) -> Optional[Tuple[str, float]]:
+    parts = line.split()
+    if len(parts) < 3 or parts[0] != SAMPLE_MARKER:
+        return None
+    try:
+        return parts[1], float(parts[2])
+    except ValueError:
+        return None
+
+# Testo della notifica di un cambio di stato
+def render_alert_event(event: AlertEvent) -> str:
+    incident, rule = event.incident, event.rule
+    metric = incident.metric.upper()
+    if event.kind == "firing":
+        text = (
+            f"🚨 <b>[{html.escape(incident.host)}] {metric} al {incident.value:.0f}%</b>\n"
+            f"Sopra la soglia del {rule.trigger:.0f}% da {format_age(event.duration)}"
+        )
+        if incident.details:
+            text += f"\n<pre>{html.escape(incident.details)}</pre>"
+        return text
+    return (
+        f"✅ <b>[{html.escape(incident.host)}] {metric} rientrata al {incident.value:.0f}%</b>\n"
+        f"Durata {format_age(event.duration)}, picco {incident.peak:.0f}%"
+    )
+
+# Invia la notifica del cambio di stato a tutte le chat iscritte (una sola volta per chat)
+async def notify_alert_event(bot, event: AlertEvent):
+    text = render_alert_event(event)
+    for chat_id in ALERT_ENGINE.chats_for(event.incident.host, event.incident.metric):
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", rate_limit_args=SEND_ALERT)
+        except Exception as e:
+            logger.warning(f"Invio alert a {chat_id} non riuscito: {e}")
+
+# Testo del riepilogo periodico per una chat (None se non c'è nulla da segnalare)
+def render_digest(chat_id: int) -> Optional[str]:
+    def subscribed(incident: Incident) -> bool:
+        return chat_id in ALERT_ENGINE.chats_for(incident.host, incident.metric)
+
+    now = time.time()
+    active = [i for i in ALERT_ENGINE.active_incidents() if subscribed(i)]
+    transitions = [e for e in ALERT_ENGINE.transitions_since_digest if subscribed(e.incident)]
+    if not active and not transitions:
+        return None
+
+    lines = ["📋 <b>Riepilogo alert</b>"]
+    if active:
+        lines.append(f"\n🔥 Attivi ({len(active)}):")
+        for incident in sorted(active, key=lambda i: i.started):
+            lines.append(
+                f"• {html.escape(incident.host)} {incident.metric.upper()}: {incident.value:.0f}% "
+                f"(picco {incident.peak:.0f}%, da {format_age(now - incident.started)})"
+            )
+    fired = sum(1 for e in transitions if e.kind == "firing")
+    resolved = sum(1 for e in transitions if e.kind == "resolved")
+    lines.append(f"\nDall'ultimo riepilogo: {fired} nuovi, {resolved} rientrati")
+    return "\n".join(lines)
+
+# Job periodico: invia il riepilogo degli alert a ogni chat iscritta
+async def alert_digest(context: ContextTypes.DEFAULT_TYPE):
+    chats = {chat_id for subscribers in ALERT_ENGINE.subscribers.values() for chat_id in subscribers.values()}
+    for chat_id in sorted(chats):
+        text = render_digest(chat_id)
+        if text:
+            try:
+                await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", disable_notification=True,
+                                               rate_limit_args=SEND_REFRESH)
+            except Exception as e:
+                logger.warning(f"Invio riepilogo alert a {chat_id} non riuscito: {e}")
+    ALERT_ENGINE.transitions_since_digest.clear()
+
+# Registra il job del riepilogo sulla job queue dell'applicazione
+def start_alert_digest(app: Application):
+    if ALERT_DIGEST_INTERVAL <= 0:
+        return
+    if app.job_queue is None:
+        logger.warning("JobQueue non disponibile: il riepilogo degli alert è disattivato.")
+        return
+    app.job_queue.run_repeating(alert_digest, interval=ALERT_DIGEST_INTERVAL, first=ALERT_DIGEST_INTERVAL, name="alert_digest")
@@ -0,0 +1,153 @@
+import time
+import datetime
+from asyncio.log import logger
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from telegram.ext import Application, ContextTypes
+from config.config import (
+    ANOMALY_ENABLED, ANOMALY_INTERVAL, ANOMALY_THRESHOLD, ANOMALY_MIN_DELTA, ANOMALY_MIN_SAMPLES, ANOMALY_MAX_AGE
+)
+from .history import METRIC_HISTORY
+from .utils import LIST_OF_ADMINS
+from .outbox import SEND_ALERT
+
+# Metriche analizzate (serie dello storico in percentuale)
+ANOMALY_METRICS = ("cpu", "ram")
+
+# Fattore che rende la MAD confrontabile con la deviazione standard di una distribuzione normale
+MAD_SCALE = 1.4826
+# Dispersione minima (punti percentuali): evita punteggi enormi su serie quasi costanti
+MIN_SPREAD = 1.0
+
+# Valore anomalo rilevato sull'ultimo campione di una metrica di un computer
+@dataclass
+class Anomaly:
+    host: str
+    metric: str
+    timestamp: datetime.datetime
+    value: float
+    baseline: float      # mediana di riferimento
+    spread: float        # MAD scalata di riferimento
+    score: float         # scostamento in multipli di spread
+    hourly: bool         # True se la base è quella della stessa ora del giorno
+
+# Anomalie attualmente in corso: {(host, metrica): Anomaly}
+ACTIVE_ANOMALIES: Dict[Tuple[str, str], Anomaly] = {}
+
+# Mediana di values per ciascun gruppo (0..n_groups-1), calcolata su tutti i gruppi in un'unica passata:
+# ordina per (gruppo, valore) e legge gli elementi centrali di ogni gruppo.
+# Restituisce le mediane (NaN per i gruppi vuoti) e il numero di elementi di ogni gruppo
+def group_median(groups: np.ndarray, values: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = np.full(n_groups, np.nan)
+    present = counts > 0
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    medians[present] = (sorted_values[low] + sorted_values[high]) / 2
+    return medians, counts
+
+# Mediana e MAD scalata per gruppo
+def group_baseline(groups: np.ndarray, values: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    medians, counts = group_median(groups, values, n_groups)
+    mad, _ = group_median(groups, np.abs(values - medians[groups]), n_groups)
+    return medians, np.maximum(mad * MAD_SCALE, MIN_SPREAD), counts
+
+# Valuta l'ultimo campione di ogni computer per la metrica, in un'unica passata vettoriale su tutta la flotta.
+# La base di ogni computer è la mediana/MAD dei campioni precedenti della stessa ora del giorno;
+# se sono troppo pochi si usa quella di tutti i campioni precedenti del computer
+def detect_anomalies(series: Dict[str, List[Tuple[datetime.datetime, float]]], metric: str,
+                     now: Optional[datetime.datetime] = None) -> Dict[str, Anomaly]:
+    now = now or datetime.datetime.now()
+    hosts = [
+        host for host, points in series.items()
+        if len(points) > ANOMALY_MIN_SAMPLES and (now - points[-1][0]).total_seconds() <= ANOMALY_MAX_AGE
+    ]
+    if not hosts:
+        return {}
+
+    # Storico (escluso l'ultimo campione) di tutti i computer concatenato in array piatti
+    host_idx = np.concatenate([np.full(len(series[h]) - 1, i) for i, h in enumerate(hosts)])
+    hours = np.array([ts.hour for h in hosts for ts, _ in series[h][:-1]])
+    values = np.array([v for h in hosts for _, v in series[h][:-1]], dtype=float)
+    # Ultimo campione di ogni computer
+    latest_ts = [series[h][-1][0] for h in hosts]
+    latest = np.array([series[h][-1][1] for h in hosts], dtype=float)
+    latest_hour = np.array([ts.hour for ts in latest_ts])
+
+    n_hosts = len(hosts)
+    hourly_median, hourly_spread, hourly_count = group_baseline(host_idx * 24 + hours, values, n_hosts * 24)
+    daily_median, daily_spread, _ = group_baseline(host_idx, values, n_hosts)
+
+    # Sceglie per ogni computer la base oraria, se ha abbastanza campioni
+    slot = np.arange(n_hosts) * 24 + latest_hour
+    hourly = hourly_count[slot] >= ANOMALY_MIN_SAMPLES
+    baseline = np.where(hourly, hourly_median[slot], daily_median)
+    spread = np.where(hourly, hourly_spread[slot], daily_spread)
+    scores = (latest - baseline) / spread
+    # Sono anomali solo i valori molto più alti del solito (un computer più scarico del solito non è un problema)
+    flagged = (scores >= ANOMALY_THRESHOLD) & (latest - baseline >= ANOMALY_MIN_DELTA)
+
+    return {
+        hosts[i]: Anomaly(hosts[i], metric, latest_ts[i], float(latest[i]), float(baseline[i]),
+                          float(spread[i]), float(scores[i]), bool(hourly[i]))
+        for i in np.flatnonzero(flagged)
+    }
+
+# Analizza lo storico di tutti i computer e aggiorna le anomalie in corso.
+# Restituisce le nuove anomalie e quelle rientrate dall'ultima analisi
+def evaluate_fleet() -> Tuple[List[Anomaly], List[Anomaly]]:
+    started, ended = [], []
+    for metric in ANOMALY_METRICS:
+        series = {
+            host: metrics[metric]["points"]
+            for host, metrics in METRIC_HISTORY.items()
+            if metrics.get(metric, {}).get("points")
+        }
+        found = detect_anomalies(series, metric)
+        for host, anomaly in found.items():
+            if (host, metric) not in ACTIVE_ANOMALIES:
+                started.append(anomaly)
+            ACTIVE_ANOMALIES[(host, metric)] = anomaly
+        # Un'anomalia rientra quando l'ultimo campione non è più anomalo (o non è più recente)
+        for key in [key for key in ACTIVE_ANOMALIES if key[1] == metric and key[0] not in found]:
+            ended.append(ACTIVE_ANOMALIES.pop(key))
+    return started, ended
+
+# Descrizione breve dell'anomalia in corso per la metrica del computer (None se assente)
+def describe_anomaly(host: str, metric: str) -> Optional[str]:
+    anomaly = ACTIVE_ANOMALIES.get((host, metric))
+    if anomaly is None:
+        return None
+    reference = f"alle {anomaly.timestamp.hour:02d}" if anomaly.hourly else "nella giornata"
+    return (
+        f"{metric.upper()} anomala: {anomaly.value:.0f}% contro una mediana di {anomaly.baseline:.0f}% "
+        f"{reference} ({anomaly.score:.1f}× lo scostamento tipico)"
+    )
+
+# Job periodico: analizza la flotta e avvisa gli amministratori delle anomalie nuove e rientrate
+async def anomaly_tick(context: ContextTypes.DEFAULT_TYPE):
+    start = time.perf_counter()
+    started, ended = evaluate_fleet()
+    logger.debug(f"Analisi anomalie completata in {(time.perf_counter() - start) * 1000:.1f} ms")
+    lines = [f"⚠️ [{a.host}] {describe_anomaly(a.host, a.metric)}" for a in started]
+    lines += [f"✅ [{a.host}] {a.metric.upper()} tornata nella norma" for a in ended]
+    if not lines:
+        return
+    for admin_id in LIST_OF_ADMINS:
+        try:
+            await context.bot.send_message(chat_id=admin_id, text="\n".join(lines), rate_limit_args=SEND_ALERT)
+        except Exception as e:
+            logger.warning(f"Invio anomalie a {admin_id} non riuscito: {e}")
+
+# Registra il job di analisi delle anomalie sulla job queue dell'applicazione
+def start_anomaly_detection(app: Application):
+    if not ANOMALY_ENABLED:
+        return
+    if app.job_queue is None:
+        logger.warning("JobQueue non disponibile: il rilevamento delle anomalie è disattivato.")
+        return
+    app.job_queue.run_repeating(anomaly_tick, interval=ANOMALY_INTERVAL, first=ANOMALY_INTERVAL, name="anomaly_detection")
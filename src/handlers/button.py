@@ -1,13 +1,19 @@
 import asyncio
 from asyncio.log import logger
-from .utils import check_admin, execute_bash_command, is_host_reachable, find_computer_by_name
+from .utils import check_admin, execute_bash_command, probe_host, find_computer_by_name
 from .commands import get_menu_keyboard
 from .monitor import *
 from .graphs import *
 from .sections import *
+from .procstats import send_proc_stats, PROC_STAT_VIEWS
+from .snapshot import send_resources
+from .dashboard import dashboard_navigation
+from .picker import picker_navigation
+from .journal import open_journal, journal_navigation, search_navigation, JOURNAL_PRESETS
 from telegram import InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 from config.config import MONITORED_COMPUTERS
+from .state import STATE, NS_SELECTION
 
 # Gestisce le callback dei bottoni inline nel bot Telegram.
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -43,8 +49,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.answer("❗ Computer non trovato.", show_alert=True)
             return
         
-        # Verifica se il computer è raggiungibile 
-        is_online = await is_host_reachable(computer["ip"])
+        # Verifica se il computer è raggiungibile (subito falso se è noto come irraggiungibile)
+        is_online = await probe_host(computer)
         if not is_online:
             try:
                 await query.edit_message_text(f"❌ Il computer <b>{selected}</b> non è raggiungibile.", parse_mode="HTML")
@@ -58,6 +64,9 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data = {}
             
         context.user_data["selected_computer"] = selected
+        # La selezione viene salvata per essere ripristinata dopo un riavvio del bot
+        if update.effective_user:
+            STATE.put(NS_SELECTION, update.effective_user.id, selected)
 
         try:
             await query.edit_message_text(
@@ -72,6 +81,20 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Salva il valore della callback
     data = query.data
 
+    # Gestione aggiornamento forzato di un dato pre-raccolto in background
+    if data.startswith("refresh:"):
+        target = data.split(":", 1)[1]
+        if target == "CPU_graph":
+            await send_cpu_graph(update, context, force=True)
+        elif target in PROC_STAT_VIEWS:
+            await send_proc_stats(update, context, target, force=True)
+        elif target == "resources":
+            await send_resources(update, context, force=True)
+        else:
+            await execute_bash_command(update, target, is_callback=True, context=context, force=True)
+        await asyncio.sleep(1)
+        return
+
     # Gestione callback grafici
     if data in graphs_handlers:
         print(data)
@@ -84,6 +107,37 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_alert(update, context, action, monitor_type)
         return
 
+    # Gestione iostat/vmstat calcolati dagli snapshot /proc
+    if data in PROC_STAT_VIEWS:
+        await send_proc_stats(update, context, data)
+        return
+
+    # Gestione vista risorse calcolata dagli snapshot del computer
+    if data == "resources":
+        await send_resources(update, context)
+        return
+
+    # Gestione visualizzatore journal (pulsanti Log / Log Sudo e navigazione tra le pagine)
+    if data in JOURNAL_PRESETS:
+        await open_journal(update, context, dict(JOURNAL_PRESETS[data]))
+        return
+    if data.startswith("journal:"):
+        await journal_navigation(update, context, data.split(":", 1)[1])
+        return
+    if data.startswith("search:"):
+        await search_navigation(update, context, data.split(":", 1)[1])
+        return
+
+    # Gestione pagine, tag e filtri del selettore dei computer
+    if data.startswith("picker:"):
+        await picker_navigation(update, context, data.split(":", 1)[1])
+        return
+
+    # Gestione pulsanti della dashboard
+    if data.startswith("dashboard:"):
+        await dashboard_navigation(update, context, data.split(":", 1)[1])
+        return
+
     # Gestione sezioni
     if data in section_handlers:
         await section_handlers[data](update, context)
@@ -122,6 +176,8 @@ graphs_handlers = {
     "CPU_graph": send_cpu_graph,
     "RAM_graph": send_ram_graph,
     "LOG_graph": send_log_graph,
+    "COMPARE_graph": send_compare_graph,
+    "COMPARE_grid": send_compare_grid_graph,
 }
 
 # Dispatcher per sezioni
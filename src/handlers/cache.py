@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from config.config import COMMAND_CACHE_TTL, COMMAND_CACHE_MAX_ENTRIES
+from .state import STATE, NS_CACHE, pair_key
+
+# Cache LRU dei risultati dei comandi remoti, con scadenza (TTL) configurata per comando
+class ResultCache:
+    def __init__(self, ttls: Dict[str, int], max_entries: int):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        # {(computer_name, comando): (output, timestamp)} ordinato dal meno al più recentemente usato
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+
+    # Indica se il comando ha un TTL configurato e quindi può essere messo in cache
+    def is_cacheable(self, command: str) -> bool:
+        return self.ttls.get(command, 0) > 0
+
+    # Restituisce (output, timestamp) se il risultato è presente e non scaduto
+    def get(self, computer_name: str, command: str) -> Optional[Tuple[str, float]]:
+        key = (computer_name, command)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > self.ttls.get(command, 0):
+            del self.entries[key]
+            STATE.delete(NS_CACHE, pair_key(*key))
+            return None
+        # Sposta la voce in fondo: è la più recentemente usata
+        self.entries.move_to_end(key)
+        return entry
+
+    # Salva il risultato, eliminando le voci meno usate oltre il limite di dimensione
+    def put(self, computer_name: str, command: str, output: str):
+        if not self.is_cacheable(command):
+            return
+        now = time.time()
+        self.restore(computer_name, command, output, now)
+        STATE.put(NS_CACHE, pair_key(computer_name, command), {"output": output, "ts": now})
+
+    # Inserisce un risultato con il suo timestamp originale (usato anche per ricaricare la cache salvata)
+    def restore(self, computer_name: str, command: str, output: str, timestamp: float):
+        key = (computer_name, command)
+        self.entries[key] = (output, timestamp)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            STATE.delete(NS_CACHE, pair_key(*evicted))
+
+    # Elimina il risultato di un singolo comando
+    def invalidate(self, computer_name: str, command: str):
+        self.entries.pop((computer_name, command), None)
+        STATE.delete(NS_CACHE, pair_key(computer_name, command))
+
+    # Elimina tutti i risultati di un computer (es. dopo un comando che lo modifica)
+    def invalidate_host(self, computer_name: str):
+        for key in [key for key in self.entries if key[0] == computer_name]:
+            del self.entries[key]
+            STATE.delete(NS_CACHE, pair_key(*key))
+
+# Istanza condivisa usata da execute_bash_command
+COMMAND_CACHE = ResultCache(COMMAND_CACHE_TTL, COMMAND_CACHE_MAX_ENTRIES)
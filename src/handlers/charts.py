@@ -0,0 +1,439 @@
+import io
+import math
+import time
+import html
+import asyncio
+import threading
+import itertools
+from asyncio.log import logger
+from collections import Counter, deque, OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+import matplotlib.pyplot as plt
+import matplotlib.patheffects as path_effects
+from matplotlib import font_manager
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from config.config import (
+    GRAPH_MAX_BYTES, GRAPH_MAX_SIDE, GRAPH_FORMATS, GRAPH_QUALITY, GRAPH_BASELINE_SAMPLE, CHART_BACKENDS, PIE_TEMPLATE_CACHE_SIZE
+)
+from .tracing import span, spanned
+
+# Pillow è già una dipendenza di matplotlib, ma se manca si usa sempre matplotlib
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+# Tentativi di riduzione della risoluzione per rientrare in GRAPH_MAX_BYTES
+MAX_SHRINK_ATTEMPTS = 3
+
+# Colore di sfondo comune a tutti i grafici
+BACKGROUND = "#f9f9f9"
+
+# Grafico a torta: dati, colori, titolo e legenda
+@dataclass
+class PieChart:
+    sizes: List[float]
+    labels: List[str]
+    colors: List[str]
+    explode: List[float]
+    title: str
+    legend_labels: List[str]
+    legend_title: str
+    kind: str = "pie"
+
+# Risultato della codifica di un grafico, per misurare byte risparmiati e tempo impiegato
+@dataclass
+class EncodingStats:
+    label: str
+    format: str
+    size: Tuple[int, int]
+    bytes: int
+    # PNG a colori pieni con compressione predefinita dell'immagine ricevuta, come veniva inviata prima
+    # (None se non misurato, vedi GRAPH_BASELINE_SAMPLE)
+    baseline_bytes: Optional[int]
+    encode_ms: float
+
+    @property
+    def saved_bytes(self) -> Optional[int]:
+        if self.baseline_bytes is None:
+            return None
+        return self.baseline_bytes - self.bytes
+
+# Ultime codifiche eseguite
+ENCODING_STATS: Deque[EncodingStats] = deque(maxlen=100)
+# Numero progressivo dei grafici codificati, per misurare il riferimento solo su uno ogni GRAPH_BASELINE_SAMPLE
+ENCODED_COUNTER = itertools.count()
+
+# Estensione del file inviato per ogni formato (Telegram riconosce il tipo dal nome)
+FORMAT_EXTENSIONS = {"png": "png", "png8": "png", "jpeg": "jpg", "webp": "webp"}
+
+# Codifica l'immagine nel formato indicato
+def _encode(image, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "png":
+        image.save(buf, format="PNG")
+    elif fmt == "png8":
+        # 256 colori bastano per grafici a colori piatti; FASTOCTREE è il metodo di riduzione più veloce
+        image.quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(buf, format="PNG")
+    elif fmt == "jpeg":
+        image.save(buf, format="JPEG", quality=GRAPH_QUALITY)
+    elif fmt == "webp":
+        image.save(buf, format="WEBP", quality=GRAPH_QUALITY)
+    else:
+        raise ValueError(f"formato immagine sconosciuto: {fmt}")
+    return buf.getvalue()
+
+# Fase di codifica comune a tutti i grafici: ridimensiona l'immagine per lo schermo di un telefono
+# (lato massimo GRAPH_MAX_SIDE), la codifica nei formati di GRAPH_FORMATS e tiene il più leggero.
+# Se supera comunque GRAPH_MAX_BYTES viene ridotta ancora. Registra byte risparmiati e tempo in ENCODING_STATS.
+# La funzione è bloccante (più codifiche di prova): dal loop va chiamata con encode_chart_async
+@spanned("encode")
+def encode_chart(image, label: str) -> io.BytesIO:
+    start = time.perf_counter()
+    image = image.convert("RGB")
+    original_size = image.size
+    # Riferimento per i byte risparmiati: il PNG che veniva inviato prima di questa fase.
+    # Se l'immagine non viene ridimensionata coincide con il primo PNG provato e non costa nulla;
+    # altrimenti richiede una codifica a piena risoluzione in più e viene misurato solo a campione
+    sampled = GRAPH_BASELINE_SAMPLE > 0 and next(ENCODED_COUNTER) % GRAPH_BASELINE_SAMPLE == 0
+    baseline = None
+    if sampled and max(original_size) > GRAPH_MAX_SIDE:
+        baseline = len(_encode(image, "png"))
+    image.thumbnail((GRAPH_MAX_SIDE, GRAPH_MAX_SIDE))
+    formats = GRAPH_FORMATS or ["png"]
+    for attempt in range(MAX_SHRINK_ATTEMPTS + 1):
+        png = _encode(image, "png")
+        if attempt == 0 and image.size == original_size:
+            baseline = len(png)
+        best_fmt, best = "png", png
+        for fmt in formats:
+            if fmt != "png":
+                data = _encode(image, fmt)
+                if len(data) < len(best):
+                    best_fmt, best = fmt, data
+        if len(best) <= GRAPH_MAX_BYTES:
+            break
+        # I byte crescono circa con l'area, cioè con il quadrato del lato
+        scale = 0.9 * (GRAPH_MAX_BYTES / len(best)) ** 0.5
+        image = image.resize((max(int(image.width * scale), 1), max(int(image.height * scale), 1)), Image.LANCZOS)
+    else:
+        raise ValueError(f"immagine troppo grande ({len(best)} byte, massimo {GRAPH_MAX_BYTES})")
+
+    stats = EncodingStats(label, best_fmt, image.size, len(best), baseline, (time.perf_counter() - start) * 1000)
+    ENCODING_STATS.append(stats)
+    saved = f" ({stats.saved_bytes} risparmiati rispetto al PNG)" if stats.saved_bytes is not None else ""
+    logger.info(
+        f"Grafico '{label}': {best_fmt} {image.width}x{image.height}, {stats.bytes} byte{saved}, "
+        f"codifica in {stats.encode_ms:.1f} ms"
+    )
+    buf = io.BytesIO(best)
+    buf.name = f"grafico.{FORMAT_EXTENSIONS[best_fmt]}"
+    return buf
+
+# Esegue encode_chart in un thread, così le codifiche di prova non bloccano il loop.
+# Senza Pillow il buffer ricevuto (già un PNG) viene restituito così com'è
+async def encode_chart_async(image, label: str) -> io.BytesIO:
+    if isinstance(image, io.BytesIO):
+        return image
+    return await asyncio.to_thread(encode_chart, image, label)
+
+# Disegna la figura e restituisce i pixel come immagine Pillow, da passare a encode_chart, e chiude la figura.
+# La risoluzione viene scelta perché il lato più lungo rientri in GRAPH_MAX_SIDE.
+# Senza Pillow restituisce direttamente il PNG (compressione predefinita), già pronto per reply_photo.
+# Con close=False la figura resta aperta per essere riutilizzata
+def figure_to_image(fig: Figure, label: str = "grafico", close: bool = True, **savefig_kwargs):
+    savefig_kwargs.setdefault("facecolor", fig.get_facecolor())
+    savefig_kwargs.setdefault("dpi", min(fig.get_dpi(), GRAPH_MAX_SIDE / max(fig.get_size_inches())))
+    # Con Pillow il PNG serve solo a passare i pixel: compressione minima
+    if Image is not None:
+        savefig_kwargs.setdefault("pil_kwargs", {"compress_level": 0})
+    try:
+        buf = io.BytesIO()
+        with span("render.savefig", chart=label):
+            fig.savefig(buf, format="png", **savefig_kwargs)
+    finally:
+        if close:
+            plt.close(fig)
+    buf.seek(0)
+    if Image is None:
+        return buf
+    image = Image.open(buf)
+    image.load()
+    return image
+
+# Converte la figura in un'immagine in memoria, pronta per reply_photo, e chiude la figura.
+# Il disegno avviene nel loop (pyplot non è thread-safe), la codifica in un thread
+async def figure_to_buffer(fig: Figure, label: str = "grafico", **savefig_kwargs) -> io.BytesIO:
+    return await encode_chart_async(figure_to_image(fig, label, **savefig_kwargs), label)
+
+# Nome del grafico nei log: la prima riga del titolo
+def _chart_label(chart) -> str:
+    return chart.title.split("\n", 1)[0]
+
+#########################         MOTORE MATPLOTLIB         #########################
+
+# Applica lo stile comune ai grafici a torta: testo delle percentuali, bordi, titolo e legenda
+def _pie_style(fig, wedges, autotexts, title, legend_labels, legend_title, legend_anchor=(1, 0.5)):
+    # Imposta il colore di sfondo della figura
+    fig.set_facecolor(BACKGROUND)
+    # Personalizza il testo percentuale sulle fette della torta
+    for autotext in autotexts:
+        autotext.set_color('white')
+        autotext.set_fontsize(13)
+        autotext.set_fontweight('bold')
+        autotext.set_path_effects([
+            path_effects.Stroke(linewidth=2, foreground='black'),
+            path_effects.Normal()
+        ])
+    # Personalizza i bordi delle fette della torta
+    for w in wedges:
+        w.set_linewidth(1.5)
+        w.set_edgecolor('black')
+    # Imposta il titolo del grafico
+    fig.suptitle(title, fontsize=17, fontweight='bold', color="#222222")
+    # Aggiunge la legenda a sinistra del grafico
+    fig.legend(
+        wedges,
+        legend_labels,
+        title=legend_title,
+        loc="center left",
+        bbox_to_anchor=legend_anchor,
+        fontsize=13,
+        title_fontsize=14,
+        frameon=False
+    )
+    return fig
+
+# Figura di una torta già costruita e con lo stile applicato, per un numero fisso di fette.
+# A ogni disegno vengono aggiornati solo angoli, colori, testi, titolo e legenda.
+# La disposizione è fissa (torta a sinistra, legenda a destra dentro la figura): non serve bbox_inches='tight',
+# che ridisegna la figura una volta in più per misurarla.
+# Riguarda solo il motore matplotlib: la torta Pillow non ha una parte fissa costosa da preparare
+# (disegna direttamente le forme e i font sono già in _FONTS), quindi viene disegnata ogni volta da zero
+class PieTemplate:
+    def __init__(self, n_wedges: int):
+        # Figura non registrata in pyplot, con una propria tela Agg: resta in memoria finché il template è nella cache
+        self.fig = Figure(figsize=(12, 7), dpi=min(100, GRAPH_MAX_SIDE / 12))
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax = self.fig.add_axes((0.02, 0.02, 0.62, 0.84))
+        self.wedges, self.texts, self.autotexts = ax.pie(
+            [1] * n_wedges,
+            labels=[""] * n_wedges,
+            autopct='%1.1f%%',
+            startangle=90,
+            pctdistance=0.82,
+            wedgeprops={'edgecolor': 'black', 'linewidth': 1.5}
+        )
+        _pie_style(self.fig, self.wedges, self.autotexts, "", [""] * n_wedges, "", legend_anchor=(0.7, 0.5))
+        self.legend = self.fig.legends[-1]
+        # legend_handles dalla versione 3.7 di matplotlib, legendHandles nelle precedenti
+        self.legend_handles = getattr(self.legend, "legend_handles", None) or self.legend.legendHandles
+
+    # Posiziona fette e testi come farebbe ax.pie con startangle=90, etichette a 1.1 e percentuali a 0.82 del raggio
+    def update(self, chart: PieChart):
+        if any(size < 0 for size in chart.sizes):
+            raise ValueError("i valori della torta non possono essere negativi")
+        total = float(sum(chart.sizes))
+        theta = 90.0
+        parts = zip(self.wedges, self.texts, self.autotexts, self.legend_handles, self.legend.get_texts(),
+                    chart.sizes, chart.labels, chart.colors, chart.explode, chart.legend_labels)
+        for wedge, text, autotext, handle, legend_text, size, label, color, explode, legend_label in parts:
+            fraction = size / total
+            theta2 = theta + 360.0 * fraction
+            middle = math.radians((theta + theta2) / 2)
+            dx, dy = math.cos(middle), math.sin(middle)
+            center = (explode * dx, explode * dy)
+            wedge.set_center(center)
+            wedge.set_theta1(theta)
+            wedge.set_theta2(theta2)
+            wedge.set_facecolor(color)
+            handle.set_facecolor(color)
+            text.set_position((center[0] + 1.1 * dx, center[1] + 1.1 * dy))
+            text.set_horizontalalignment("left" if dx > 0 else "right")
+            text.set_text(label)
+            autotext.set_position((center[0] + 0.82 * dx, center[1] + 0.82 * dy))
+            autotext.set_text(f"{fraction * 100:.1f}%")
+            legend_text.set_text(legend_label)
+            theta = theta2
+        self.legend.set_title(chart.legend_title)
+        self.fig.suptitle(chart.title, fontsize=17, fontweight='bold', color="#222222")
+
+    # Disegna la figura e restituisce i pixel come immagine Pillow, senza passare da un file PNG
+    def to_image(self):
+        self.canvas.draw()
+        return Image.frombuffer("RGBA", self.canvas.get_width_height(), self.canvas.buffer_rgba(), "raw", "RGBA", 0, 1)
+
+    def close(self):
+        self.fig.clear()
+
+# Template delle torte per numero di fette, dal meno al più recentemente usato (al massimo PIE_TEMPLATE_CACHE_SIZE)
+PIE_TEMPLATES: "OrderedDict[int, PieTemplate]" = OrderedDict()
+# Un template viene modificato e disegnato da un solo grafico alla volta
+PIE_TEMPLATES_LOCK = threading.Lock()
+
+# Restituisce il template per il numero di fette indicato, costruendolo se necessario
+def get_pie_template(n_wedges: int) -> PieTemplate:
+    template = PIE_TEMPLATES.get(n_wedges)
+    if template is not None:
+        PIE_TEMPLATES.move_to_end(n_wedges)
+        return template
+    template = PIE_TEMPLATES[n_wedges] = PieTemplate(n_wedges)
+    # Elimina i template usati meno di recente
+    while len(PIE_TEMPLATES) > max(PIE_TEMPLATE_CACHE_SIZE, 1):
+        PIE_TEMPLATES.popitem(last=False)[1].close()
+    return template
+
+def render_pie_matplotlib(chart: PieChart):
+    with PIE_TEMPLATES_LOCK:
+        template = get_pie_template(len(chart.sizes))
+        template.update(chart)
+        # L'immagine di to_image usa la memoria della tela: la copia in RGB rende il template subito riutilizzabile
+        if Image is not None:
+            return template.to_image().convert("RGB")
+        return figure_to_image(template.fig, _chart_label(chart), close=False)
+
+#########################         MOTORE PILLOW         #########################
+
+# Fattore di sovracampionamento: si disegna più grande e si riduce, per ottenere bordi sfumati
+SUPERSAMPLE = 2
+
+# Font di matplotlib (DejaVu Sans), già installati con la libreria: {(grassetto, dimensione): font}
+_FONTS: Dict[Tuple[bool, int], "ImageFont.FreeTypeFont"] = {}
+
+# Restituisce il font della dimensione indicata in punti, convertiti in pixel come fa matplotlib a 100 dpi
+def _font(size: int, bold: bool = False):
+    key = (bold, size)
+    if key not in _FONTS:
+        path = font_manager.findfont(font_manager.FontProperties(family="DejaVu Sans", weight="bold" if bold else "normal"))
+        _FONTS[key] = ImageFont.truetype(path, round(size * 100 / 72) * SUPERSAMPLE)
+    return _FONTS[key]
+
+# Larghezza e altezza di un testo (anche su più righe)
+def _text_size(draw, text: str, font) -> Tuple[int, int]:
+    left, top, right, bottom = draw.multiline_textbbox((0, 0), text, font=font, spacing=4 * SUPERSAMPLE)
+    return right - left, bottom - top
+
+# Disegna la legenda (quadrato colorato ed etichetta per ogni voce) a partire da x, centrata verticalmente
+def _draw_legend(draw, x: int, height: int, title: str, labels: List[str], colors: List[str]):
+    s = SUPERSAMPLE
+    title_font, label_font = _font(14), _font(13)
+    rows = [_text_size(draw, label, label_font) for label in labels]
+    title_w, title_h = _text_size(draw, title, title_font)
+    total_h = title_h + 12 * s + sum(h + 14 * s for _, h in rows)
+    y = (height - total_h) // 2
+    box = 22 * s
+    draw.text((x + (box + 10 * s + max((w for w, _ in rows), default=0) - title_w) // 2, y), title, font=title_font, fill="#222222")
+    y += title_h + 12 * s
+    for label, color, (_, h) in zip(labels, colors, rows):
+        box_y = y + (h - box) // 2
+        draw.rectangle((x, box_y, x + box, box_y + box), fill=color, outline="black", width=s)
+        draw.multiline_text((x + box + 10 * s, y), label, font=label_font, fill="#222222", spacing=4 * s)
+        y += h + 14 * s
+
+# Larghezza necessaria per la legenda
+def _legend_width(draw, title: str, labels: List[str]) -> int:
+    widths = [_text_size(draw, label, _font(13))[0] for label in labels]
+    return max([_text_size(draw, title, _font(14))[0]] + [w + 32 * SUPERSAMPLE for w in widths])
+
+# Torta nello stile di render_pie_matplotlib: fette che partono dalle 12 in senso antiorario,
+# percentuali bianche bordate di nero, etichette esterne, titolo in alto e legenda a destra
+def render_pie_pillow(chart: PieChart):
+    s = SUPERSAMPLE
+    pie_w, height = 800 * s, 640 * s
+    scratch = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    legend_w = _legend_width(scratch, chart.legend_title, chart.legend_labels)
+    image = Image.new("RGB", (pie_w + legend_w + 40 * s, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+
+    title_font = _font(17, bold=True)
+    title_w, title_h = _text_size(draw, chart.title, title_font)
+    draw.multiline_text(((image.width - title_w) // 2, 16 * s), chart.title, font=title_font,
+                        fill="#222222", align="center", spacing=4 * s)
+
+    total = float(sum(chart.sizes))
+    radius = 220 * s
+    cx, cy = pie_w // 2, (height + title_h + 16 * s) // 2
+    pct_font, label_font = _font(13, bold=True), _font(10)
+    # Angoli di Pillow: in gradi, in senso orario a partire dalle 3; le 12 corrispondono a -90
+    angle = -90.0
+    texts = []
+    for size, label, color, explode in zip(chart.sizes, chart.labels, chart.colors, chart.explode):
+        sweep = 360.0 * size / total
+        if sweep <= 0:
+            continue
+        start, end = angle - sweep, angle
+        angle = start
+        middle = math.radians((start + end) / 2)
+        dx, dy = math.cos(middle), math.sin(middle)
+        ox, oy = cx + dx * explode * radius, cy + dy * explode * radius
+        draw.pieslice((ox - radius, oy - radius, ox + radius, oy + radius), start, end,
+                      fill=color, outline="black", width=int(1.5 * s))
+        texts.append((ox, oy, dx, dy, size / total, label))
+
+    # I testi vanno disegnati dopo tutte le fette per non essere coperti
+    for ox, oy, dx, dy, fraction, label in texts:
+        pct = f"{fraction * 100:.1f}%"
+        pw, ph = _text_size(draw, pct, pct_font)
+        draw.text((ox + dx * radius * 0.82 - pw / 2, oy + dy * radius * 0.82 - ph / 2), pct, font=pct_font,
+                  fill="white", stroke_width=s, stroke_fill="black")
+        lw, lh = _text_size(draw, label, label_font)
+        lx, ly = ox + dx * radius * 1.1, oy + dy * radius * 1.1 - lh / 2
+        draw.text((lx - lw if dx < 0 else lx, ly), label, font=label_font, fill="#222222")
+
+    _draw_legend(draw, pie_w, height, chart.legend_title, chart.legend_labels, chart.colors)
+    # Riduce l'immagine sovracampionata alla dimensione finale
+    return image.reduce(SUPERSAMPLE)
+
+#########################         SCELTA DEL MOTORE         #########################
+
+# Funzioni di disegno per (tipo di grafico, motore): restituiscono l'immagine Pillow da codificare
+# (o il PNG già pronto se Pillow non è disponibile).
+# Non c'è un tipo "bar": nessun grafico del bot è a barre, quindi il disegno a barre non è stato tenuto.
+# Un nuovo tipo si aggiunge con la sua dataclass (campo kind) e almeno la voce (tipo, "matplotlib")
+CHART_RENDERERS: Dict[Tuple[str, str], Callable] = {
+    ("pie", "matplotlib"): render_pie_matplotlib,
+    ("pie", "pillow"): render_pie_pillow,
+}
+
+# Disegna il grafico con il motore configurato per il suo tipo in CHART_BACKENDS (matplotlib se non indicato)
+# e lo codifica in un thread. Se il motore non è disponibile o il disegno fallisce si ripiega su matplotlib
+async def render_chart(chart) -> io.BytesIO:
+    backend = CHART_BACKENDS.get(chart.kind, "matplotlib")
+    if backend == "pillow" and Image is None:
+        backend = "matplotlib"
+    renderer = CHART_RENDERERS.get((chart.kind, backend), CHART_RENDERERS[(chart.kind, "matplotlib")])
+    with span("render", chart=chart.kind, backend=backend) as current:
+        try:
+            image = renderer(chart)
+        except Exception as e:
+            if backend == "matplotlib":
+                raise
+            logger.warning(f"Disegno del grafico '{chart.kind}' con {backend} non riuscito ({e}): uso matplotlib")
+            image = CHART_RENDERERS[(chart.kind, "matplotlib")](chart)
+        buf = await encode_chart_async(image, _chart_label(chart))
+        current.set(bytes=buf.getbuffer().nbytes)
+        return buf
+
+# Riepilogo delle ultime codifiche (ENCODING_STATS): formati scelti, byte inviati e risparmiati, tempo medio
+def render_encoding_summary() -> str:
+    stats = list(ENCODING_STATS)
+    if not stats:
+        return ""
+    sent = sum(s.bytes for s in stats)
+    formats = ", ".join(f"{fmt} {count}" for fmt, count in Counter(s.format for s in stats).most_common())
+    # Il risparmio è calcolato solo sui grafici di cui è stato misurato il PNG di riferimento
+    measured = [s for s in stats if s.baseline_bytes is not None]
+    baseline = sum(s.baseline_bytes for s in measured)
+    if baseline:
+        saved = (baseline - sum(s.bytes for s in measured)) * 100 / baseline
+        comparison = f"{saved:.0f}% in meno del PNG precedente (misurato su {len(measured)})"
+    else:
+        comparison = "risparmio non misurato"
+    return (
+        f"\n<b>Codifica degli ultimi {len(stats)} grafici</b>\n"
+        f"Formati: {html.escape(formats)}\n"
+        f"{sent / 1024:.0f} KB inviati, {comparison}; "
+        f"codifica media {sum(s.encode_ms for s in stats) / len(stats):.0f} ms"
+    )
@@ -1,7 +1,11 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from config.config import PATH_PRG, MONITORED_COMPUTERS
-from .utils import check_admin, is_host_reachable
+from config.config import PATH_PRG, SCRIPT_DEPLOY_ENABLED, SCRIPT_DEPLOY_DIR
+from .utils import check_admin
+from .picker import get_picker_state, get_computer_keyboard, render_picker_text
+from .graphs import send_compare_graph
+from .lifecycle import render_resource_report
+from .monitor import render_monitor_report
 
 
 #########################      START      #########################
@@ -25,13 +29,29 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• Ricevere alert automatici su risorse critiche\n"
         "• Consultare log di sistema e informazioni dettagliate sull’hardware\n\n"
         "<b>Comandi principali:</b>\n"
-        "• /menu — Mostra il menu principale\n"
+        "• /menu [nome] [tag=…] — Mostra il menu principale, filtrando i computer per nome o tag\n"
+        "• /confronto [griglia] [tag] — Confronta CPU e RAM di tutti i computer\n"
+        "• /journal [unit=…] [prio=…] [grep=…] — Sfoglia i log del computer selezionato\n"
+        "• /cerca testo [tag=…] [since=24h] — Cerca nei log di tutti i computer\n"
+        "• /dashboard [tag] — Tabella aggiornata automaticamente con lo stato dei computer\n"
+        "• /connessioni — Connessioni SSH, attività in background e cadenza dei monitoraggi\n"
+        "• /profilo [secondi] — Campiona il bot in esecuzione e invia gli stack più frequenti\n"
         "• /start — Mostra questa presentazione\n"
         "• Usa i bottoni per navigare tra le sezioni e le funzioni avanzate\n\n"
-        "⚠️ <b>Avvertenza</b>:\n"
-        "Se si riscontrano problemi relativi a file o cartella non trovata, "
-        f"si prega di clonare il progetto nella propria home in:\n<code>~/{relative_path}</code>"
     )
+    if SCRIPT_DEPLOY_ENABLED:
+        # Gli script vengono copiati automaticamente sui computer quando cambiano
+        intro += (
+            "ℹ️ <b>Nota</b>:\n"
+            "Gli script necessari vengono copiati automaticamente su ogni computer in "
+            f"<code>~/{SCRIPT_DEPLOY_DIR}</code>: non serve clonare il progetto."
+        )
+    else:
+        intro += (
+            "⚠️ <b>Avvertenza</b>:\n"
+            "Se si riscontrano problemi relativi a file o cartella non trovata, "
+            f"si prega di clonare il progetto nella propria home in:\n<code>~/{relative_path}</code>"
+        )
     if update.message is not None:
         await update.message.reply_text(intro, parse_mode="HTML")
 
@@ -82,6 +102,10 @@ def get_menu_keyboard():
             InlineKeyboardButton("🧾 Grafico RAM", callback_data="RAM_graph"),
             InlineKeyboardButton("🧾 Grafico LOG", callback_data="LOG_graph")
         ],
+        [
+            InlineKeyboardButton("📉 Confronto CPU/RAM", callback_data="COMPARE_graph"),
+            InlineKeyboardButton("🗂️ Confronto a griglia", callback_data="COMPARE_grid")
+        ],
         [InlineKeyboardButton("🔔 Alert", callback_data="alerts_section")],
         [
             InlineKeyboardButton("🟢 RAM Monitor ON", callback_data="alert_on"),
@@ -91,48 +115,41 @@ def get_menu_keyboard():
         ]
     ]
 
-async def get_computer_keyboard():
-    # Inizializza una lista vuota per la keyboard
-    keyboard = []
-
-    # Crea una lista di task asincroni per verificare lo stato dei computer
-    tasks = []
-    for computer in MONITORED_COMPUTERS:
-        # Per ogni computer monitorato, crea un task per verificare se è raggiungibile
-        task = is_host_reachable(computer["ip"])
-        tasks.append(task)
-    
-    # Esegue tutti i task in parallelo e raccoglie i risultati
-    statuses = []
-    for task in tasks:
-        # Attende il completamento di ogni task e salva lo stato
-        status = await task
-        statuses.append(status)
+# Comando /menu [testo] [tag=nome]: mostra il selettore, eventualmente già filtrato
+async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, context):
+        return
+    state = get_picker_state(context)
+    state.update({"page": 0, "tag": None, "search": ""})
+    for arg in context.args or []:
+        if arg.lower().startswith("tag="):
+            state["tag"] = arg.split("=", 1)[1] or None
+        else:
+            state["search"] = arg
+    keyboard = await get_computer_keyboard(state)
+    await update.message.reply_text(render_picker_text(state), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
 
-    # Crea i pulsanti per la keyboard in base allo stato dei computer
-    for computer, online in zip(MONITORED_COMPUTERS, statuses):
-        # Sceglie l'emoji verde se online, rosso se offline
-        status_emoji = "🟢" if online else "🔴"
-        keyboard.append([
-            # Crea un pulsante inline con:
-            # - emoji dello stato
-            # - nome del computer
-            # - indirizzo IP
-            # - callback data con il nome del computer
-            InlineKeyboardButton(
-                f"{status_emoji} {computer['name']} ({computer['ip']})",
-                callback_data=f"select_computer:{computer['name']}"
-            )
-        ])
-    return keyboard
+#########################      CONFRONTO      #########################
 
-async def menu(update, context):
+async def compare(update, context):
+    # Uso: /confronto [overlay|griglia] [tag]
     if not await check_admin(update, context):
         return
-    keyboard = await get_computer_keyboard()
-    await update.message.reply_text(
-        "💻 Seleziona il computer da monitorare:",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode="HTML"
-    )
+    mode = "overlay"
+    tag = None
+    for arg in context.args or []:
+        if arg.lower() in ("overlay", "griglia"):
+            mode = arg.lower()
+        else:
+            tag = arg
+    await send_compare_graph(update, context, mode=mode, tag=tag)
 
+
+#########################      RISORSE      #########################
+
+async def connections_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Uso: /connessioni — connessioni SSH, canali e task in background aperti, per computer, e cadenza e costo dei monitoraggi attivi
+    if not await check_admin(update, context):
+        return
+    if update.message is not None:
+        await update.message.reply_text(render_resource_report() + render_monitor_report(), parse_mode="HTML")
@@ -0,0 +1,158 @@
+import time
+import html
+import asyncio
+from asyncio.log import logger
+from typing import Dict, Any, List, Optional
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+from config.config import DASHBOARD_INTERVAL, DASHBOARD_IDLE_TIMEOUT, DASHBOARD_HOST_TIMEOUT
+from .utils import check_admin, get_computers_by_tag, CHAT_ACTIVITY
+from .snapshot import HostSnapshot, fetch_host_snapshot, get_latest_snapshot, get_snapshot_pair, cpu_usage_between
+from .health import BREAKER, HostUnavailableError
+from .scheduler import PRIORITY_MONITOR, QueueFullError
+from .outbox import SEND_INTERACTIVE, SEND_REFRESH
+from .state import STATE, NS_DASHBOARD
+
+# Dashboard attive per chat: {chat_id: {"message_id": int, "tag": str|None, "last_text": str}}
+DASHBOARDS: Dict[int, Dict[str, Any]] = {}
+
+# Restituisce lo snapshot del computer per la dashboard: quello già raccolto se abbastanza recente,
+# altrimenti uno nuovo. Restituisce il motivo dell'errore se il computer non risponde
+async def get_dashboard_snapshot(computer: Dict[str, Any]):
+    name = computer["name"]
+    snapshot = get_latest_snapshot(name, DASHBOARD_INTERVAL)
+    if snapshot is not None:
+        return snapshot
+    # I computer noti come irraggiungibili non vengono contattati
+    if not BREAKER.allows(name):
+        return "offline"
+    try:
+        return await asyncio.wait_for(fetch_host_snapshot(computer, PRIORITY_MONITOR), timeout=DASHBOARD_HOST_TIMEOUT)
+    except HostUnavailableError:
+        return "offline"
+    except QueueFullError:
+        return "coda piena"
+    except asyncio.TimeoutError:
+        return "timeout"
+    except Exception as e:
+        return type(e).__name__
+
+# Riga della tabella per un computer: CPU, memoria, carico a 1 minuto e disco principale
+def render_dashboard_row(name: str, result) -> str:
+    if not isinstance(result, HostSnapshot):
+        return f"{name[:12]:<12} 🔴 {result}"
+    pair = get_snapshot_pair(name, DASHBOARD_INTERVAL * 3)
+    cpu = f"{cpu_usage_between(*pair):3.0f}%" if pair else "  --"
+    root = result.root_filesystem
+    disk = f"{root.used_percent:3.0f}%" if root else "  --"
+    return f"{name[:12]:<12} 🟢 {cpu} {result.mem_used_percent:3.0f}% {result.loadavg[0]:5.2f} {disk}"
+
+# Testo completo della dashboard per i computer indicati
+async def render_dashboard(computers: List[Dict[str, Any]], tag: Optional[str]) -> str:
+    results = await asyncio.gather(*(get_dashboard_snapshot(computer) for computer in computers))
+    header = f"{'HOST':<12}    {'CPU':>4} {'MEM':>4} {'LOAD':>5} {'DISK':>4}"
+    rows = [render_dashboard_row(computer["name"], result) for computer, result in zip(computers, results)]
+    title = "📋 <b>Dashboard</b>" + (f" — tag <code>{html.escape(tag)}</code>" if tag else "")
+    return f"{title}\n<pre>{html.escape(chr(10).join([header] + rows))}</pre>"
+
+# Pulsanti della dashboard
+def get_dashboard_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("🔄 Aggiorna", callback_data="dashboard:refresh"),
+        InlineKeyboardButton("⏹️ Ferma", callback_data="dashboard:stop"),
+    ]])
+
+# Rimuove il job di aggiornamento della chat, se presente
+def stop_dashboard_job(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    if context.job_queue is None:
+        return
+    for job in context.job_queue.get_jobs_by_name(f"dashboard:{chat_id}"):
+        job.schedule_removal()
+
+# Aggiorna il messaggio della dashboard solo se il contenuto è cambiato.
+# Restituisce False se il messaggio non esiste più
+# Gli aggiornamenti periodici hanno la priorità più bassa nella coda dei messaggi in uscita: una modifica
+# ancora in coda viene sostituita da quella successiva dello stesso messaggio
+async def update_dashboard_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str,
+                                   reply_markup: Optional[InlineKeyboardMarkup], priority: int = SEND_REFRESH) -> bool:
+    dashboard = DASHBOARDS[chat_id]
+    if text == dashboard["last_text"]:
+        return True
+    try:
+        await context.bot.edit_message_text(text, chat_id=chat_id, message_id=dashboard["message_id"],
+                                            parse_mode="HTML", reply_markup=reply_markup, rate_limit_args=priority)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            logger.info(f"Dashboard della chat {chat_id} non aggiornabile: {e}")
+            return False
+    dashboard["last_text"] = text
+    return True
+
+# Job periodico: aggiorna la dashboard della chat, oppure la sospende se nessuno interagisce da troppo tempo
+async def dashboard_tick(context: ContextTypes.DEFAULT_TYPE):
+    chat_id = context.job.chat_id
+    dashboard = DASHBOARDS.get(chat_id)
+    if dashboard is None:
+        context.job.schedule_removal()
+        return
+
+    if time.time() - CHAT_ACTIVITY.get(chat_id, 0) > DASHBOARD_IDLE_TIMEOUT:
+        context.job.schedule_removal()
+        DASHBOARDS.pop(chat_id, None)
+        STATE.delete(NS_DASHBOARD, chat_id)
+        text = dashboard["last_text"] + "\n<i>⏸️ Aggiornamento sospeso per inattività: usa /dashboard per riprendere.</i>"
+        try:
+            await context.bot.edit_message_text(text, chat_id=chat_id, message_id=dashboard["message_id"], parse_mode="HTML",
+                                                rate_limit_args=SEND_REFRESH)
+        except BadRequest:
+            pass
+        return
+
+    text = await render_dashboard(get_computers_by_tag(dashboard["tag"]), dashboard["tag"])
+    if not await update_dashboard_message(context, chat_id, text, get_dashboard_keyboard()):
+        context.job.schedule_removal()
+        DASHBOARDS.pop(chat_id, None)
+        STATE.delete(NS_DASHBOARD, chat_id)
+
+# Comando /dashboard [tag]: pubblica la tabella dei computer e la aggiorna periodicamente modificando lo stesso messaggio
+async def dashboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, context):
+        return
+    tag = context.args[0] if context.args else None
+    computers = get_computers_by_tag(tag)
+    if not computers:
+        await update.message.reply_text(f"❗ Nessun computer con il tag '{tag}'.")
+        return
+
+    chat_id = update.effective_chat.id
+    stop_dashboard_job(context, chat_id)
+    message = await update.message.reply_text("⏳ Raccolta dei dati dai computer...")
+    DASHBOARDS[chat_id] = {"message_id": message.message_id, "tag": tag, "last_text": ""}
+    # Il messaggio viene salvato: dopo un riavvio del bot viene segnato come interrotto
+    STATE.put(NS_DASHBOARD, chat_id, {"message_id": message.message_id, "tag": tag})
+    await update_dashboard_message(context, chat_id, await render_dashboard(computers, tag), get_dashboard_keyboard(), SEND_INTERACTIVE)
+
+    if context.job_queue is None:
+        logger.warning("JobQueue non disponibile: la dashboard non verrà aggiornata automaticamente.")
+        return
+    context.job_queue.run_repeating(dashboard_tick, interval=DASHBOARD_INTERVAL, first=DASHBOARD_INTERVAL,
+                                    chat_id=chat_id, name=f"dashboard:{chat_id}")
+
+# Gestisce i pulsanti della dashboard (callback "dashboard:<azione>")
+async def dashboard_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str):
+    chat_id = update.effective_chat.id
+    dashboard = DASHBOARDS.get(chat_id)
+    if dashboard is None:
+        await update.callback_query.edit_message_reply_markup(reply_markup=None)
+        return
+    if action == "stop":
+        stop_dashboard_job(context, chat_id)
+        DASHBOARDS.pop(chat_id, None)
+        STATE.delete(NS_DASHBOARD, chat_id)
+        await update.callback_query.edit_message_text(
+            dashboard["last_text"] + "\n<i>⏹️ Aggiornamento fermato.</i>", parse_mode="HTML"
+        )
+    elif action == "refresh":
+        text = await render_dashboard(get_computers_by_tag(dashboard["tag"]), dashboard["tag"])
+        await update_dashboard_message(context, chat_id, text, get_dashboard_keyboard(), SEND_INTERACTIVE)
@@ -0,0 +1,132 @@
+import hashlib
+import threading
+from asyncio.log import logger
+from pathlib import Path
+from typing import Dict, Any, Tuple
+import paramiko
+from config.config import PATH_PRG, SCRIPT_DEPLOY_ENABLED, SCRIPT_DEPLOY_DIR
+
+# Script inviati ai computer monitorati (tutti quelli eseguiti dal bot via SSH)
+DEPLOYED_SCRIPTS = ["linux_admin.sh", "admin_worker.sh", "ram_monitor.sh", "cpu_monitor.sh", "cpu_usage.sh", "log.sh"]
+
+# Hash già verificato per ogni computer: {computer_name: hash}.
+# Finché l'hash locale non cambia, il computer non viene più controllato
+DEPLOYED_HASHES: Dict[str, str] = {}
+# Un lock per computer evita due caricamenti contemporanei degli stessi file
+DEPLOY_LOCKS: Dict[str, threading.Lock] = {}
+DEPLOY_LOCKS_GUARD = threading.Lock()
+
+# Hash calcolato per l'ultima versione letta degli script: (date di modifica, hash)
+_BUNDLE_HASH: Tuple[Tuple[float, ...], str] = ((), "")
+
+# Ottiene il percorso del progetto in modo dinamico sostituendo l'utente locale con l'utente SSH
+#
+# Parametri:
+#   ssh_user (str): Nome dell'utente SSH a cui mappare il percorso
+#   local_path (Path): Percorso locale del progetto (oggetto Path)
+#
+# Ritorna:
+#   str: Percorso del progetto mappato per l'utente SSH, o il percorso originale se non è possibile mapparlo
+def get_ssh_project_path(ssh_user: str, local_path: Path) -> str:
+    # Divide il percorso in componenti
+    parts = local_path.parts
+
+    # Cerca l'indice della cartella 'home' nel percorso
+    try:
+        home_idx = parts.index('home')
+        # Ricostruisce il percorso sostituendo l'utente locale dopo 'home' con ssh_user
+        # Esempio: /home/local_user/project -> /home/ssh_user/project
+        new_parts = parts[:home_idx+1] + (ssh_user,) + parts[home_idx+2:]
+
+        # L'asterisco (*) converte la tupla in argomenti separati:
+        # Esempio: Path(*['home', 'ssh_user', 'project']) diventa Path('home', 'ssh_user', 'project')
+        # Equivalente a scrivere manualmente: Path('home', 'ssh_user', 'project')
+        return str(Path(*new_parts))
+    except ValueError:
+        # Se 'home' non è presente nel percorso, ritorna il percorso originale
+        # (caso in cui il progetto non è nella home directory)
+        return str(local_path)
+
+# Calcola l'hash del contenuto degli script da inviare.
+# Viene ricalcolato solo se uno degli script è stato modificato
+def get_bundle_hash() -> str:
+    global _BUNDLE_HASH
+    paths = [PATH_PRG / "scripts" / name for name in DEPLOYED_SCRIPTS]
+    mtimes = tuple(path.stat().st_mtime for path in paths)
+    if _BUNDLE_HASH[0] != mtimes:
+        digest = hashlib.sha256()
+        for path in paths:
+            digest.update(path.name.encode() + b"\0" + path.read_bytes() + b"\0")
+        _BUNDLE_HASH = (mtimes, digest.hexdigest()[:16])
+    return _BUNDLE_HASH[1]
+
+# Carica gli script sul computer nella cartella dell'hash indicato.
+# Il file .complete viene creato per ultimo: una copia interrotta viene rifatta al tentativo successivo
+def upload_scripts(ssh: paramiko.SSHClient, remote_dir: str, bundle_hash: str):
+    stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {remote_dir}/scripts {remote_dir}/logs")
+    if stdout.channel.recv_exit_status() != 0:
+        raise IOError(f"impossibile creare {remote_dir}: {stderr.read().decode().strip()}")
+
+    sftp = ssh.open_sftp()
+    try:
+        for name in DEPLOYED_SCRIPTS:
+            sftp.put(str(PATH_PRG / "scripts" / name), f"{remote_dir}/scripts/{name}")
+            sftp.chmod(f"{remote_dir}/scripts/{name}", 0o755)
+        with sftp.open(f"{remote_dir}/.complete", "w") as marker:
+            marker.write(bundle_hash)
+    finally:
+        sftp.close()
+
+    # Rimuove le versioni precedenti degli script, tranne quelle ancora usate da un processo
+    # (es. un monitoraggio avviato prima dell'aggiornamento): verranno rimosse a un invio successivo
+    ssh.exec_command(
+        f"for dir in {SCRIPT_DEPLOY_DIR}/*/; do "
+        f"name=$(basename \"$dir\"); [ \"$name\" = {bundle_hash} ] && continue; "
+        f"pgrep -f \"{SCRIPT_DEPLOY_DIR}/$name/\" >/dev/null || rm -rf \"$dir\"; "
+        f"done"
+    )[1].channel.recv_exit_status()
+
+# Codice di uscita di bash quando lo script da eseguire non esiste
+SCRIPT_NOT_FOUND = 127
+
+# Dimentica la versione inviata al computer (es. cartella cancellata o computer reinstallato):
+# al prossimo comando gli script vengono ricontrollati e, se mancano, inviati di nuovo
+def invalidate_remote_scripts(computer_name: str):
+    if DEPLOYED_HASHES.pop(computer_name, None) is not None:
+        logger.warning(f"Script non trovati su {computer_name}: verranno inviati di nuovo")
+
+# Restituisce la cartella remota che contiene scripts/ e logs/, caricando gli script se necessario.
+# Gli script vivono in ~/SCRIPT_DEPLOY_DIR/<hash>: il controllo della versione è un semplice "test -f"
+# e il caricamento via SFTP avviene solo quando l'hash cambia.
+# Se il caricamento è disattivato o fallisce si usa il progetto clonato nella home dell'utente remoto.
+# La funzione è bloccante e riusa la connessione SSH già aperta dal chiamante
+def ensure_remote_scripts(ssh: paramiko.SSHClient, computer: Dict[str, Any]) -> str:
+    legacy_path = get_ssh_project_path(computer["user"], PATH_PRG)
+    if not SCRIPT_DEPLOY_ENABLED:
+        return legacy_path
+
+    name = computer["name"]
+    bundle_hash = get_bundle_hash()
+    # I percorsi relativi partono dalla home dell'utente, sia per i comandi sia per SFTP
+    remote_dir = f"{SCRIPT_DEPLOY_DIR}/{bundle_hash}"
+    if DEPLOYED_HASHES.get(name) == bundle_hash:
+        return remote_dir
+
+    with DEPLOY_LOCKS_GUARD:
+        lock = DEPLOY_LOCKS.setdefault(name, threading.Lock())
+    with lock:
+        if DEPLOYED_HASHES.get(name) == bundle_hash:
+            return remote_dir
+        try:
+            stdin, stdout, stderr = ssh.exec_command(f"test -f {remote_dir}/.complete")
+            if stdout.channel.recv_exit_status() != 0:
+                logger.info(f"Invio degli script (versione {bundle_hash}) a {name}")
+                upload_scripts(ssh, remote_dir, bundle_hash)
+        except (IOError, paramiko.SFTPError) as e:
+            # Gli errori di connessione vengono propagati; quelli di scrittura portano al percorso classico
+            if isinstance(e, (TimeoutError, ConnectionError)):
+                raise
+            logger.warning(f"Invio degli script a {name} non riuscito ({e}): uso {legacy_path}")
+            return legacy_path
+        DEPLOYED_HASHES[name] = bundle_hash
+    return remote_dir
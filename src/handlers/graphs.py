@@ -1,16 +1,25 @@
 import io
-import os
+import re
+import asyncio
 import datetime
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import paramiko
 from paramiko.ssh_exception import SSHException, NoValidConnectionsError
-from config.config import MONITORED_COMPUTERS, PATH_PRG
+from config.config import (
+    MONITORED_COMPUTERS, COMPARE_HOST_TIMEOUT, HISTORY_MAX_AGE, PRECOLLECT_ENABLED, PRECOLLECT_TARGETS, REMOTE_LOG_MAX_BYTES
+)
 import traceback
-from typing import Dict
-import matplotlib.patheffects as path_effects
-import tempfile
-from .utils import get_ssh_project_path, find_computer_by_name
+from typing import Dict, Any, List, Optional, Tuple
+from .utils import find_computer_by_name, get_computers_by_tag, run_remote_command, run_on_host, format_age, get_refresh_keyboard
+from .history import store_history, get_history, history_age
+from .scheduler import PRIORITY_INTERACTIVE, PRIORITY_FANOUT, QueueFullError
+from .health import HostUnavailableError
+from .deploy import ensure_remote_scripts, invalidate_remote_scripts, SCRIPT_NOT_FOUND
+from .lifecycle import ssh_client
+from .snapshot import fetch_host_snapshot
+from .anomaly import describe_anomaly
+from .charts import PieChart, figure_to_buffer, render_chart
+from .tracing import span, spanned
 
 #########################         FUNZIONI        #########################   
 
@@ -18,42 +27,9 @@ from .utils import get_ssh_project_path, find_computer_by_name
 async def send_error_message(msg_telegram, error_message: str):
     await msg_telegram.edit_text(error_message)
 
-# Funzione helper per generare grafici a torta
-
-def _pie_style(fig, wedges, autotexts, title, legend_labels, legend_title):
-    # Imposta il colore di sfondo della figura
-    fig.set_facecolor("#f9f9f9")
-    # Personalizza il testo percentuale sulle fette della torta
-    for autotext in autotexts:
-        autotext.set_color('white')           
-        autotext.set_fontsize(13)             
-        autotext.set_fontweight('bold')       
-        autotext.set_path_effects([           
-            path_effects.Stroke(linewidth=2, foreground='black'),
-            path_effects.Normal()
-        ])
-    # Personalizza i bordi delle fette della torta
-    for w in wedges:
-        w.set_linewidth(1.5)
-        w.set_edgecolor('black')
-    # Imposta il titolo del grafico
-    fig.suptitle(title, fontsize=17, fontweight='bold', color="#222222")
-    # Aggiunge la legenda a sinistra del grafico
-    fig.legend(
-        wedges,
-        legend_labels,
-        title=legend_title,
-        loc="center left",
-        bbox_to_anchor=(1, 0.5),
-        fontsize=13,
-        title_fontsize=14,
-        frameon=False
-    )
-    return fig
-
-# Funzione DRY per generare grafici a torta
-
-def generate_pie_chart(sizes, labels, colors, explode, title, legend_labels, legend_title):
+# Funzione DRY per generare grafici a torta: restituisce la descrizione del grafico,
+# disegnata poi da render_chart con il motore configurato (None se non ci sono dati)
+def generate_pie_chart(sizes, labels, colors, explode, title, legend_labels, legend_title) -> Optional[PieChart]:
     # questo if controlla se ci sono valori in sizes
     if not any(sizes):
         return None
@@ -63,42 +39,13 @@ def generate_pie_chart(sizes, labels, colors, explode, title, legend_labels, leg
     if total == 0:
         return None
 
-    fig, ax = plt.subplots(figsize=(10, 7))
-    pie_result = ax.pie(
-        sizes,
-        labels=labels,
-        autopct='%1.1f%%',
-        startangle=90,
-        colors=colors,
-        explode=explode,
-        pctdistance=0.82,
-        wedgeprops={'edgecolor': 'black', 'linewidth': 1.5}
-    )
-
-    # questo if controlla se ci sono valori in pie_result
-    if len(pie_result) == 3:
-        wedges, texts, autotexts = pie_result
-    else:
-        wedges, texts = pie_result # type: ignore
-        autotexts = []
-    fig = _pie_style(fig, wedges, autotexts, title, legend_labels, legend_title)
-    return fig
+    return PieChart(list(sizes), list(labels), list(colors), list(explode), title, list(legend_labels), legend_title)
 
-async def get_meminfo(ssh) -> Dict[str, int]:
-    # Esegue il comando remoto per leggere il file /proc/meminfo tramite SSH
-    stdin, stdout, stderr = ssh.exec_command("cat /proc/meminfo")
-    meminfo = {}
-    # Scorre ogni riga dell'output
-    for line in stdout:
-        if ':' not in line:
-            continue # Salta le righe non valide
-        name, var = line.split(':', 1)
-        value = var.split()[0]  # Prende solo il valore numerico
-        try:
-            meminfo[name.strip()] = int(value)  # Converte in intero
-        except ValueError:
-            continue
-    return meminfo
+# Legge /proc/meminfo tramite uno snapshot del computer (un'unica esecuzione remota),
+# che resta disponibile anche per le altre viste
+async def get_meminfo(computer: Dict[str, Any]) -> Dict[str, int]:
+    snapshot = await fetch_host_snapshot(computer)
+    return snapshot.meminfo
 
 
 
@@ -121,13 +68,9 @@ async def send_ram_graph(update, context):
         await send_error_message(msg_telegram, "❗ Computer non trovato.")
         return
 
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
     try:
-        ssh.connect(computer["ip"], username=computer["user"], timeout=5)
         # Recupera le informazioni di memoria tramite SSH
-        meminfo = await get_meminfo(ssh)
+        meminfo = await get_meminfo(computer)
 
         # Genera tutti i grafici a torta della memoria
         graphs = {}
@@ -140,9 +83,9 @@ async def send_ram_graph(update, context):
             (generate_kernel_memory_pie, "📊 Memoria del Kernel"),
         ]
         for gen, caption in pie_generators:
-            fig = await gen(meminfo)
-            if fig:
-                graphs[caption] = (fig, caption)
+            chart = await gen(meminfo)
+            if chart:
+                graphs[caption] = (chart, caption)
 
         # Gestione della memoria di swap separatamente
         swap_graph = await generate_swap_memory_pie(meminfo)
@@ -155,29 +98,118 @@ async def send_ram_graph(update, context):
 
         # Invia tutti i grafici
         await msg_telegram.delete()
-        for caption, (fig, _) in graphs.items():
-            buf = io.BytesIO()
-            fig.savefig(buf, format='png', bbox_inches='tight', facecolor=fig.get_facecolor())
-            plt.close(fig)
-            buf.seek(0)
+        for caption, (chart, _) in graphs.items():
+            buf = await render_chart(chart)
             await (update.message or update.callback_query.message).reply_photo(
                 buf,
                 caption=f"{caption} su {selected}"
             )
 
+    except HostUnavailableError as e:
+        await send_error_message(msg_telegram, f"⛔ {e}")
+    except QueueFullError:
+        await send_error_message(msg_telegram, f"🚦 Troppe operazioni in coda per {selected}, riprova tra poco.")
     except Exception as e:
         # Gestione degli errori: invia il traceback all'utente
         tb = traceback.format_exc()
         await send_error_message(msg_telegram, f"❌ Errore: {str(e)}\n\n<pre>{tb}</pre>")
-    finally:
-        ssh.close()
 
 
 #########################         GRAFICI CPU         #########################   
 
 
-# Funzione per inviare il grafico CPU
-async def send_cpu_graph(update, context):
+# Esegue uno script remoto che genera un file di log e ne legge il contenuto via SFTP direttamente in memoria,
+# fino a max_bytes (i grafici usano solo l'inizio del file).
+# La funzione è bloccante: va eseguita tramite lo scheduler (run_on_host)
+def fetch_remote_log(computer: Dict[str, Any], script_name: str, log_name: str, max_bytes: int = REMOTE_LOG_MAX_BYTES) -> bytes:
+    with ssh_client(computer, f"log {log_name}") as ssh:
+        # Recupera la cartella remota degli script e dei log, inviando gli script se necessario
+        remote_path = ensure_remote_scripts(ssh, computer)
+        stdin, stdout, stderr = ssh.exec_command(f"bash {remote_path}/scripts/{script_name}")
+        # Attendi che il comando finisca; se gli script sono spariti dal computer li reinvia e riprova
+        if stdout.channel.recv_exit_status() == SCRIPT_NOT_FOUND:
+            invalidate_remote_scripts(computer["name"])
+            remote_path = ensure_remote_scripts(ssh, computer)
+            stdin, stdout, stderr = ssh.exec_command(f"bash {remote_path}/scripts/{script_name}")
+            stdout.channel.recv_exit_status()
+
+        sftp = ssh.open_sftp()
+        try:
+            with sftp.open(f"{remote_path}/logs/{log_name}", "rb") as remote_file, span("sftp.read", log=log_name) as current:
+                remote_file.prefetch(min(remote_file.stat().st_size, max_bytes))
+                data = remote_file.read(max_bytes)
+                current.set(bytes=len(data))
+                return data
+        finally:
+            sftp.close()
+
+# Converte il contenuto di cpu_usage.log (CSV "timestamp,cpu_percent") nelle serie di orari e percentuali
+@spanned("parse")
+def parse_cpu_log(data: bytes) -> Tuple[List[datetime.datetime], List[float]]:
+    timestamps, cpu_percents = [], []
+    # La prima riga è l'intestazione
+    for line in data.decode(errors="replace").splitlines()[1:]:
+        if "Media:" in line or not line.strip():
+            continue
+        try:
+            ts, cpu = line.strip().split(",")
+            timestamps.append(datetime.datetime.strptime(ts, "%Y-%m-%d %H:%M:%S"))
+            cpu_percents.append(float(cpu))
+        except ValueError:
+            continue
+    return timestamps, cpu_percents
+
+# Estrae dal riepilogo iniziale di syslog.log il totale e il numero di log per livello
+@spanned("parse")
+def parse_syslog_summary(data: bytes) -> Tuple[Dict[str, int], int]:
+    log_types = {}
+    total_logs = 0
+    # Il riepilogo occupa le righe 2-7 del file
+    for line in data.decode(errors="replace").splitlines()[1:7]:
+        line = line.strip()
+        if line.startswith("Totale log:"):
+            total_logs = int(line.split(":", 1)[1].strip())
+        elif ":" in line:
+            tipo, count = line.split(":", 1)
+            log_types[tipo.strip()] = int(count.strip())
+    return log_types, total_logs
+
+# Disegna il grafico dell'utilizzo CPU e lo restituisce come immagine in memoria
+async def plot_cpu_usage(timestamps, cpu_percents, selected: str) -> io.BytesIO:
+    fig, ax = plt.subplots(figsize=(13, 6))
+    ax.plot(
+        timestamps,
+        cpu_percents,
+        label="CPU %",
+        color="#007acc",
+        linewidth=2,
+        marker="o",
+        markersize=4,
+        markerfacecolor="#ff6600"
+    )
+    ax.set_xlabel("Tempo", fontsize=12)
+    ax.set_ylabel("Utilizzo CPU (%)", fontsize=12)
+    ax.set_title(f"Utilizzo CPU nelle ultime 24 ore su {selected}", fontsize=14)
+    ax.set_ylim(0, 100)
+    ax.grid(True, linestyle="--", alpha=0.5)
+    ax.legend(loc="upper right", fontsize=11)
+    fig.tight_layout()
+    ax.set_facecolor("#f9f9f9")
+    fig.autofmt_xdate()
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+    return await figure_to_buffer(fig, "CPU 24h")
+
+# Didascalia del grafico CPU, con l'eventuale anomalia rilevata sull'ultimo campione
+def cpu_graph_caption(selected: str) -> str:
+    caption = f"Grafico utilizzo CPU 24h per {selected}"
+    anomaly = describe_anomaly(selected, "cpu")
+    if anomaly:
+        caption += f"\n⚠️ {anomaly}"
+    return caption
+
+# Funzione per inviare il grafico CPU.
+# Se lo storico CPU è pre-raccolto in background risponde subito con quello, salvo force=True
+async def send_cpu_graph(update, context, force: bool = False):
     # Invia un messaggio di attesa all'utente
     msg_telegram = await (update.message or update.callback_query.message).reply_text("⏳ Connessione SSH e generazione del grafico CPU...")
 
@@ -194,43 +226,27 @@ async def send_cpu_graph(update, context):
         await send_error_message(msg_telegram, "❗ Computer non trovato.")
         return
 
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    # Pulsante per forzare l'aggiornamento, disponibile solo se lo storico è pre-raccolto
+    cpu_refresh_markup = None
+    if PRECOLLECT_ENABLED and "cpu_history" in PRECOLLECT_TARGETS:
+        cpu_refresh_markup = get_refresh_keyboard("CPU_graph")
+        cached = get_history(selected, "cpu")
+        if cached and not force:
+            await send_cached_cpu_graph(update, msg_telegram, selected, cached, cpu_refresh_markup)
+            return
 
     try:
-        ssh.connect(computer["ip"], username=computer["user"], timeout=5)
-        # Costruisce il percorso remoto degli script e log
-        remote_path = get_ssh_project_path(computer["user"], PATH_PRG)
-        script_path = f"{remote_path}/scripts/cpu_usage.sh"
-        # Esegue lo script remoto per aggiornare il log CPU
-        stdin, stdout, stderr = ssh.exec_command(f"bash {script_path}")
-        stdout.channel.recv_exit_status()
-
-        # Scarica il file di log CPU via SFTP in un file temporaneo locale
-        sftp = ssh.open_sftp()
-        remote_log_path = f"{remote_path}/logs/cpu_usage.log"
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            local_log_path = tmp_file.name
-            sftp.get(remote_log_path, local_log_path)
-        sftp.close()
-
-        # Legge i dati dal file temporaneo e li prepara per il grafico
-        timestamps, cpu_percents = [], []
-        try:
-            with open(local_log_path) as f:
-                next(f) # Salta l'intestazione
-                for line in f:
-                    if "Media:" in line or not line.strip():
-                        continue
-                    try:
-                        ts, cpu = line.strip().split(",")
-                        timestamps.append(datetime.datetime.strptime(ts, "%Y-%m-%d %H:%M:%S"))
-                        cpu_percents.append(float(cpu))
-                    except ValueError:
-                        continue
-        except Exception as e:
-            await send_error_message(msg_telegram, f"❌ Errore lettura file temporaneo CPU: {e}")
-            return
+        # Esegue lo script remoto per aggiornare il log CPU e ne legge il contenuto in memoria
+        log_data = await run_on_host(
+            computer, PRIORITY_INTERACTIVE, fetch_remote_log, computer, "cpu_usage.sh", "cpu_usage.log"
+        )
+
+        # Prepara i dati per il grafico
+        timestamps, cpu_percents = parse_cpu_log(log_data)
+
+        # Salva la serie nello storico, così da poterla riutilizzare nei grafici di confronto
+        if timestamps:
+            store_history(selected, "cpu", list(zip(timestamps, cpu_percents)))
 
         # Se non ci sono dati validi, avvisa l'utente
         if not timestamps:
@@ -247,58 +263,55 @@ async def send_cpu_graph(update, context):
             return
         
         # Crea il grafico dell'utilizzo CPU
-        plt.figure(figsize=(13, 6))
-        plt.plot(
-            timestamps,
-            cpu_percents,
-            label="CPU %",
-            color="#007acc",
-            linewidth=2,
-            marker="o",
-            markersize=4,
-            markerfacecolor="#ff6600"
-        )
-        plt.xlabel("Tempo", fontsize=12)
-        plt.ylabel("Utilizzo CPU (%)", fontsize=12)
-        plt.title(f"Utilizzo CPU nelle ultime 24 ore su {selected}", fontsize=14)
-        plt.ylim(0, 100)
-        plt.grid(True, linestyle="--", alpha=0.5)
-        plt.legend(loc="upper right", fontsize=11)
-        plt.tight_layout()
-        plt.gca().set_facecolor("#f9f9f9")
-        plt.gcf().autofmt_xdate()
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-        img_path = f"/tmp/{selected}_cpu_usage_24h.png"
-        plt.savefig(img_path)
-        plt.close()
+        img = await plot_cpu_usage(timestamps, cpu_percents, selected)
 
         # Invia il grafico all'utente
         try:
-            with open(img_path, "rb") as img:
-                await msg_telegram.delete()
-                await (update.message or update.callback_query.message).reply_photo(img, caption=f"Grafico utilizzo CPU 24h per {selected}")
+            await msg_telegram.delete()
+            await (update.message or update.callback_query.message).reply_photo(
+                img,
+                caption=cpu_graph_caption(selected),
+                reply_markup=cpu_refresh_markup
+            )
         except Exception as e:
             await send_error_message(msg_telegram, f"❌ Errore invio immagine CPU: {e}")
-        # Elimina i file temporanei
-        try:
-            os.remove(local_log_path)
-            os.remove(img_path)
-        except Exception:
-            pass
     # Gestione degli errori di connessione e SSH
     except NoValidConnectionsError:
         await send_error_message(msg_telegram, "❌ Impossibile connettersi al server. Verifica l'indirizzo IP e la disponibilità del server.")
     except SSHException as e:
         await send_error_message(msg_telegram, f"❌ Errore SSH: {e}")
+    except HostUnavailableError as e:
+        await send_error_message(msg_telegram, f"⛔ {e}")
+    except QueueFullError:
+        await send_error_message(msg_telegram, f"🚦 Troppe operazioni in coda per {selected}, riprova tra poco.")
     # Gestione degli errori generali
     except Exception as e:
         await send_error_message(msg_telegram, f"❌ Errore durante la connessione SSH o generazione del grafico: {e}")
-    finally:
-        ssh.close()
+
+
+# Invia il grafico CPU usando lo storico già raccolto, indicandone l'età
+async def send_cached_cpu_graph(update, msg_telegram, selected: str, points, reply_markup):
+    age = history_age(selected, "cpu") or 0
+    # Lo storico può coprire più giorni: il grafico mostra solo le ultime 24 ore
+    cutoff = datetime.datetime.now() - datetime.timedelta(hours=24)
+    points = [p for p in points if p[0] >= cutoff] or points
+    try:
+        img = await plot_cpu_usage([p[0] for p in points], [p[1] for p in points], selected)
+        await msg_telegram.delete()
+        await (update.message or update.callback_query.message).reply_photo(
+            img,
+            caption=cpu_graph_caption(selected) + f"\n🕒 Dati raccolti {format_age(age)} fa",
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        await send_error_message(msg_telegram, f"❌ Errore invio immagine CPU: {e}")
 
 
 #########################         GRAFICI LOG         #########################   
 
+# Byte letti dall'inizio di syslog.log: bastano per il riepilogo per livello
+SYSLOG_SUMMARY_BYTES = 4096
+
 async def send_log_graph(update, context):
     # Genera e invia il grafico a torta dei log syslog tramite SSH
     # Invia un messaggio di attesa all'utente
@@ -317,42 +330,18 @@ async def send_log_graph(update, context):
         await send_error_message(msg_telegram, "❗ Computer non trovato.")
         return
 
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
     try:
-        ssh.connect(computer["ip"], username=computer["user"], timeout=5)
-        
-        # Costruisce il percorso remoto degli script e log
-        remote_path = get_ssh_project_path(computer["user"], PATH_PRG)
-        script_path = f"{remote_path}/scripts/log.sh"
-        # Esegui lo script remoto che genera syslog.log
-        stdin, stdout, stderr = ssh.exec_command(f"bash {script_path}")
-        stdout.channel.recv_exit_status()  # Attendi che il comando finisca
-
-        # Scarica il file syslog.log via SFTP in un file temporaneo locale
-        sftp = ssh.open_sftp()
-        remote_log_path = f"{remote_path}/logs/syslog.log"
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            local_log_path = tmp_file.name
-            sftp.get(remote_log_path, local_log_path)
-        sftp.close()
-
-        # Leggi solo le righe 2-7 del file log locale e genera il grafico a torta
-        log_types = {}
-        total_logs = 0
+        # Esegue lo script remoto che genera syslog.log e ne legge solo il riepilogo iniziale:
+        # il resto del file contiene l'intero journal delle ultime 24 ore
+        log_data = await run_on_host(
+            computer, PRIORITY_INTERACTIVE, fetch_remote_log, computer, "log.sh", "syslog.log", SYSLOG_SUMMARY_BYTES
+        )
+
+        # Legge il totale e il numero di log per livello e genera il grafico a torta
         try:
-            with open(local_log_path, "r") as f:
-                lines = f.readlines()[1:7]
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith("Totale log:"):
-                        total_logs = int(line.split(":", 1)[1].strip())
-                    elif ":" in line:
-                        tipo, count = line.split(":", 1)
-                        log_types[tipo.strip()] = int(count.strip())
-        except Exception as e:
-            await send_error_message(msg_telegram, f"❌ Errore lettura file temporaneo log: {e}")
+            log_types, total_logs = parse_syslog_summary(log_data)
+        except ValueError as e:
+            await send_error_message(msg_telegram, f"❌ Errore lettura riepilogo log: {e}")
             return
 
         # Se non ci sono dati validi, avvisa l'utente
@@ -379,39 +368,215 @@ async def send_log_graph(update, context):
         legend_title = "Tipologia Log"
 
         # Genera il grafico a torta
-        fig = generate_pie_chart(sizes, labels, colors, explode, title, legend_labels, legend_title)
-        if not fig:
+        chart = generate_pie_chart(sizes, labels, colors, explode, title, legend_labels, legend_title)
+        if not chart:
             await send_error_message(msg_telegram, "❗ Nessun dato valido per il grafico syslog.")
             return
 
         # Invia il grafico all'utente
         try:
-            buf = io.BytesIO()
-            fig.savefig(buf, format="png", bbox_inches='tight', facecolor=fig.get_facecolor())
-            plt.close(fig)
-            buf.seek(0)
+            buf = await render_chart(chart)
             await msg_telegram.delete()
             await (update.message or update.callback_query.message).reply_photo(buf, caption=f"Grafico syslog 24h per {selected}")
         except Exception as e:
             await send_error_message(msg_telegram, f"❌ Errore invio immagine log: {e}")
-        # Elimina il file temporaneo locale
-        try:
-            os.remove(local_log_path)
-        except Exception:
-            pass
     # Gestione degli errori di connessione e SSH
     except NoValidConnectionsError:
         await send_error_message(msg_telegram, "❌ Impossibile connettersi al server. Verifica l'indirizzo IP e la disponibilità del server.")
     except SSHException as e:
         await send_error_message(msg_telegram, f"❌ Errore SSH: {e}")
+    except HostUnavailableError as e:
+        await send_error_message(msg_telegram, f"⛔ {e}")
+    except QueueFullError:
+        await send_error_message(msg_telegram, f"🚦 Troppe operazioni in coda per {selected}, riprova tra poco.")
     # Gestione degli errori generali
     except Exception as e:
         await send_error_message(msg_telegram, f"❌ Errore durante la connessione SSH o generazione del grafico: {e}")
-    finally:
-        ssh.close()
 
 
 
+#########################         GRAFICI CONFRONTO         #########################   
+
+# Comando remoto che estrae da sar l'utilizzo CPU e RAM dalla mezzanotte in un'unica connessione.
+# S_TIME_FORMAT=ISO e LC_ALL=C forzano orari nel formato HH:MM:SS indipendentemente dalla lingua
+SAR_HISTORY_COMMAND = (
+    "date +%F; "
+    "S_TIME_FORMAT=ISO LC_ALL=C sar -u -s 00:00:00; "
+    "echo ===RAM===; "
+    "S_TIME_FORMAT=ISO LC_ALL=C sar -r -s 00:00:00"
+)
+
+SAR_TIME_RE = re.compile(r"^\d{2}:\d{2}:\d{2}$")
+
+# Colori usati per distinguere i computer nei grafici di confronto
+COMPARE_COLORS = ['#007acc', '#ff6600', '#4CAF50', '#F44336', '#9C27B0', '#FF9800', '#00bcd4', '#795548']
+
+# Estrae da una sezione dell'output di sar la serie della colonna richiesta
+def parse_sar_section(text: str, column: str, day: datetime.date) -> List[Tuple[datetime.datetime, float]]:
+    points = []
+    column_idx = None
+    for line in text.splitlines():
+        parts = line.split()
+        # Considera solo le righe che iniziano con un orario (salta intestazione e "Average:")
+        if not parts or not SAR_TIME_RE.match(parts[0]):
+            continue
+        # La riga di intestazione indica la posizione della colonna cercata
+        if column in parts:
+            column_idx = parts.index(column)
+            continue
+        if column_idx is None or len(parts) <= column_idx:
+            continue
+        try:
+            value = float(parts[column_idx].replace(",", "."))
+            ts = datetime.datetime.combine(day, datetime.datetime.strptime(parts[0], "%H:%M:%S").time())
+        except ValueError:
+            continue  # Righe come "LINUX RESTART"
+        points.append((ts, value))
+    return points
+
+# Converte l'output di SAR_HISTORY_COMMAND nelle serie CPU e RAM (percentuali di utilizzo)
+@spanned("parse")
+def parse_sar_history(output: str) -> Dict[str, List[Tuple[datetime.datetime, float]]]:
+    first_line, _, rest = output.partition("\n")
+    try:
+        day = datetime.datetime.strptime(first_line.strip(), "%Y-%m-%d").date()
+    except ValueError:
+        day = datetime.date.today()
+    cpu_text, _, ram_text = rest.partition("===RAM===")
+
+    cpu_points = []
+    for ts, idle in parse_sar_section(cpu_text, "%idle", day):
+        cpu_points.append((ts, round(100 - idle, 2)))
+    ram_points = parse_sar_section(ram_text, "%memused", day)
+    return {"cpu": cpu_points, "ram": ram_points}
+
+# Restituisce le serie CPU/RAM di un computer, usando lo storico in cache quando è abbastanza recente
+async def collect_host_series(computer: Dict[str, Any], priority: int = PRIORITY_FANOUT) -> Dict[str, List[Tuple[datetime.datetime, float]]]:
+    name = computer["name"]
+    cached_cpu = get_history(name, "cpu", HISTORY_MAX_AGE)
+    cached_ram = get_history(name, "ram", HISTORY_MAX_AGE)
+    if cached_cpu and cached_ram:
+        return {"cpu": cached_cpu, "ram": cached_ram}
+
+    return await refresh_host_series(computer, priority)
+
+# Scarica da sar le serie CPU/RAM del computer e aggiorna lo storico
+async def refresh_host_series(computer: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE) -> Dict[str, List[Tuple[datetime.datetime, float]]]:
+    output = await run_remote_command(computer, SAR_HISTORY_COMMAND, priority)
+    series = parse_sar_history(output)
+    for metric, points in series.items():
+        if points:
+            store_history(computer["name"], metric, points)
+    return series
+
+# Raccoglie in parallelo le serie di tutti i computer, con un timeout per ciascuno.
+# Restituisce le serie raccolte e la lista dei computer che non hanno risposto (con il motivo)
+async def collect_fleet_series(computers: List[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, list]], List[str]]:
+    tasks = []
+    for computer in computers:
+        tasks.append(asyncio.wait_for(collect_host_series(computer), timeout=COMPARE_HOST_TIMEOUT))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    series = {}
+    failed = []
+    for computer, result in zip(computers, results):
+        if isinstance(result, asyncio.TimeoutError):
+            failed.append(f"{computer['name']} (timeout)")
+        elif isinstance(result, QueueFullError):
+            failed.append(f"{computer['name']} (coda piena)")
+        elif isinstance(result, HostUnavailableError):
+            failed.append(f"{computer['name']} (irraggiungibile)")
+        elif isinstance(result, BaseException):
+            failed.append(f"{computer['name']} ({type(result).__name__})")
+        elif not result["cpu"] and not result["ram"]:
+            failed.append(f"{computer['name']} (nessun dato sar)")
+        else:
+            series[computer["name"]] = result
+    return series, failed
+
+# Genera il grafico di confronto: "overlay" sovrappone i computer in due pannelli (CPU e RAM),
+# "griglia" crea un piccolo pannello per ogni computer con entrambe le metriche
+def generate_compare_chart(series: Dict[str, Dict[str, list]], mode: str, failed: List[str]):
+    if mode == "griglia":
+        cols = min(3, len(series))
+        rows = (len(series) + cols - 1) // cols
+        fig, axes = plt.subplots(rows, cols, figsize=(5 * cols, 3.5 * rows), sharey=True, squeeze=False)
+        flat_axes = [ax for row in axes for ax in row]
+        for ax, (name, host_series) in zip(flat_axes, series.items()):
+            for metric, color in (("cpu", "#007acc"), ("ram", "#ff6600")):
+                points = host_series.get(metric) or []
+                if points:
+                    ax.plot([p[0] for p in points], [p[1] for p in points], color=color, linewidth=1.5, label=metric.upper())
+            ax.set_title(name, fontsize=11)
+            ax.set_ylim(0, 100)
+            ax.grid(True, linestyle="--", alpha=0.5)
+            ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+            ax.legend(loc="upper right", fontsize=8)
+        # Nasconde i pannelli avanzati nella griglia
+        for ax in flat_axes[len(series):]:
+            ax.set_visible(False)
+    else:
+        fig, axes = plt.subplots(2, 1, figsize=(13, 8), sharex=True)
+        for ax, metric, label in ((axes[0], "cpu", "Utilizzo CPU (%)"), (axes[1], "ram", "Utilizzo RAM (%)")):
+            for idx, (name, host_series) in enumerate(series.items()):
+                points = host_series.get(metric) or []
+                if points:
+                    ax.plot(
+                        [p[0] for p in points], [p[1] for p in points],
+                        label=name, color=COMPARE_COLORS[idx % len(COMPARE_COLORS)], linewidth=1.8
+                    )
+            ax.set_ylabel(label, fontsize=12)
+            ax.set_ylim(0, 100)
+            ax.grid(True, linestyle="--", alpha=0.5)
+            ax.set_facecolor("#f9f9f9")
+            ax.legend(loc="upper right", fontsize=10)
+        axes[1].xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+
+    fig.set_facecolor("#f9f9f9")
+    fig.suptitle("Confronto utilizzo CPU e RAM", fontsize=15, fontweight='bold')
+    # Segnala nel grafico i computer esclusi
+    if failed:
+        fig.text(0.01, 0.01, "Non disponibili: " + ", ".join(failed), fontsize=9, color="#F44336")
+    fig.autofmt_xdate()
+    fig.tight_layout(rect=(0, 0.03, 1, 0.95))
+    return fig
+
+# Invia il grafico di confronto CPU/RAM tra tutti i computer monitorati (o quelli con il tag indicato)
+async def send_compare_graph(update, context, mode: str = "overlay", tag: Optional[str] = None):
+    message = update.message or update.callback_query.message
+    computers = get_computers_by_tag(tag)
+    if not computers:
+        await message.reply_text(f"❗ Nessun computer con il tag '{tag}'.")
+        return
+
+    msg_telegram = await message.reply_text(f"⏳ Raccolta dati CPU/RAM da {len(computers)} computer...")
+    try:
+        series, failed = await collect_fleet_series(computers)
+        if not series:
+            await send_error_message(
+                msg_telegram,
+                "❗ Nessun dato disponibile per il confronto.\n" + "\n".join(f"• {f}" for f in failed)
+            )
+            return
+
+        fig = generate_compare_chart(series, mode, failed)
+        buf = await figure_to_buffer(fig, "Confronto CPU/RAM")
+
+        caption = f"Confronto CPU/RAM ({len(series)} computer)"
+        if tag:
+            caption += f" - tag: {tag}"
+        if failed:
+            caption += "\n⚠️ Non disponibili: " + ", ".join(failed)
+        await msg_telegram.delete()
+        await message.reply_photo(buf, caption=caption)
+    except Exception as e:
+        await send_error_message(msg_telegram, f"❌ Errore durante la generazione del grafico di confronto: {e}")
+
+# Variante a piccoli pannelli (uno per computer) usata dal pulsante dedicato
+async def send_compare_grid_graph(update, context):
+    await send_compare_graph(update, context, mode="griglia")
+
+
 #########################         GRAFICI MEMORIA         #########################   
 
 
@@ -0,0 +1,187 @@
+import time
+import socket
+import asyncio
+import datetime
+import threading
+from asyncio.log import logger
+from typing import Dict, Any, Optional
+import paramiko
+from telegram.ext import Application, ContextTypes
+from config.config import MONITORED_COMPUTERS, HEALTH_FAILURE_THRESHOLD, HEALTH_OPEN_COOLDOWN, HEALTH_PROBE_INTERVAL
+from .state import STATE, NS_HEALTH
+
+# Stati del circuit breaker di ogni computer
+STATE_CLOSED = "closed"        # computer raggiungibile: le richieste passano
+STATE_OPEN = "open"            # computer irraggiungibile: le richieste falliscono subito
+STATE_HALF_OPEN = "half_open"  # in verifica: passa una sola richiesta di prova
+
+# Errori che indicano un problema di connessione (e non del comando eseguito)
+CONNECTION_ERRORS = (OSError, TimeoutError, socket.timeout, paramiko.SSHException)
+
+# Sollevata quando il computer è noto come irraggiungibile: la richiesta fallisce senza attendere il timeout
+class HostUnavailableError(Exception):
+    def __init__(self, host: str, last_error: Optional[str], last_error_time: Optional[float]):
+        self.host = host
+        self.last_error = last_error
+        self.last_error_time = last_error_time
+        when = datetime.datetime.fromtimestamp(last_error_time).strftime("%H:%M:%S") if last_error_time else "?"
+        super().__init__(f"{host} non raggiungibile (ultimo errore alle {when}: {last_error or 'sconosciuto'})")
+
+# Stato di salute di un computer, aggiornato da tutte le connessioni e le verifiche
+class HostHealth:
+    def __init__(self):
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_error_time: Optional[float] = None
+        self.last_success: Optional[float] = None
+        self.opened_at: Optional[float] = None
+        self.trial_in_progress = False
+
+    # Campi salvati nello stato persistente (la prova in corso non sopravvive a un riavvio)
+    PERSISTED = ("state", "failures", "last_error", "last_error_time", "last_success", "opened_at")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.PERSISTED}
+
+# Circuit breaker per computer. I metodi sono protetti da lock perché vengono chiamati
+# anche dai thread che eseguono le operazioni SSH
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, open_cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.open_cooldown = open_cooldown
+        self.hosts: Dict[str, HostHealth] = {}
+        self.lock = threading.Lock()
+
+    def _get(self, host: str) -> HostHealth:
+        return self.hosts.setdefault(host, HostHealth())
+
+    # Salva lo stato del computer, per non ricontattare subito dopo un riavvio i computer irraggiungibili
+    def _persist(self, host: str, health: HostHealth):
+        STATE.put(NS_HEALTH, host, health.to_dict())
+
+    # Ripristina lo stato salvato del computer; un circuito in half-open torna aperto fino alla prossima verifica
+    def restore(self, host: str, values: Dict[str, Any]):
+        with self.lock:
+            health = self._get(host)
+            for name in HostHealth.PERSISTED:
+                if name in values:
+                    setattr(health, name, values[name])
+            if health.state == STATE_HALF_OPEN:
+                health.state = STATE_OPEN
+
+    # Verifica se una richiesta può raggiungere il computer, altrimenti solleva HostUnavailableError.
+    # Trascorso il cooldown il computer passa in half-open e viene lasciata passare una richiesta di prova
+    def check(self, host: str):
+        with self.lock:
+            health = self._get(host)
+            if health.state == STATE_OPEN and time.time() - (health.opened_at or 0) >= self.open_cooldown:
+                health.state = STATE_HALF_OPEN
+            if health.state == STATE_OPEN or (health.state == STATE_HALF_OPEN and health.trial_in_progress):
+                raise HostUnavailableError(host, health.last_error, health.last_error_time)
+            if health.state == STATE_HALF_OPEN:
+                health.trial_in_progress = True
+
+    # Indica se una richiesta verrebbe lasciata passare, senza modificare lo stato (per verifiche e badge)
+    def allows(self, host: str) -> bool:
+        with self.lock:
+            health = self._get(host)
+            if health.state == STATE_OPEN:
+                return time.time() - (health.opened_at or 0) >= self.open_cooldown
+            return not (health.state == STATE_HALF_OPEN and health.trial_in_progress)
+
+    # Registra una connessione riuscita: il computer torna raggiungibile
+    def record_success(self, host: str):
+        with self.lock:
+            health = self._get(host)
+            if health.state != STATE_CLOSED:
+                logger.info(f"Circuit breaker: {host} di nuovo raggiungibile")
+            health.state = STATE_CLOSED
+            health.failures = 0
+            health.trial_in_progress = False
+            health.last_success = time.time()
+            self._persist(host, health)
+
+    # Registra un errore di connessione; oltre la soglia (o se la prova in half-open fallisce) apre il circuito
+    def record_failure(self, host: str, error: BaseException):
+        with self.lock:
+            health = self._get(host)
+            health.failures += 1
+            health.last_error = f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+            health.last_error_time = time.time()
+            health.trial_in_progress = False
+            if health.state == STATE_HALF_OPEN or health.failures >= self.failure_threshold:
+                if health.state != STATE_OPEN:
+                    logger.warning(f"Circuit breaker: {host} irraggiungibile ({health.last_error})")
+                health.state = STATE_OPEN
+                health.opened_at = time.time()
+            self._persist(host, health)
+
+    # Libera la prova in half-open se l'operazione è terminata senza un esito sulla connessione
+    def release_trial(self, host: str):
+        with self.lock:
+            self._get(host).trial_in_progress = False
+
+    # Una verifica in background è riuscita: il computer passa in half-open, la prossima richiesta fa da prova
+    def record_probe_success(self, host: str):
+        with self.lock:
+            health = self._get(host)
+            if health.state == STATE_OPEN:
+                health.state = STATE_HALF_OPEN
+                health.trial_in_progress = False
+                self._persist(host, health)
+
+    # Epoch dell'ultimo esito (riuscito o fallito) registrato per il computer, None se mai contattato
+    def last_checked(self, host: str) -> Optional[float]:
+        with self.lock:
+            health = self.hosts.get(host)
+            if health is None:
+                return None
+            times = [t for t in (health.last_success, health.last_error_time) if t is not None]
+            return max(times) if times else None
+
+    # Stato corrente del computer (per badge e riepiloghi)
+    def state(self, host: str) -> str:
+        with self.lock:
+            return self._get(host).state
+
+    # Indica se il computer è considerato raggiungibile (None se non è mai stato contattato)
+    def is_available(self, host: str) -> Optional[bool]:
+        with self.lock:
+            health = self.hosts.get(host)
+            if health is None or (health.last_success is None and health.last_error_time is None):
+                return None
+            if health.state == STATE_OPEN:
+                return False
+            # Sotto la soglia di apertura conta l'esito più recente
+            return (health.last_success or 0) >= (health.last_error_time or 0)
+
+# Istanza condivisa da tutte le connessioni del bot
+BREAKER = CircuitBreaker(HEALTH_FAILURE_THRESHOLD, HEALTH_OPEN_COOLDOWN)
+
+# Verifica leggera: prova ad aprire una connessione TCP alla porta SSH
+async def tcp_probe(ip: str, port: int = 22, timeout: float = 3) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+        writer.close()
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+# Job periodico: verifica in background i computer irraggiungibili, così che tornino disponibili
+# appena rispondono, senza far pagare il timeout a una richiesta dell'utente
+async def probe_unavailable_hosts(context: ContextTypes.DEFAULT_TYPE):
+    computers = [c for c in MONITORED_COMPUTERS if BREAKER.state(c["name"]) == STATE_OPEN]
+    if not computers:
+        return
+    results = await asyncio.gather(*(tcp_probe(c["ip"]) for c in computers))
+    for computer, reachable in zip(computers, results):
+        if reachable:
+            BREAKER.record_probe_success(computer["name"])
+
+# Registra il job di verifica sulla job queue dell'applicazione
+def start_health_probes(app: Application):
+    if app.job_queue is None:
+        logger.warning("JobQueue non disponibile: la verifica in background dei computer è disattivata.")
+        return
+    app.job_queue.run_repeating(probe_unavailable_hosts, interval=HEALTH_PROBE_INTERVAL, first=HEALTH_PROBE_INTERVAL, name="health_probes")
@@ -0,0 +1,54 @@
+import time
+import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from .state import STATE, NS_SNAPSHOT, pair_key
+
+# Numero massimo di punti conservati per ogni metrica di ogni computer
+HISTORY_MAX_POINTS = 2000
+
+# Storico delle metriche raccolte per ciascun computer:
+# {computer_name: {metric: {"points": [(timestamp, valore), ...], "updated": epoch}}}
+METRIC_HISTORY: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+# Salva una serie di punti nello storico, unendola a quella già presente.
+# I punti con lo stesso timestamp vengono sovrascritti con il valore più recente.
+def store_history(computer_name: str, metric: str, points: List[Tuple[datetime.datetime, float]]):
+    host_history = METRIC_HISTORY.setdefault(computer_name, {})
+    entry = host_history.setdefault(metric, {"points": [], "updated": 0.0})
+
+    merged = dict(entry["points"])
+    for ts, value in points:
+        merged[ts] = value
+    entry["points"] = sorted(merged.items())[-HISTORY_MAX_POINTS:]
+    entry["updated"] = time.time()
+
+# Restituisce la serie salvata per la metrica, oppure None se assente o più vecchia di max_age secondi
+def get_history(computer_name: str, metric: str, max_age: Optional[float] = None) -> Optional[List[Tuple[datetime.datetime, float]]]:
+    entry = METRIC_HISTORY.get(computer_name, {}).get(metric)
+    if not entry or not entry["points"]:
+        return None
+    if max_age is not None and time.time() - entry["updated"] > max_age:
+        return None
+    return entry["points"]
+
+# Restituisce da quanti secondi la metrica non viene aggiornata (None se mai raccolta)
+def history_age(computer_name: str, metric: str) -> Optional[float]:
+    entry = METRIC_HISTORY.get(computer_name, {}).get(metric)
+    if not entry:
+        return None
+    return time.time() - entry["updated"]
+
+
+# Ultimo output raccolto per ogni comando di ogni computer (dalla pre-raccolta o da un click):
+# {(computer_name, comando): {"output": str, "ts": epoch}}
+SNAPSHOTS: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+# Salva l'output più recente di un comando
+def store_snapshot(computer_name: str, command: str, output: str):
+    snapshot = {"output": output, "ts": time.time()}
+    SNAPSHOTS[(computer_name, command)] = snapshot
+    STATE.put(NS_SNAPSHOT, pair_key(computer_name, command), snapshot)
+
+# Restituisce l'ultimo snapshot del comando (None se mai raccolto)
+def get_snapshot(computer_name: str, command: str) -> Optional[Dict[str, Any]]:
+    return SNAPSHOTS.get((computer_name, command))
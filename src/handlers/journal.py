@@ -0,0 +1,536 @@
+import re
+import json
+import heapq
+import itertools
+import html
+import time
+import shlex
+import asyncio
+import datetime
+import threading
+from typing import Dict, Any, List, Optional, Set, Tuple
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from config.config import (
+    MONITORED_COMPUTERS, JOURNAL_PAGE_SIZE, JOURNAL_MAX_PAGES, JOURNAL_NEW_LIMIT,
+    FLEET_SEARCH_LIMIT, FLEET_SEARCH_TIME_LIMIT, FLEET_SEARCH_BUFFER
+)
+from .utils import check_admin, find_computer_by_name, run_remote_command, truncate_message, get_computers_by_tag, ssh_stream_lines
+from .scheduler import SCHEDULER, PRIORITY_FANOUT, QueueFullError
+from .health import BREAKER, CONNECTION_ERRORS, HostUnavailableError
+from .lifecycle import spawn
+
+# Campi richiesti a journalctl (__CURSOR e __REALTIME_TIMESTAMP sono sempre inclusi)
+JOURNAL_FIELDS = "MESSAGE,PRIORITY,SYSLOG_IDENTIFIER,_COMM"
+
+# Priorità accettate dal filtro (nome o numero, anche come intervallo "err..warning")
+PRIORITY_NAMES = ["emerg", "alert", "crit", "err", "warning", "notice", "info", "debug"]
+PRIORITY_RE = re.compile(r"^(%s|[0-7])(\.\.(%s|[0-7]))?$" % ("|".join(PRIORITY_NAMES), "|".join(PRIORITY_NAMES)))
+UNIT_RE = re.compile(r"^[\w@.:\-]+$")
+
+# Filtri predefiniti associati ai pulsanti del menu
+JOURNAL_PRESETS = {
+    "logs": {},
+    "sudolog": {"match": "_COMM=sudo", "grep": "COMMAND="},
+}
+
+# Costruisce il comando journalctl remoto. Tutti i valori forniti dall'utente vengono quotati.
+#   cursor/after_cursor: posizione da cui partire
+#   reverse: dalle voci più recenti alle più vecchie
+#   since: inizio dell'intervallo (es. "-24h"), time_limit: durata massima in secondi
+def build_journal_command(filters: Dict[str, str], lines: int, reverse: bool = False,
+                          cursor: Optional[str] = None, after_cursor: Optional[str] = None,
+                          since: Optional[str] = None, time_limit: Optional[int] = None) -> str:
+    args = ["journalctl", "--no-pager", "-o", "json", f"--output-fields={JOURNAL_FIELDS}", "-n", str(lines)]
+    # Limite di tempo lato remoto: journalctl viene terminato anche se il bot perde la connessione
+    if time_limit:
+        args = ["timeout", str(time_limit)] + args
+    if since:
+        args.append(f"--since={since}")
+    if reverse:
+        args.append("-r")
+    if cursor:
+        args.append(f"--cursor={cursor}")
+    if after_cursor:
+        args.append(f"--after-cursor={after_cursor}")
+    if filters.get("unit"):
+        args += ["-u", filters["unit"]]
+    if filters.get("prio"):
+        args += ["-p", filters["prio"]]
+    if filters.get("grep"):
+        args += ["-g", filters["grep"]]
+    if filters.get("match"):
+        args.append(filters["match"])
+    return " ".join(shlex.quote(arg) for arg in args) + " 2>&1"
+
+# Converte una riga JSON di journalctl in una voce compatta (None se la riga non è una voce)
+def parse_journal_line(line: str) -> Optional[Dict[str, Any]]:
+    if not line.startswith("{"):
+        return None
+    try:
+        raw = json.loads(line)
+    except ValueError:
+        return None
+    message = raw.get("MESSAGE", "")
+    # I messaggi non UTF-8 vengono restituiti come lista di byte
+    if isinstance(message, list):
+        message = bytes(message).decode(errors="replace")
+    try:
+        ts = datetime.datetime.fromtimestamp(int(raw.get("__REALTIME_TIMESTAMP", 0)) / 1_000_000)
+    except (TypeError, ValueError):
+        ts = None
+    return {
+        "cursor": raw.get("__CURSOR"),
+        "ts": ts,
+        "ident": raw.get("SYSLOG_IDENTIFIER") or raw.get("_COMM") or "?",
+        "prio": raw.get("PRIORITY", ""),
+        "message": str(message)[:300],
+    }
+
+# Converte l'output JSON di journalctl (una voce per riga) in una lista di voci compatte
+def parse_journal_entries(output: str) -> List[Dict[str, Any]]:
+    entries = []
+    for line in output.splitlines():
+        entry = parse_journal_line(line)
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+# Estrae dall'output le righe di errore di journalctl (es. filtro non valido)
+def journal_error(output: str) -> Optional[str]:
+    errors = [line for line in output.splitlines() if line.strip() and not line.startswith("{")]
+    return "\n".join(errors[:5]) if errors else None
+
+# Interpreta argomenti del tipo unit=nginx prio=err grep=pattern
+def parse_journal_filters(args: List[str]) -> Dict[str, str]:
+    filters = {}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep or not value:
+            raise ValueError(f"Argomento non valido: {arg}")
+        key = key.lower()
+        if key == "unit" and UNIT_RE.match(value):
+            filters["unit"] = value
+        elif key == "prio" and PRIORITY_RE.match(value.lower()):
+            filters["prio"] = value.lower()
+        elif key == "grep":
+            filters["grep"] = value
+        else:
+            raise ValueError(f"Filtro non valido: {arg}")
+    return filters
+
+# Restituisce lo stato del visualizzatore per l'utente e il computer (cursori e pagine già scaricate)
+def get_journal_state(context: ContextTypes.DEFAULT_TYPE, computer_name: str) -> Dict[str, Any]:
+    journal = context.user_data.setdefault("journal", {})
+    return journal.setdefault(computer_name, {"filters": None, "pages": [], "page": 0,
+                                              "newest_cursor": None, "oldest_cursor": None, "has_older": True})
+
+# Divide le voci in pagine da JOURNAL_PAGE_SIZE
+def _paginate(entries: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    return [entries[i:i + JOURNAL_PAGE_SIZE] for i in range(0, len(entries), JOURNAL_PAGE_SIZE)]
+
+# Scarica la pagina più recente, ripartendo da zero
+async def load_latest(computer: Dict[str, Any], state: Dict[str, Any]) -> Optional[str]:
+    output = await run_remote_command(computer, build_journal_command(state["filters"], JOURNAL_PAGE_SIZE, reverse=True))
+    entries = parse_journal_entries(output)
+    state.update(pages=[entries] if entries else [], page=0, has_older=len(entries) == JOURNAL_PAGE_SIZE,
+                 newest_cursor=entries[0]["cursor"] if entries else None,
+                 oldest_cursor=entries[-1]["cursor"] if entries else None)
+    return None if entries else journal_error(output)
+
+# Scarica solo le voci successive all'ultimo cursore visto e le aggiunge in testa.
+# Restituisce il numero di nuove voci
+async def load_newer(computer: Dict[str, Any], state: Dict[str, Any]) -> int:
+    output = await run_remote_command(
+        computer, build_journal_command(state["filters"], JOURNAL_NEW_LIMIT, after_cursor=state["newest_cursor"])
+    )
+    # journalctl restituisce le voci dalla più vecchia: le inverte per mostrarle dalla più recente
+    entries = [e for e in parse_journal_entries(output) if e["cursor"] != state["newest_cursor"]]
+    entries.reverse()
+    if entries:
+        state["newest_cursor"] = entries[0]["cursor"]
+        # Le voci vengono ripaginate tutte insieme, così solo l'ultima pagina può essere incompleta
+        merged = entries + [entry for page in state["pages"] for entry in page]
+        # Limita la memoria scartando le voci più vecchie: il cursore riparte dall'ultima voce tenuta,
+        # così "Più vecchi" le riscarica
+        if len(merged) > JOURNAL_MAX_PAGES * JOURNAL_PAGE_SIZE:
+            merged = merged[:JOURNAL_MAX_PAGES * JOURNAL_PAGE_SIZE]
+            state["oldest_cursor"] = merged[-1]["cursor"]
+            state["has_older"] = True
+        state["pages"] = _paginate(merged)
+        state["page"] = 0
+    return len(entries)
+
+# Scarica la pagina precedente all'ultimo cursore (voci più vecchie)
+async def load_older(computer: Dict[str, Any], state: Dict[str, Any]):
+    output = await run_remote_command(
+        computer,
+        build_journal_command(state["filters"], JOURNAL_PAGE_SIZE + 1, reverse=True, cursor=state["oldest_cursor"])
+    )
+    # --cursor include la voce del cursore stesso, già mostrata nella pagina precedente
+    entries = [e for e in parse_journal_entries(output) if e["cursor"] != state["oldest_cursor"]][:JOURNAL_PAGE_SIZE]
+    state["has_older"] = len(entries) == JOURNAL_PAGE_SIZE
+    if entries:
+        state["oldest_cursor"] = entries[-1]["cursor"]
+        state["pages"].append(entries)
+        # Limita la memoria scartando le pagine più recenti
+        if len(state["pages"]) > JOURNAL_MAX_PAGES:
+            drop = len(state["pages"]) - JOURNAL_MAX_PAGES
+            state["pages"] = state["pages"][drop:]
+            state["newest_cursor"] = state["pages"][0][0]["cursor"]
+            state["page"] = max(state["page"] - drop, 0)
+
+# Testo della pagina corrente
+def render_journal_page(computer_name: str, state: Dict[str, Any], notice: str = "") -> str:
+    filters = state["filters"] or {}
+    filters_text = ", ".join(f"{k}={v}" for k, v in filters.items()) or "nessuno"
+    pages = state["pages"]
+    header = (
+        f"📜 <b>Journal {html.escape(computer_name)}</b> — pagina {state['page'] + 1}/{len(pages) or 1}\n"
+        f"<i>Filtri: {html.escape(filters_text)}</i>\n"
+    )
+    if notice:
+        header += f"{notice}\n"
+    if not pages:
+        return header + "\nNessuna voce trovata."
+
+    lines = []
+    for entry in pages[state["page"]]:
+        ts = entry["ts"].strftime("%m-%d %H:%M:%S") if entry["ts"] else "--"
+        lines.append(f"{ts} {entry['ident']}: {entry['message']}")
+    body = truncate_message(html.escape("\n".join(lines)), html_tag_len=len(header) + 20)
+    return f"{header}<pre>{body}</pre>"
+
+# Pulsanti di navigazione tra le pagine
+def get_journal_keyboard(state: Dict[str, Any]) -> InlineKeyboardMarkup:
+    nav = []
+    if state["page"] > 0:
+        nav.append(InlineKeyboardButton("⬅️ Più recenti", callback_data="journal:newer"))
+    if state["page"] < len(state["pages"]) - 1 or state["has_older"]:
+        nav.append(InlineKeyboardButton("Più vecchi ➡️", callback_data="journal:older"))
+    return InlineKeyboardMarkup([
+        nav,
+        [
+            InlineKeyboardButton("🆕 Nuovi", callback_data="journal:new"),
+            InlineKeyboardButton("🔄 Ricarica", callback_data="journal:reset"),
+        ],
+    ])
+
+# Apre il visualizzatore con i filtri indicati. Se l'utente ha già visto il journal di questo
+# computer con gli stessi filtri, scarica solo le voci arrivate dopo l'ultima visita
+async def open_journal(update: Update, context: ContextTypes.DEFAULT_TYPE, filters: Dict[str, str]):
+    query = update.callback_query
+    reply = query.edit_message_text if query else update.message.reply_text
+    selected = context.user_data.get("selected_computer") if context.user_data else None
+    computer = find_computer_by_name(MONITORED_COMPUTERS, selected) if selected else None
+    if computer is None:
+        await reply("❗ Devi prima selezionare un computer.")
+        return
+
+    state = get_journal_state(context, selected)
+    notice = ""
+    try:
+        if state["filters"] == filters and state["newest_cursor"]:
+            new_count = await load_newer(computer, state)
+            state["page"] = 0
+            notice = f"🆕 {new_count} nuove voci dall'ultima visita"
+        else:
+            state["filters"] = filters
+            error = await load_latest(computer, state)
+            if error:
+                notice = f"⚠️ {html.escape(error)}"
+    except HostUnavailableError as e:
+        await reply(f"⛔ {e}")
+        return
+    except QueueFullError:
+        await reply(f"🚦 Troppe operazioni in coda per {selected}, riprova tra poco.")
+        return
+    except Exception:
+        await reply("❌ Il computer non è raggiungibile.")
+        return
+    await reply(render_journal_page(selected, state, notice), parse_mode="HTML", reply_markup=get_journal_keyboard(state))
+
+# Gestisce i pulsanti di navigazione (callback "journal:<azione>")
+async def journal_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str):
+    query = update.callback_query
+    selected = context.user_data.get("selected_computer") if context.user_data else None
+    computer = find_computer_by_name(MONITORED_COMPUTERS, selected) if selected else None
+    if computer is None:
+        await query.edit_message_text("❗ Devi prima selezionare un computer.")
+        return
+    state = get_journal_state(context, selected)
+    if state["filters"] is None:
+        state["filters"] = {}
+
+    notice = ""
+    try:
+        if action == "newer" and state["page"] > 0:
+            state["page"] -= 1
+        elif action == "older":
+            # Le pagine già viste vengono mostrate senza riscaricarle
+            if state["page"] + 1 >= len(state["pages"]) and state["has_older"] and state["oldest_cursor"]:
+                await load_older(computer, state)
+            if state["page"] + 1 < len(state["pages"]):
+                state["page"] += 1
+            else:
+                notice = "ℹ️ Non ci sono voci più vecchie."
+        elif action == "new":
+            if state["newest_cursor"]:
+                notice = f"🆕 {await load_newer(computer, state)} nuove voci"
+            else:
+                await load_latest(computer, state)
+        elif action == "reset":
+            await load_latest(computer, state)
+    except HostUnavailableError as e:
+        await query.edit_message_text(f"⛔ {e}")
+        return
+    except QueueFullError:
+        await query.edit_message_text(f"🚦 Troppe operazioni in coda per {selected}, riprova tra poco.")
+        return
+    except Exception:
+        await query.edit_message_text("❌ Il computer non è raggiungibile.")
+        return
+    await query.edit_message_text(render_journal_page(selected, state, notice), parse_mode="HTML",
+                                  reply_markup=get_journal_keyboard(state))
+
+# Comando /journal [unit=...] [prio=...] [grep=...]
+async def journal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, context):
+        return
+    try:
+        filters = parse_journal_filters(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❗ {e}\nUso: /journal [unit=nome] [prio=err|0-7|err..warning] [grep=testo]"
+        )
+        return
+    await open_journal(update, context, filters)
+
+
+
+#########################      RICERCA SU TUTTI I COMPUTER      #########################
+
+SINCE_RE = re.compile(r"^\d+(s|m|min|h|d)$")
+
+# Cerca il pattern nei log di tutti i computer indicati, in parallelo.
+# Le voci arrivano in streaming attraverso un buffer limitato (FLEET_SEARCH_BUFFER): se il bot non
+# le elabora abbastanza in fretta i thread di lettura si fermano in attesa. Delle voci ricevute da tutti
+# i computer vengono tenute le "limit" più recenti, non le prime arrivate. La ricerca termina quando
+# tutti i computer hanno finito, alla scadenza del tempo o appena nessun computer ancora attivo può più
+# inviare voci più recenti di quelle tenute (ogni computer le invia dalla più recente alla più vecchia).
+# Restituisce i risultati ordinati dal più recente e le note sui computer non completati
+async def search_fleet(computers: List[Dict[str, Any]], filters: Dict[str, str], since: str,
+                       limit: int = FLEET_SEARCH_LIMIT) -> Tuple[List[Dict[str, Any]], List[str]]:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = threading.Semaphore(FLEET_SEARCH_BUFFER)
+    stop = threading.Event()
+    # Computer il cui thread di lettura è partito: da lì in poi è il thread a gestire il circuit breaker
+    started: Set[str] = set()
+    command = build_journal_command(filters, limit, reverse=True, since=since, time_limit=FLEET_SEARCH_TIME_LIMIT)
+
+    # Thread di lettura: inserisce nel buffer ogni voce trovata su un computer
+    def producer(computer: Dict[str, Any]):
+        def on_line(line: str) -> bool:
+            entry = parse_journal_line(line)
+            if entry is None:
+                return not stop.is_set()
+            entry["host"] = computer["name"]
+            # Attende che si liberi un posto nel buffer, controllando periodicamente l'interruzione
+            while not stop.is_set():
+                if slots.acquire(timeout=0.5):
+                    loop.call_soon_threadsafe(queue.put_nowait, entry)
+                    return True
+            return False
+        started.add(computer["name"])
+        # Ricerca già terminata mentre il computer era in coda nello scheduler
+        if stop.is_set():
+            BREAKER.release_trial(computer["name"])
+            return
+        error = None
+        try:
+            ssh_stream_lines(computer, command, on_line)
+            BREAKER.record_success(computer["name"])
+        except CONNECTION_ERRORS as e:
+            BREAKER.record_failure(computer["name"], e)
+            error = type(e).__name__
+        except Exception as e:
+            BREAKER.release_trial(computer["name"])
+            error = type(e).__name__
+        # Segnala la fine del computer (con l'eventuale errore), fuori dal buffer limitato.
+        # Se la ricerca è già terminata nessuno legge più la coda
+        if not stop.is_set():
+            loop.call_soon_threadsafe(queue.put_nowait, (computer["name"], error))
+
+    # Ogni computer passa dallo scheduler con priorità fan-out, così una ricerca su tutta la flotta
+    # non sottrae posti ai click interattivi
+    async def run_host(computer: Dict[str, Any]):
+        try:
+            # I computer noti come irraggiungibili vengono saltati subito
+            BREAKER.check(computer["name"])
+            # Il posto resta occupato finché il thread di lettura non chiude la connessione
+            await SCHEDULER.run(computer["name"], PRIORITY_FANOUT, producer, computer)
+        except HostUnavailableError:
+            if not stop.is_set():
+                queue.put_nowait((computer["name"], "irraggiungibile"))
+        except QueueFullError:
+            BREAKER.release_trial(computer["name"])
+            if not stop.is_set():
+                queue.put_nowait((computer["name"], "coda piena"))
+        except asyncio.CancelledError:
+            # Annullato mentre era in coda nello scheduler: la prova del circuit breaker non è stata usata
+            if computer["name"] not in started:
+                BREAKER.release_trial(computer["name"])
+            raise
+
+    # I riferimenti ai task sono tenuti dal registro di lifecycle finché non terminano
+    tasks = [spawn(run_host(computer), computer["name"], "ricerca nei log") for computer in computers]
+
+    # Le "limit" voci più recenti ricevute finora: heap con la più vecchia in cima
+    # (il contatore evita di confrontare le voci a parità di data)
+    newest: List[Tuple[datetime.datetime, int, Dict[str, Any]]] = []
+    order = itertools.count()
+    received = 0
+    pending = {computer["name"] for computer in computers}
+    # Data dell'ultima voce ricevuta da ogni computer: le successive non possono essere più recenti
+    last_seen: Dict[str, datetime.datetime] = {}
+    stopped_early = False
+    notes = []
+    deadline = time.monotonic() + FLEET_SEARCH_TIME_LIMIT + 10
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if isinstance(item, tuple):
+                name, error = item
+                pending.discard(name)
+                if error:
+                    notes.append(f"{name} ({error})")
+                continue
+            slots.release()
+            received += 1
+            ts = item["ts"] or datetime.datetime.min
+            last_seen[item["host"]] = ts
+            heap_item = (ts, next(order), item)
+            if len(newest) < limit:
+                heapq.heappush(newest, heap_item)
+            else:
+                heapq.heappushpop(newest, heap_item)
+            # Con i risultati al completo, i computer la cui ultima voce è già più vecchia della meno
+            # recente tenuta non possono più cambiare il risultato
+            if len(newest) == limit and all(name in last_seen and last_seen[name] <= newest[0][0] for name in pending):
+                stopped_early = bool(pending)
+                break
+    finally:
+        # Ferma i thread ancora attivi (chiudono la connessione alla prossima riga letta)
+        # e toglie dalla coda dello scheduler i computer non ancora avviati
+        stop.set()
+        for task in tasks:
+            task.cancel()
+
+    if stopped_early:
+        notes.append(f"mostrati i {limit} risultati più recenti; interrotti {len(pending)} computer senza voci più recenti")
+    else:
+        if received > limit:
+            notes.append(f"mostrati i {limit} risultati più recenti su {received}")
+        notes.extend(f"{name} (timeout)" for name in sorted(pending))
+    # Unisce i risultati di tutti i computer in ordine cronologico inverso
+    results = [entry for _, _, entry in sorted(newest, key=lambda item: item[:2], reverse=True)]
+    return results, notes
+
+# Testo della pagina corrente dei risultati di ricerca
+def render_search_page(search: Dict[str, Any]) -> str:
+    results = search["results"]
+    pages = max((len(results) + JOURNAL_PAGE_SIZE - 1) // JOURNAL_PAGE_SIZE, 1)
+    header = (
+        f"🔎 <b>Ricerca</b> <code>{html.escape(search['pattern'])}</code> — "
+        f"{len(results)} risultati, pagina {search['page'] + 1}/{pages}\n"
+    )
+    if search["notes"]:
+        header += "<i>⚠️ " + html.escape(", ".join(search["notes"])) + "</i>\n"
+    if not results:
+        return header + "\nNessuna voce trovata."
+
+    lines = []
+    start = search["page"] * JOURNAL_PAGE_SIZE
+    for entry in results[start:start + JOURNAL_PAGE_SIZE]:
+        ts = entry["ts"].strftime("%m-%d %H:%M:%S") if entry["ts"] else "--"
+        lines.append(f"[{entry['host']}] {ts} {entry['ident']}: {entry['message']}")
+    body = truncate_message(html.escape("\n".join(lines)), html_tag_len=len(header) + 20)
+    return f"{header}<pre>{body}</pre>"
+
+# Pulsanti di navigazione tra le pagine dei risultati
+def get_search_keyboard(search: Dict[str, Any]) -> Optional[InlineKeyboardMarkup]:
+    buttons = []
+    if search["page"] > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Più recenti", callback_data="search:prev"))
+    if (search["page"] + 1) * JOURNAL_PAGE_SIZE < len(search["results"]):
+        buttons.append(InlineKeyboardButton("Più vecchi ➡️", callback_data="search:next"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+# Comando /cerca <testo> [tag=...] [since=24h] [unit=...] [prio=...]
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, context):
+        return
+    usage = "Uso: /cerca testo [tag=nome] [since=24h] [unit=nome] [prio=err]"
+    pattern_parts = []
+    options = []
+    for arg in context.args or []:
+        if "=" in arg and arg.split("=", 1)[0].lower() in ("tag", "since", "unit", "prio"):
+            options.append(arg)
+        else:
+            pattern_parts.append(arg)
+    if not pattern_parts:
+        await update.message.reply_text(f"❗ Specifica il testo da cercare.\n{usage}")
+        return
+
+    tag = None
+    since = "24h"
+    filter_args = []
+    for option in options:
+        key, _, value = option.partition("=")
+        key = key.lower()
+        if key == "tag":
+            tag = value
+        elif key == "since":
+            since = value
+        else:
+            filter_args.append(option)
+    try:
+        filters = parse_journal_filters(filter_args)
+    except ValueError as e:
+        await update.message.reply_text(f"❗ {e}\n{usage}")
+        return
+    if not SINCE_RE.match(since):
+        await update.message.reply_text(f"❗ Intervallo non valido: {since}\n{usage}")
+        return
+    filters["grep"] = " ".join(pattern_parts)
+
+    computers = get_computers_by_tag(tag)
+    if not computers:
+        await update.message.reply_text(f"❗ Nessun computer con il tag '{tag}'.")
+        return
+
+    msg = await update.message.reply_text(f"⏳ Ricerca in corso su {len(computers)} computer...")
+    results, notes = await search_fleet(computers, filters, f"-{since}")
+    search = {"pattern": filters["grep"], "results": results, "notes": notes, "page": 0}
+    context.user_data["search"] = search
+    await msg.edit_text(render_search_page(search), parse_mode="HTML", reply_markup=get_search_keyboard(search))
+
+# Gestisce i pulsanti di navigazione dei risultati (callback "search:<azione>")
+async def search_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str):
+    query = update.callback_query
+    search = context.user_data.get("search") if context.user_data else None
+    if not search:
+        await query.edit_message_text("❗ Nessuna ricerca attiva. Usa /cerca per avviarne una.")
+        return
+    if action == "prev" and search["page"] > 0:
+        search["page"] -= 1
+    elif action == "next" and (search["page"] + 1) * JOURNAL_PAGE_SIZE < len(search["results"]):
+        search["page"] += 1
+    await query.edit_message_text(render_search_page(search), parse_mode="HTML", reply_markup=get_search_keyboard(search))
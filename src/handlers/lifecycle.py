@@ -0,0 +1,194 @@
+import time
+import html
+import asyncio
+import itertools
+import threading
+from asyncio.log import logger
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+import paramiko
+from telegram.ext import Application, ContextTypes
+from config.config import LIFECYCLE_MAX_CONNECTIONS_PER_HOST, LIFECYCLE_LEAK_CHECK_INTERVAL, LIFECYCLE_SHUTDOWN_TIMEOUT
+from .tracing import span
+
+# Tipi di risorsa registrati
+KIND_SSH = "ssh"          # connessione SSH (client e trasporto, con il suo thread di lettura)
+KIND_CHANNEL = "channel"  # canale di lunga durata su una connessione (monitoraggi, worker remoti)
+KIND_TASK = "task"        # task asyncio in background
+
+# Sollevata quando un computer ha già troppe connessioni SSH aperte
+class ResourceLimitError(Exception):
+    def __init__(self, host: str, limit: int):
+        super().__init__(f"{host} ha già {limit} connessioni SSH aperte, riprova tra poco")
+        self.host = host
+
+# Risorsa registrata: chi l'ha aperta, per quale computer e come chiuderla
+@dataclass
+class Resource:
+    id: int
+    kind: str
+    host: str
+    purpose: str
+    close: Callable[[], Any]
+    created: float = field(default_factory=time.time)
+    obj: Any = None
+
+# Registro centrale delle risorse: ogni connessione SSH, canale e task in background viene registrato
+# alla creazione e rimosso alla chiusura, così nessuna risorsa resta senza proprietario.
+# Le connessioni vengono aperte anche dai thread dello scheduler: lo stato è protetto da un lock
+class ResourceRegistry:
+    def __init__(self, max_connections_per_host: int):
+        self.max_connections_per_host = max_connections_per_host
+        self.resources: Dict[int, Resource] = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.closing = False
+
+    def _connections(self, host: str) -> int:
+        return sum(1 for r in self.resources.values() if r.kind == KIND_SSH and r.host == host)
+
+    # Registra una risorsa e ne restituisce l'id.
+    # Per le connessioni SSH rispetta il limite per computer; durante lo spegnimento non si aprono nuove risorse
+    def register(self, kind: str, host: str, purpose: str, close: Callable[[], Any], obj: Any = None) -> int:
+        with self.lock:
+            if self.closing:
+                raise RuntimeError("il bot si sta arrestando")
+            if kind == KIND_SSH and self._connections(host) >= self.max_connections_per_host:
+                raise ResourceLimitError(host, self.max_connections_per_host)
+            resource = Resource(next(self.ids), kind, host, purpose, close, obj=obj)
+            self.resources[resource.id] = resource
+        return resource.id
+
+    # Chiude la risorsa e la rimuove dal registro. Chiamarla più volte non ha effetto
+    def release(self, resource_id: Optional[int]):
+        with self.lock:
+            resource = self.resources.pop(resource_id, None)
+        if resource is None:
+            return
+        try:
+            resource.close()
+        except Exception as e:
+            logger.warning(f"Chiusura di {resource.kind} '{resource.purpose}' per {resource.host} non riuscita: {e}")
+
+    # Rimuove la risorsa dal registro senza chiuderla (già chiusa dal proprietario)
+    def forget(self, resource_id: Optional[int]):
+        with self.lock:
+            self.resources.pop(resource_id, None)
+
+    # Numero di risorse aperte per tipo e per computer: {tipo: {computer: numero}}
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            resources = list(self.resources.values())
+        result: Dict[str, Dict[str, int]] = {}
+        for resource in resources:
+            by_host = result.setdefault(resource.kind, {})
+            by_host[resource.host] = by_host.get(resource.host, 0) + 1
+        return result
+
+    def snapshot(self) -> List[Resource]:
+        with self.lock:
+            return sorted(self.resources.values(), key=lambda r: r.created)
+
+    # Chiude tutte le risorse: prima annulla i task (che a loro volta chiudono le proprie connessioni),
+    # poi chiude quello che resta
+    async def shutdown(self, timeout: float):
+        with self.lock:
+            self.closing = True
+            tasks = [r.obj for r in self.resources.values() if r.kind == KIND_TASK]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        remaining = self.snapshot()
+        for resource in remaining:
+            await asyncio.to_thread(self.release, resource.id)
+        logger.info(f"Arresto: {len(tasks)} task annullati, {len(remaining)} risorse chiuse")
+
+# Istanza condivisa da tutto il bot
+REGISTRY = ResourceRegistry(LIFECYCLE_MAX_CONNECTIONS_PER_HOST)
+
+# Apre una connessione SSH al computer e la registra. Restituisce il client e l'id della risorsa,
+# da passare a REGISTRY.release per chiuderla. La funzione è bloccante
+def open_ssh_client(computer: Dict[str, Any], purpose: str):
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    # Il posto viene riservato prima di connettersi, così il limite vale anche per le connessioni in corso
+    resource_id = REGISTRY.register(KIND_SSH, computer["name"], purpose, ssh.close, obj=ssh)
+    try:
+        with span("ssh.connect", host=computer["name"]):
+            ssh.connect(computer["ip"], username=computer["user"], timeout=5)
+    except BaseException:
+        REGISTRY.release(resource_id)
+        raise
+    return ssh, resource_id
+
+# Connessione SSH registrata per la durata del blocco "with", chiusa all'uscita anche in caso di errore
+@contextmanager
+def ssh_client(computer: Dict[str, Any], purpose: str):
+    ssh, resource_id = open_ssh_client(computer, purpose)
+    try:
+        yield ssh
+    finally:
+        REGISTRY.release(resource_id)
+
+# Registra un canale SSH di lunga durata del computer; REGISTRY.release lo chiude
+def register_channel(channel: paramiko.Channel, host: str, purpose: str) -> int:
+    return REGISTRY.register(KIND_CHANNEL, host, purpose, channel.close, obj=channel)
+
+# Avvia un task in background e lo registra finché non termina.
+# Il registro mantiene il riferimento al task (che altrimenti potrebbe essere eliminato prima della fine)
+def spawn(coro, host: str, purpose: str) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    try:
+        resource_id = REGISTRY.register(KIND_TASK, host, purpose, task.cancel, obj=task)
+    except RuntimeError:
+        task.cancel()
+        raise
+    task.add_done_callback(lambda _: REGISTRY.forget(resource_id))
+    return task
+
+# Thread di trasporto paramiko ancora attivi (uno per connessione SSH aperta, registrata o no)
+def live_transports() -> int:
+    return sum(1 for thread in threading.enumerate() if isinstance(thread, paramiko.Transport) and thread.is_alive())
+
+# Job periodico: confronta le connessioni registrate con i trasporti paramiko vivi.
+# Un trasporto in più è una connessione aperta fuori dal registro e mai chiusa
+async def leak_check(context: ContextTypes.DEFAULT_TYPE):
+    registered = sum(REGISTRY.counts().get(KIND_SSH, {}).values())
+    alive = live_transports()
+    if alive > registered:
+        logger.warning(f"Possibile perdita di connessioni: {alive} trasporti SSH attivi, {registered} registrati")
+
+# Testo con le risorse aperte per tipo e per computer
+def render_resource_report() -> str:
+    counts = REGISTRY.counts()
+    lines = ["🔌 <b>Risorse aperte</b>"]
+    if not counts:
+        lines.append("Nessuna risorsa aperta.")
+    for kind in sorted(counts):
+        by_host = counts[kind]
+        detail = ", ".join(f"{html.escape(host)}: {n}" for host, n in sorted(by_host.items()))
+        lines.append(f"• {kind}: {sum(by_host.values())} ({detail})")
+    registered = sum(counts.get(KIND_SSH, {}).values())
+    alive = live_transports()
+    lines.append(f"\nTrasporti SSH attivi: {alive} (registrati: {registered})")
+    if alive > registered:
+        lines.append("⚠️ Ci sono connessioni aperte fuori dal registro.")
+    oldest = [r for r in REGISTRY.snapshot() if r.kind == KIND_SSH][:5]
+    if oldest:
+        lines.append("\nConnessioni più vecchie:")
+        now = time.time()
+        lines.extend(f"• {html.escape(r.host)} — {html.escape(r.purpose)} ({int(now - r.created)} s)" for r in oldest)
+    return "\n".join(lines)
+
+# Chiamata all'arresto dell'applicazione: chiude tutte le connessioni e annulla i task
+async def shutdown_resources(app: Application):
+    await REGISTRY.shutdown(LIFECYCLE_SHUTDOWN_TIMEOUT)
+
+# Registra il controllo periodico delle connessioni non registrate
+def start_leak_check(app: Application):
+    if LIFECYCLE_LEAK_CHECK_INTERVAL <= 0 or app.job_queue is None:
+        return
+    app.job_queue.run_repeating(leak_check, interval=LIFECYCLE_LEAK_CHECK_INTERVAL,
+                                first=LIFECYCLE_LEAK_CHECK_INTERVAL, name="leak_check")
@@ -1,10 +1,19 @@
+import time
+import html
 import asyncio
 from asyncio.log import logger
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
 from telegram import Update
 from telegram.ext import ContextTypes
 import paramiko
-from config.config import MONITORED_COMPUTERS, PATH_PRG
-from .utils import get_ssh_project_path, find_computer_by_name
+from config.config import MONITORED_COMPUTERS, PATH_PRG, MONITOR_INTERVALS, SCRIPT_DEPLOY_DIR
+from .utils import find_computer_by_name, run_on_host
+from .deploy import ensure_remote_scripts, invalidate_remote_scripts, SCRIPT_NOT_FOUND
+from .scheduler import PRIORITY_MONITOR
+from .alerts import ALERT_ENGINE, get_alert_rule, parse_sample_line, notify_alert_event
+from .lifecycle import REGISTRY, open_ssh_client, register_channel, spawn
+from .state import STATE, NS_MONITOR
 
 # Mappa dei tipi di monitoraggio e script associati
 MONITOR_TYPES = {
@@ -16,12 +25,47 @@ MONITOR_TYPES = {
 # Inizializza dizionari per tracciare i processi di monitoraggio
 MONITOR_PROCESSES = {}
 for monitor_type in MONITOR_TYPES:
-    MONITOR_PROCESSES[monitor_type] = {}  # {user_id: {computer_name: channel}}
+    MONITOR_PROCESSES[monitor_type] = {}  # {user_id: {computer_name: MonitorConnection}}
 
-# Inizializza dizionari per tracciare gli ultimi messaggi inviati
-MONITOR_LAST_MSG = {}
-for monitor_type in MONITOR_TYPES:
-    MONITOR_LAST_MSG[monitor_type] = {}  # {user_id: {computer_name: last_message_id}}
+# Marker delle righe con la cadenza dello script: "===STATS=== <tipo> <intervallo> <ms di CPU usati finora>"
+STATS_MARKER = "===STATS==="
+
+# Cadenza e costo di uno script di monitoraggio, aggiornati a ogni controllo
+@dataclass
+class MonitorStats:
+    interval: Optional[int] = None    # secondi fino al prossimo controllo, scelti dallo script
+    samples: int = 0
+    first_cpu_ms: Optional[int] = None
+    first_seen: float = 0.0
+    cpu_ms: int = 0
+    last_seen: float = 0.0
+
+    def update(self, interval: int, cpu_ms: int):
+        now = time.monotonic()
+        if self.first_cpu_ms is None:
+            self.first_cpu_ms, self.first_seen = cpu_ms, now
+        self.interval, self.cpu_ms, self.last_seen = interval, cpu_ms, now
+        self.samples += 1
+
+    # Percentuale di un core usata dallo script dal primo controllo ricevuto (None finché i dati non bastano)
+    def overhead(self) -> Optional[float]:
+        if self.first_cpu_ms is None or self.last_seen <= self.first_seen:
+            return None
+        return (self.cpu_ms - self.first_cpu_ms) / ((self.last_seen - self.first_seen) * 1000) * 100
+
+# Connessione di un monitoraggio: il canale su cui gira lo script e le risorse registrate
+# (la connessione SSH e il canale), chiuse insieme quando il monitoraggio termina
+@dataclass
+class MonitorConnection:
+    channel: paramiko.Channel
+    ssh_id: int
+    channel_id: int
+    stats: MonitorStats = field(default_factory=MonitorStats)
+
+    # Chiude il canale e la connessione. Chiamarla più volte non ha effetto; la funzione è bloccante
+    def close(self):
+        REGISTRY.release(self.channel_id)
+        REGISTRY.release(self.ssh_id)
 
 def get_reply_function(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Restituisce la funzione di risposta più adatta per l'update, oppure None se non disponibile.
@@ -73,6 +117,91 @@ async def monitor_control(update: Update, context: ContextTypes.DEFAULT_TYPE, ac
     elif action == "off":
         await monitor_off(update, context, monitor_type)
 
+# Intervallo minimo e massimo (secondi) tra due controlli del monitoraggio sul computer:
+# valori predefiniti del tipo, sovrascrivibili da "monitor" in monitored_computers.json
+def get_monitor_cadence(host: str, monitor_type: str) -> Tuple[int, int]:
+    values = dict(MONITOR_INTERVALS.get(monitor_type, {}))
+    computer = find_computer_by_name(MONITORED_COMPUTERS, host)
+    if computer:
+        values.update(computer.get("monitor", {}).get(monitor_type, {}))
+    # La misura della CPU richiede almeno un secondo
+    min_interval = max(int(values.get("min_interval", 5)), 1)
+    max_interval = max(int(values.get("max_interval", 60)), min_interval)
+    return min_interval, max_interval
+
+# Converte una riga "===STATS=== tipo intervallo cpu_ms" in (intervallo, cpu_ms); None se la riga non è di cadenza
+def parse_stats_line(line: str) -> Optional[Tuple[int, int]]:
+    parts = line.split()
+    if len(parts) < 4 or parts[0] != STATS_MARKER:
+        return None
+    try:
+        return int(parts[2]), int(parts[3])
+    except ValueError:
+        return None
+
+# Si connette al computer e avvia lo script di monitoraggio remoto su una nuova sessione SSH.
+# Lo script riceve la soglia di attivazione dell'alert, oltre la quale allega la tabella dei processi,
+# il valore di rientro e gli intervalli tra cui adatta la frequenza dei controlli.
+# Con cleanup=True termina prima gli script di monitoraggio rimasti attivi da un'esecuzione precedente del bot.
+# Restituisce la connessione (None se il trasporto non è disponibile). La funzione è bloccante
+def open_monitor_channel(computer, monitor_type: str, cleanup: bool = False):
+    # Connessione SSH al computer selezionato, registrata finché il monitoraggio resta attivo
+    ssh, ssh_id = open_ssh_client(computer, f"monitor {monitor_type}")
+    try:
+        transport = ssh.get_transport()
+        if not transport:
+            REGISTRY.release(ssh_id)
+            return None
+
+        # Apre una nuova sessione SSH e avvia lo script di monitoraggio remoto
+        channel = transport.open_session()
+        connection = MonitorConnection(channel, ssh_id, register_channel(channel, computer["name"], f"monitor {monitor_type}"))
+        remote_path = ensure_remote_scripts(ssh, computer)
+        remote_script_path = f"{remote_path}/scripts/{monitor_type}_monitor.sh"
+        if cleanup:
+            # Il percorso non include l'hash della versione: gli script rimasti possono essere stati avviati
+            # da una versione precedente (con gli script locali modificati nel frattempo).
+            # Se gli script non sono stati inviati si usa anche il percorso del progetto clonato
+            patterns = [f"{SCRIPT_DEPLOY_DIR}/[^/]*/scripts/{monitor_type}_monitor.sh"]
+            if not remote_path.startswith(f"{SCRIPT_DEPLOY_DIR}/"):
+                patterns.append(remote_script_path)
+            for pattern in patterns:
+                stdin, stdout, stderr = ssh.exec_command(f"pkill -f '{pattern}'")
+                stdout.channel.recv_exit_status()
+        rule = get_alert_rule(computer["name"], monitor_type)
+        threshold = int(rule.trigger) if rule else 95
+        clear = int(rule.clear) if rule else threshold
+        min_interval, max_interval = get_monitor_cadence(computer["name"], monitor_type)
+        channel.exec_command(f"bash {remote_script_path} {threshold} {clear} {min_interval} {max_interval}")
+        return connection
+    except BaseException:
+        REGISTRY.release(ssh_id)
+        raise
+
+# Chiave del monitoraggio nello stato persistente
+def monitor_state_key(monitor_type: str, user_id: int, selected: str) -> str:
+    return f"{monitor_type}:{user_id}:{selected}"
+
+# Avvia il monitoraggio del computer per l'utente: apre la connessione, iscrive la chat agli alert,
+# lo salva nello stato persistente (per riprenderlo dopo un riavvio) e avvia la lettura dell'output.
+# Restituisce la connessione, None se il trasporto SSH non è disponibile
+async def attach_monitor(bot, computer, monitor_type: str, user_id: int, chat_id: int, cleanup: bool = False):
+    selected = computer["name"]
+    # Connessione SSH e avvio monitoraggio, tramite lo scheduler con priorità "monitor".
+    # Il posto nello scheduler viene occupato solo durante l'avvio, non per tutta la durata del monitoraggio
+    connection = await run_on_host(computer, PRIORITY_MONITOR, open_monitor_channel, computer, monitor_type, cleanup)
+    if connection is None:
+        return None
+    # Salva la connessione per poterla chiudere successivamente
+    MONITOR_PROCESSES[monitor_type].setdefault(user_id, {})[selected] = connection
+    # Iscrive la chat alle notifiche degli incidenti del computer
+    ALERT_ENGINE.subscribe(selected, monitor_type, user_id, chat_id)
+    STATE.put(NS_MONITOR, monitor_state_key(monitor_type, user_id, selected),
+              {"type": monitor_type, "user_id": user_id, "host": selected, "chat_id": chat_id})
+    # Avvia la lettura asincrona dell'output del monitoraggio (il task resta nel registro finché è attivo)
+    spawn(read_monitor_output_ssh(bot, connection, selected, monitor_type, user_id), selected, f"monitor {monitor_type}")
+    return connection
+
 async def monitor_on(update: Update, context: ContextTypes.DEFAULT_TYPE, monitor_type: str, script_path: str):
     # Attiva il monitoraggio (RAM/CPU) per il computer selezionato
     # Recupera dati utente e computer
@@ -102,34 +231,22 @@ async def monitor_on(update: Update, context: ContextTypes.DEFAULT_TYPE, monitor
             await reply("❗ Computer non trovato.")
         return
 
-    # Connessione SSH e avvio monitoraggio
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
     try:
-        # Connessione SSH al computer selezionato
-        ssh.connect(computer["ip"], username=computer["user"], timeout=5)
-        transport = ssh.get_transport()
+        chat_id = update.effective_chat.id if update.effective_chat else user_id
+        connection = await attach_monitor(context.bot, computer, monitor_type, user_id, chat_id)
         
         # Se il trasporto SSH non è disponibile, avvisa l'utente
-        if not transport:
+        if connection is None:
             if reply:
                 await reply(f"❌ Errore avvio monitoraggio {monitor_type.upper()}: trasporto SSH non disponibile.")
             return
-            
-        # Apre una nuova sessione SSH e avvia lo script di monitoraggio remoto
-        channel = transport.open_session()
-        ssh_user = computer["user"]
-        remote_path = get_ssh_project_path(ssh_user, PATH_PRG)
-        remote_script_path = f"{remote_path}/scripts/{monitor_type}_monitor.sh"
-        channel.exec_command(f"bash {remote_script_path}")
 
-        # Salva il canale SSH per poterlo chiudere successivamente
-        user_monitors[selected] = channel
         if reply:
-            await reply(f"✅ Monitoraggio {monitor_type.upper()} attivato per {selected}!")
-        # Avvia la lettura asincrona dell'output del monitoraggio
-        asyncio.create_task(read_monitor_output_ssh(update, context, channel, selected, monitor_type, user_id))
+            rule = get_alert_rule(selected, monitor_type)
+            details = f" (soglia {rule.trigger:.0f}%, rientro {rule.clear:.0f}%, durata minima {rule.sustain:.0f}s)" if rule else ""
+            min_interval, max_interval = get_monitor_cadence(selected, monitor_type)
+            details += f"\nControlli ogni {min_interval}-{max_interval}s, più frequenti vicino alla soglia."
+            await reply(f"✅ Monitoraggio {monitor_type.upper()} attivato per {selected}!{details}")
     except Exception as e:
         if reply:
             await reply(f"❌ Errore avvio monitoraggio {monitor_type.upper()}: {e}")
@@ -162,86 +279,92 @@ async def monitor_off(update: Update, context: ContextTypes.DEFAULT_TYPE, monito
         user_monitors = user_monitors_dict.get(user_id, {})
     else:
         user_monitors = {}
-    # Recupera il canale SSH associato al monitoraggio
-    channel = user_monitors.get(selected)
-    if not channel:
+    # Recupera la connessione associata al monitoraggio
+    connection = user_monitors.get(selected)
+    if not connection:
         # Se il monitoraggio non è attivo, avvisa l'utente
         if reply:
             await reply(f"⚠️ Monitoraggio {monitor_type.upper()} non attivo per {selected}!")
         return
 
-    # Chiude il canale SSH e rimuove il monitoraggio dalla lista
-    channel.close()
+    # Chiude il canale e la connessione SSH e rimuove il monitoraggio dalla lista
     user_monitors.pop(selected, None)
+    STATE.delete(NS_MONITOR, monitor_state_key(monitor_type, user_id, selected))
+    await asyncio.to_thread(connection.close)
+    ALERT_ENGINE.unsubscribe(selected, monitor_type, user_id)
     if reply:
         await reply(f"✅ Monitoraggio {monitor_type.upper()} disattivato per {selected}!")
 
-async def read_monitor_output_ssh(update, context, channel, selected, monitor_type, user_id):
-    # Legge l'output dello script monitor via SSH e invia in HTML tabellare
+async def read_monitor_output_ssh(bot, connection, selected, monitor_type, user_id):
+    # Legge l'output dello script monitor via SSH e passa ogni campione al motore degli alert:
+    # viene inviato un messaggio solo quando un incidente inizia o rientra, non a ogni controllo.
+    # Più monitoraggi dello stesso computer condividono l'incidente, quindi la notifica non viene duplicata
     output_block = []
-
-    # Recupera l'id della chat dove inviare i messaggi
-    chat_id = None
-    if hasattr(update, "effective_chat") and update.effective_chat:
-        chat_id = update.effective_chat.id
+    # Ultima tabella dei processi ricevuta, allegata al campione successivo
+    details = ""
+    # Riga incompleta rimasta dall'ultima lettura del canale
+    pending = ""
+    channel = connection.channel
     try:
         # Continua a leggere finché il canale SSH non segnala la fine
         while not channel.exit_status_ready():
             if channel.recv_ready():
                 # Riceve e decodifica l'output dal canale SSH
-                line = channel.recv(4096).decode()
-                for decoded_line in line.splitlines():
-                    output_block.append(decoded_line)
-                    # Quando trova il marker di fine blocco, invia il messaggio
+                pending += channel.recv(4096).decode(errors="replace")
+                *lines, pending = pending.split("\n")
+                for decoded_line in lines:
+                    # Quando trova il marker di fine blocco, conserva la tabella dei processi
                     if "===END_MONITOR_BLOCK===" in decoded_line:
-                        html_msg = (
-                            f"<b>🔔 [{selected}] Monitoraggio {monitor_type.upper()}</b>\n"
-                            f"<pre>{'\n'.join(output_block)}</pre>"
-                        )
-                        # Elimina il vecchio messaggio se esiste
-                        user_last_msgs = MONITOR_LAST_MSG[monitor_type].get(user_id, {})
-                        last_msg_id = user_last_msgs.get(selected)
-                        if chat_id and last_msg_id:
-                            try:
-                                await context.bot.delete_message(chat_id=chat_id, message_id=last_msg_id)
-                            except Exception:
-                                pass  # Il messaggio potrebbe essere già stato eliminato
-                        # Invia il nuovo messaggio con i dati aggiornati
-                        if chat_id:
-                            sent = await context.bot.send_message(chat_id=chat_id, text=html_msg, parse_mode="HTML")
-                            MONITOR_LAST_MSG[monitor_type].setdefault(user_id, {})[selected] = sent.message_id
+                        details = "\n".join(output_block).strip()
                         output_block = []
+                        continue
+                    stats = parse_stats_line(decoded_line)
+                    if stats is not None:
+                        connection.stats.update(*stats)
+                        continue
+                    sample = parse_sample_line(decoded_line)
+                    if sample is None:
+                        output_block.append(decoded_line)
+                        continue
+                    metric, value = sample
+                    event = ALERT_ENGINE.observe(selected, metric, value, details)
+                    details, output_block = "", []
+                    if event:
+                        await notify_alert_event(bot, event)
             await asyncio.sleep(0.5)
-        # Alla fine, se ci sono ancora dati non inviati, invia l'ultimo messaggio
-        if output_block and chat_id:
-            html_msg = (
-                f"<b>🔔 [{selected}] Monitoraggio {monitor_type.upper()}</b>\n"
-                f"<pre>{'\n'.join(output_block)}</pre>"
-            )
-            user_last_msgs = MONITOR_LAST_MSG[monitor_type].get(user_id, {})
-            last_msg_id = user_last_msgs.get(selected)
-            if last_msg_id:
-                try:
-                    await context.bot.delete_message(chat_id=chat_id, message_id=last_msg_id)
-                except Exception:
-                    pass
-            sent = await context.bot.send_message(chat_id=chat_id, text=html_msg, parse_mode="HTML")
-            MONITOR_LAST_MSG[monitor_type].setdefault(user_id, {})[selected] = sent.message_id
+        # Script spariti dal computer: verranno reinviati al prossimo avvio
+        if channel.recv_exit_status() == SCRIPT_NOT_FOUND:
+            invalidate_remote_scripts(selected)
     except Exception as e:
         # Logga eventuali errori nella lettura dell'output SSH
         logger.warning(f"Errore lettura output {monitor_type.upper()} monitor SSH: {e}")
     finally:
-        # Rimuove il canale SSH dalla lista dei monitoraggi attivi
-        if MONITOR_PROCESSES[monitor_type].get(user_id, None):
-            MONITOR_PROCESSES[monitor_type][user_id].pop(selected, None)
-        # Elimina il messaggio residuo alla fine del monitoraggio
-        user_last_msgs = MONITOR_LAST_MSG[monitor_type].get(user_id, {})
-        last_msg_id = user_last_msgs.pop(selected, None)
-        if chat_id and last_msg_id:
-            try:
-                await context.bot.delete_message(chat_id=chat_id, message_id=last_msg_id)
-            except Exception:
-                pass
+        # Rimuove la connessione dalla lista dei monitoraggi attivi e la chiude (anche se lo script è terminato da solo)
+        user_monitors = MONITOR_PROCESSES[monitor_type].get(user_id, {})
+        if user_monitors.get(selected) is connection:
+            user_monitors.pop(selected, None)
+            # All'arresto del bot il monitoraggio resta nello stato, per essere ripreso al riavvio
+            if not REGISTRY.closing:
+                STATE.delete(NS_MONITOR, monitor_state_key(monitor_type, user_id, selected))
+        ALERT_ENGINE.unsubscribe(selected, monitor_type, user_id)
+        # La chiusura attende il thread del trasporto SSH: viene eseguita fuori dal loop
+        await asyncio.to_thread(connection.close)
+
+# Riepilogo dei monitoraggi attivi: intervallo corrente tra i controlli e costo stimato dello script
+# sul computer monitorato (percentuale di un core)
+def render_monitor_report() -> str:
+    lines = []
+    for monitor_type, users in MONITOR_PROCESSES.items():
+        for user_id, monitors in users.items():
+            for selected, connection in monitors.items():
+                stats = connection.stats
+                interval = f"ogni {stats.interval}s" if stats.interval is not None else "in avvio"
+                overhead = stats.overhead()
+                cost = f", costo {overhead:.2f}% CPU" if overhead is not None else ""
+                lines.append(f"• {html.escape(selected)} {monitor_type.upper()} (utente {user_id}): {interval}, {stats.samples} controlli{cost}")
+    if not lines:
+        return ""
+    return "\n<b>Monitoraggi attivi</b>\n" + "\n".join(lines)
 
 # --- Handler unici e semplici ---
 
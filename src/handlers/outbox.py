@@ -0,0 +1,207 @@
+import time
+import asyncio
+import datetime
+import itertools
+from asyncio.log import logger
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config.config import (
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GROUP_RATE_PER_MIN, OUTBOX_MAX_RETRIES
+)
+
+# Priorità degli invii (valore più basso = servito prima), da passare come rate_limit_args ai metodi del bot:
+# es. bot.send_message(..., rate_limit_args=SEND_ALERT). Senza indicazione un invio è interattivo
+SEND_INTERACTIVE = 0   # risposte ai comandi e ai pulsanti
+SEND_ALERT = 1         # notifiche di alert e anomalie
+SEND_REFRESH = 2       # aggiornamenti periodici (dashboard, riepiloghi)
+
+SEND_PRIORITY_NAMES = {SEND_INTERACTIVE: "interattivo", SEND_ALERT: "alert", SEND_REFRESH: "aggiornamento"}
+
+# Metodi dell'API soggetti ai limiti di invio di Telegram (messaggi, modifiche, cancellazioni)
+PACED_PREFIXES = ("send", "edit", "copy", "forward", "delete")
+# Modifiche di un messaggio: una modifica ancora in coda viene sostituita da una più recente dello stesso tipo
+EDIT_ENDPOINTS = ("editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup")
+
+# Secchiello di gettoni: consente brevi raffiche fino a capacity, poi un invio ogni 1/rate secondi
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Istante (monotonic) da cui è disponibile un gettone
+    def ready_at(self, now: float) -> float:
+        self._refill(now)
+        return now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+# Invio in attesa del proprio turno
+@dataclass(order=True)
+class PendingSend:
+    priority: int
+    seq: int
+    chat_id: Any = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    coalesce_key: Optional[Tuple] = field(compare=False, default=None)
+
+# Sollevata (internamente) quando una modifica in coda viene sostituita da una più recente
+class Superseded(Exception):
+    pass
+
+# Coda unica dei messaggi in uscita: tutte le chiamate all'API del bot passano da qui (Application.builder().rate_limiter).
+# Gli invii vengono distribuiti rispettando un limite globale e uno per chat; quando più invii attendono
+# parte per primo quello con priorità più alta. Un RetryAfter sospende tutti gli invii per il tempo indicato
+# da Telegram e l'invio viene ripetuto, invece di perdere il messaggio
+class Outbox(BaseRateLimiter[int]):
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int, group_rate_per_min: float, max_retries: int):
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_min / 60
+        self.max_retries = max_retries
+        self.chat_buckets: Dict[Any, TokenBucket] = {}
+        self.pending: List[PendingSend] = []
+        self.coalescing: Dict[Tuple, PendingSend] = {}
+        self.seq = itertools.count()
+        self.paused_until = 0.0
+        self.wakeup: Optional[asyncio.Event] = None
+        self.dispatcher: Optional[asyncio.Task] = None
+        # Statistiche: invii per priorità, modifiche sostituite, RetryAfter ricevuti
+        self.sent: Dict[int, int] = {}
+        self.superseded = 0
+        self.flood_waits = 0
+
+    async def initialize(self):
+        self.wakeup = asyncio.Event()
+        self.dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def shutdown(self):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            await asyncio.gather(self.dispatcher, return_exceptions=True)
+            self.dispatcher = None
+        for pending in self.pending:
+            if not pending.future.done():
+                pending.future.cancel()
+        self.pending.clear()
+        self.coalescing.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Gli id dei gruppi sono negativi
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            bucket = TokenBucket(self.group_rate, 1) if is_group else TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    # Sceglie il prossimo invio: il più prioritario tra quelli la cui chat ha un gettone disponibile.
+    # Restituisce (invio, None) oppure (None, secondi da attendere)
+    def _next(self, now: float):
+        self.pending = [p for p in self.pending if not p.future.done()]
+        if not self.pending:
+            return None, None
+        wait_global = max(self.global_bucket.ready_at(now), self.paused_until) - now
+        if wait_global > 0:
+            return None, wait_global
+        best, wait = None, None
+        for pending in self.pending:
+            ready_at = self._chat_bucket(pending.chat_id).ready_at(now) if pending.chat_id is not None else now
+            if ready_at <= now:
+                if best is None or pending < best:
+                    best = pending
+            elif wait is None or ready_at - now < wait:
+                wait = ready_at - now
+        return best, wait
+
+    async def _dispatch_loop(self):
+        while True:
+            now = time.monotonic()
+            pending, wait = self._next(now)
+            if pending is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.pending.remove(pending)
+            self.global_bucket.take(now)
+            if pending.chat_id is not None:
+                self._chat_bucket(pending.chat_id).take(now)
+            pending.future.set_result(None)
+
+    # Attende il turno dell'invio. Solleva Superseded se nel frattempo arriva una modifica più recente
+    # dello stesso messaggio
+    async def _wait_turn(self, chat_id, priority: int, coalesce_key: Optional[Tuple]):
+        pending = PendingSend(priority, next(self.seq), chat_id, asyncio.get_running_loop().create_future(), coalesce_key)
+        if coalesce_key is not None:
+            previous = self.coalescing.get(coalesce_key)
+            if previous is not None and not previous.future.done():
+                previous.future.set_exception(Superseded())
+            self.coalescing[coalesce_key] = pending
+        self.pending.append(pending)
+        self.wakeup.set()
+        try:
+            await pending.future
+        finally:
+            if coalesce_key is not None and self.coalescing.get(coalesce_key) is pending:
+                del self.coalescing[coalesce_key]
+
+    async def process_request(self, callback, args, kwargs, endpoint: str, data: Dict[str, Any], rate_limit_args: Optional[int]):
+        if not endpoint.startswith(PACED_PREFIXES) or self.dispatcher is None:
+            return await callback(*args, **kwargs)
+        priority = rate_limit_args if rate_limit_args is not None else SEND_INTERACTIVE
+        chat_id = data.get("chat_id")
+        coalesce_key = None
+        if endpoint in EDIT_ENDPOINTS and data.get("message_id") is not None:
+            coalesce_key = (endpoint, chat_id, data["message_id"])
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._wait_turn(chat_id, priority, coalesce_key)
+            except Superseded:
+                # La modifica non serve più: la risposta è quella di una modifica riuscita senza messaggio
+                self.superseded += 1
+                return True
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, datetime.timedelta) else float(e.retry_after)
+                self.flood_waits += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                self.wakeup.set()
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood control di Telegram su {endpoint} (chat {chat_id}): invii sospesi per {delay:.0f} s")
+                continue
+            self.sent[priority] = self.sent.get(priority, 0) + 1
+            return result
+
+    # Statistiche correnti della coda
+    def stats(self) -> Dict[str, Any]:
+        waiting: Dict[str, int] = {}
+        for pending in self.pending:
+            if not pending.future.done():
+                name = SEND_PRIORITY_NAMES.get(pending.priority, str(pending.priority))
+                waiting[name] = waiting.get(name, 0) + 1
+        return {
+            "waiting": waiting,
+            "sent": {SEND_PRIORITY_NAMES.get(p, str(p)): n for p, n in self.sent.items()},
+            "superseded": self.superseded,
+            "flood_waits": self.flood_waits,
+            "paused_for": max(self.paused_until - time.monotonic(), 0.0),
+        }
+
+# Istanza condivisa, da passare ad Application.builder().rate_limiter()
+OUTBOX = Outbox(OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GROUP_RATE_PER_MIN, OUTBOX_MAX_RETRIES)
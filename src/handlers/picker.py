@@ -0,0 +1,135 @@
+import time
+import html
+import asyncio
+from typing import Dict, Any, List, Optional
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import ContextTypes
+from config.config import MONITORED_COMPUTERS, PICKER_PAGE_SIZE, PICKER_STATUS_MAX_AGE
+from .utils import check_admin, probe_host
+from .health import BREAKER
+
+# Numero massimo di risultati restituiti da una ricerca inline (limite di Telegram)
+INLINE_RESULTS_LIMIT = 50
+
+# Restituisce i computer che hanno il tag indicato e il cui nome (o IP) inizia con il testo cercato
+def filter_computers(search: str = "", tag: Optional[str] = None) -> List[Dict[str, Any]]:
+    search = search.lower()
+    return [
+        computer for computer in MONITORED_COMPUTERS
+        if (not tag or tag in computer.get("tags", []))
+        and (not search or computer["name"].lower().startswith(search) or computer["ip"].startswith(search))
+    ]
+
+# Tutti i tag usati dai computer monitorati, in ordine alfabetico
+def get_all_tags() -> List[str]:
+    return sorted({tag for computer in MONITORED_COMPUTERS for tag in computer.get("tags", [])})
+
+# Emoji di stato dal risultato già noto (🟢 raggiungibile, 🔴 irraggiungibile, ⚪ sconosciuto)
+def cached_badge(computer: Dict[str, Any]) -> str:
+    available = BREAKER.is_available(computer["name"])
+    if available is None:
+        return "⚪"
+    return "🟢" if available else "🔴"
+
+# Emoji di stato per i computer della pagina: se lo stato registrato è recente viene riutilizzato,
+# altrimenti viene verificato (in parallelo, solo per i computer visibili)
+async def get_page_badges(computers: List[Dict[str, Any]]) -> List[str]:
+    now = time.time()
+    stale = [
+        computer for computer in computers
+        if now - (BREAKER.last_checked(computer["name"]) or 0) > PICKER_STATUS_MAX_AGE
+    ]
+    if stale:
+        await asyncio.gather(*(probe_host(computer) for computer in stale))
+    return [cached_badge(computer) for computer in computers]
+
+# Stato del selettore dell'utente (pagina, tag e testo cercato)
+def get_picker_state(context: ContextTypes.DEFAULT_TYPE) -> Dict[str, Any]:
+    return context.user_data.setdefault("picker", {"page": 0, "tag": None, "search": ""})
+
+# Costruisce la tastiera di selezione con una pagina di computer, i tag e i pulsanti di navigazione
+async def get_computer_keyboard(state: Dict[str, Any]) -> List[List[InlineKeyboardButton]]:
+    computers = filter_computers(state["search"], state["tag"])
+    pages = max((len(computers) + PICKER_PAGE_SIZE - 1) // PICKER_PAGE_SIZE, 1)
+    state["page"] = min(max(state["page"], 0), pages - 1)
+    visible = computers[state["page"] * PICKER_PAGE_SIZE:(state["page"] + 1) * PICKER_PAGE_SIZE]
+
+    keyboard = []
+    for computer, badge in zip(visible, await get_page_badges(visible)):
+        keyboard.append([InlineKeyboardButton(
+            f"{badge} {computer['name']} ({computer['ip']})",
+            callback_data=f"select_computer:{computer['name']}"
+        )])
+
+    # Raggruppamento per tag: il tag attivo è evidenziato
+    tags = get_all_tags()
+    if len(tags) > 1:
+        row = [InlineKeyboardButton("✅ Tutti" if not state["tag"] else "Tutti", callback_data="picker:tag:")]
+        for tag in tags:
+            row.append(InlineKeyboardButton(f"✅ {tag}" if tag == state["tag"] else tag, callback_data=f"picker:tag:{tag}"[:64]))
+        # Al massimo 4 tag per riga
+        keyboard.extend(row[i:i + 4] for i in range(0, len(row), 4))
+
+    if pages > 1:
+        keyboard.append([
+            InlineKeyboardButton("⬅️", callback_data=f"picker:page:{state['page'] - 1}"),
+            InlineKeyboardButton(f"{state['page'] + 1}/{pages}", callback_data="picker:noop"),
+            InlineKeyboardButton("➡️", callback_data=f"picker:page:{state['page'] + 1}"),
+        ])
+    if state["search"]:
+        keyboard.append([InlineKeyboardButton(f"✖️ Rimuovi filtro \"{state['search']}\"", callback_data="picker:clear")])
+    return keyboard
+
+# Testo del messaggio di selezione con i filtri attivi
+def render_picker_text(state: Dict[str, Any]) -> str:
+    text = "💻 Seleziona il computer da monitorare:"
+    count = len(filter_computers(state["search"], state["tag"]))
+    if state["search"] or state["tag"]:
+        text += f"\n<i>{count} computer"
+        if state["tag"]:
+            text += f" con tag {html.escape(state['tag'])}"
+        if state["search"]:
+            text += f" che iniziano per \"{html.escape(state['search'])}\""
+        text += "</i>"
+    if count == 0:
+        text += "\n❗ Nessun computer trovato."
+    return text
+
+# Gestisce i pulsanti del selettore (callback "picker:<azione>[:valore]")
+async def picker_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str):
+    state = get_picker_state(context)
+    name, _, value = action.partition(":")
+    if name == "noop":
+        return
+    if name == "page":
+        state["page"] = int(value) if value.lstrip("-").isdigit() else 0
+    elif name == "tag":
+        state.update({"tag": value or None, "page": 0})
+    elif name == "clear":
+        state.update({"search": "", "page": 0})
+    keyboard = await get_computer_keyboard(state)
+    await update.callback_query.edit_message_text(render_picker_text(state), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
+
+# Ricerca inline (@bot testo): propone i computer il cui nome inizia con il testo, con lo stato già noto.
+# Richiede la modalità inline attiva per il bot (BotFather, /setinline)
+async def inline_host_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, context):
+        return
+    search = update.inline_query.query.strip()
+    tag = None
+    if search.lower().startswith("tag="):
+        tag, _, search = search[4:].partition(" ")
+    results = []
+    for computer in filter_computers(search.strip(), tag or None)[:INLINE_RESULTS_LIMIT]:
+        tags = ", ".join(computer.get("tags", []))
+        results.append(InlineQueryResultArticle(
+            id=computer["name"][:64],
+            title=f"{cached_badge(computer)} {computer['name']}",
+            description=f"{computer['ip']}" + (f" • {tags}" if tags else ""),
+            # Solo testo: i menu delle operazioni rispondono al messaggio del pulsante, che per i messaggi
+            # inviati in modalità inline non è disponibile (c'è solo inline_message_id)
+            input_message_content=InputTextMessageContent(
+                f"💻 Computer: {computer['name']} ({computer['ip']})\nUsa /menu in chat con il bot per selezionarlo."
+            ),
+        ))
+    await update.inline_query.answer(results, cache_time=0, is_personal=True)
@@ -0,0 +1,99 @@
+import asyncio
+import random
+import time
+from asyncio.log import logger
+from typing import Dict, Any, Tuple
+from telegram.ext import Application, ContextTypes
+from config.config import (
+    MONITORED_COMPUTERS, PRECOLLECT_ENABLED, PRECOLLECT_TARGETS, PRECOLLECT_TICK,
+    PRECOLLECT_JITTER, PRECOLLECT_MAX_PER_HOST, PRECOLLECT_MAX_BACKOFF
+)
+from .utils import run_admin_command
+from .history import store_snapshot
+from .graphs import refresh_host_series
+from .snapshot import fetch_host_snapshot, get_latest_snapshot
+from .scheduler import PRIORITY_BACKGROUND, QueueFullError
+from .health import HostUnavailableError
+from .lifecycle import spawn
+
+# Stato della pre-raccolta per ogni computer:
+# {computer_name: {"failures": int, "next_due": {target: epoch}}}
+PRECOLLECT_STATE: Dict[str, Dict[str, Any]] = {}
+
+# Semafori che limitano le raccolte contemporanee sullo stesso computer
+HOST_SEMAPHORES: Dict[str, asyncio.Semaphore] = {}
+
+# Raccolte in corso, per non avviarne due uguali e per mantenere un riferimento ai task
+IN_FLIGHT: Dict[Tuple[str, str], asyncio.Task] = {}
+
+# Applica all'intervallo una variazione casuale di ±PRECOLLECT_JITTER
+def _with_jitter(interval: float) -> float:
+    return interval * (1 + random.uniform(-PRECOLLECT_JITTER, PRECOLLECT_JITTER))
+
+# Calcola tra quanti secondi ripetere la raccolta, raddoppiando l'intervallo
+# per ogni fallimento consecutivo del computer (back-off esponenziale)
+def _next_interval(target: str, failures: int) -> float:
+    interval = PRECOLLECT_TARGETS[target]
+    if failures:
+        interval = min(interval * (2 ** failures), max(PRECOLLECT_MAX_BACKOFF, interval))
+    return _with_jitter(interval)
+
+# Esegue una singola raccolta e aggiorna lo stato del computer
+async def collect_target(computer: Dict[str, Any], target: str):
+    name = computer["name"]
+    state = PRECOLLECT_STATE.setdefault(name, {"failures": 0, "next_due": {}})
+    semaphore = HOST_SEMAPHORES.setdefault(name, asyncio.Semaphore(PRECOLLECT_MAX_PER_HOST))
+
+    async with semaphore:
+        try:
+            if target == "cpu_history":
+                await refresh_host_series(computer, PRIORITY_BACKGROUND)
+            elif target in ("procstats", "resources"):
+                # Un unico snapshot aggiorna sia iostat/vmstat sia la vista "Risorse" (salvata da fetch_host_snapshot):
+                # se l'altra raccolta ne ha appena letto uno abbastanza recente, non serve ripetere il lavoro remoto
+                if get_latest_snapshot(name, PRECOLLECT_TARGETS[target]) is None:
+                    await fetch_host_snapshot(computer, PRIORITY_BACKGROUND)
+            else:
+                output = await run_admin_command(computer, target, PRIORITY_BACKGROUND)
+                store_snapshot(name, target, output)
+            state["failures"] = 0
+        except QueueFullError:
+            # Lo scheduler è saturo di richieste: la raccolta viene solo rimandata, il computer non è in errore
+            pass
+        except HostUnavailableError:
+            # Computer già noto come irraggiungibile: il controllo è immediato e non aggrava il back-off,
+            # così la raccolta riparte appena la verifica in background lo rimette in prova
+            pass
+        except Exception as e:
+            # Il computer non risponde: il back-off vale per tutte le raccolte del computer
+            state["failures"] += 1
+            logger.info(f"Pre-raccolta '{target}' fallita su {name} ({state['failures']} errori consecutivi): {e}")
+        finally:
+            state["next_due"][target] = time.time() + _next_interval(target, state["failures"])
+
+# Job periodico: avvia le raccolte scadute su tutti i computer monitorati
+async def precollect_tick(context: ContextTypes.DEFAULT_TYPE):
+    now = time.time()
+    for computer in MONITORED_COMPUTERS:
+        name = computer["name"]
+        state = PRECOLLECT_STATE.setdefault(name, {"failures": 0, "next_due": {}})
+        for target in PRECOLLECT_TARGETS:
+            key = (name, target)
+            if key in IN_FLIGHT:
+                continue
+            # La prima raccolta di ogni comando viene distribuita casualmente nel primo intervallo
+            due = state["next_due"].setdefault(target, now + random.uniform(0, PRECOLLECT_TICK * 3))
+            if due > now:
+                continue
+            task = spawn(collect_target(computer, target), name, f"pre-raccolta {target}")
+            IN_FLIGHT[key] = task
+            task.add_done_callback(lambda _, key=key: IN_FLIGHT.pop(key, None))
+
+# Registra il job di pre-raccolta sulla job queue dell'applicazione
+def start_precollect(app: Application):
+    if not PRECOLLECT_ENABLED or not PRECOLLECT_TARGETS:
+        return
+    if app.job_queue is None:
+        logger.warning("JobQueue non disponibile: installare python-telegram-bot[job-queue] per la pre-raccolta.")
+        return
+    app.job_queue.run_repeating(precollect_tick, interval=PRECOLLECT_TICK, first=PRECOLLECT_TICK, name="precollect")
@@ -0,0 +1,127 @@
+import re
+import time
+import html
+from telegram import Update
+from telegram.ext import ContextTypes
+from config.config import MONITORED_COMPUTERS
+from .utils import find_computer_by_name, truncate_message, format_age, get_refresh_keyboard
+from .scheduler import QueueFullError
+from .health import HostUnavailableError
+from .snapshot import HostSnapshot, ensure_snapshot_pair
+
+# Partizioni e dispositivi virtuali esclusi dalla tabella, come fa iostat
+PARTITION_RE = re.compile(r"^((sd|vd|xvd|hd)[a-z]+\d+|(nvme\d+n\d+|mmcblk\d+)p\d+)$")
+VIRTUAL_DEVICE_RE = re.compile(r"^(loop|ram|zram|fd)\d*")
+
+# Colonne della tabella I/O (le stesse mostrate da "iostat -x")
+IOSTAT_COLUMNS = ["r/s", "rkB/s", "rrqm/s", "%rrqm", "r_await", "rareq-sz", "w/s", "wkB/s", "wrqm/s", "%wrqm", "w_await"]
+
+# Calcola le statistiche I/O per disco, con le stesse colonne di "iostat -x"
+def compute_iostat(previous: HostSnapshot, latest: HostSnapshot) -> str:
+    elapsed = latest.uptime - previous.uptime
+    lines = [f"{'Device':<10} " + " ".join(f"{c:>8}" for c in IOSTAT_COLUMNS)]
+    for device, new in latest.diskstats.items():
+        old = previous.diskstats.get(device)
+        if old is None or PARTITION_RE.match(device) or VIRTUAL_DEVICE_RE.match(device) or not any(new):
+            continue
+        delta = [n - o for n, o in zip(new, old)]
+        reads, reads_merged, sectors_read, ms_reading = delta[0], delta[1], delta[2], delta[3]
+        writes, writes_merged, sectors_written, ms_writing = delta[4], delta[5], delta[6], delta[7]
+        values = [
+            reads / elapsed,
+            sectors_read / 2 / elapsed,  # I settori in /proc/diskstats sono sempre da 512 byte
+            reads_merged / elapsed,
+            reads_merged * 100 / (reads + reads_merged) if reads + reads_merged else 0,
+            ms_reading / reads if reads else 0,
+            sectors_read / 2 / reads if reads else 0,
+            writes / elapsed,
+            sectors_written / 2 / elapsed,
+            writes_merged / elapsed,
+            writes_merged * 100 / (writes + writes_merged) if writes + writes_merged else 0,
+            ms_writing / writes if writes else 0,
+        ]
+        lines.append(f"{device:<10} " + " ".join(f"{v:>8.2f}" for v in values))
+    return "\n".join(lines)
+
+# Calcola una riga di statistiche con le stesse colonne di "vmstat"
+def compute_vmstat(previous: HostSnapshot, latest: HostSnapshot) -> str:
+    elapsed = latest.uptime - previous.uptime
+    stat_old, stat_new = previous.stat, latest.stat
+    vm_old, vm_new = previous.vmstat, latest.vmstat
+    mem = latest.meminfo
+    page_kb = latest.pagesize / 1024
+
+    # Tempi CPU: user nice system idle iowait irq softirq steal
+    cpu = [n - o for n, o in zip(stat_new.get("cpu", []), stat_old.get("cpu", []))] + [0] * 8
+    cpu_total = sum(cpu[:8]) or 1
+
+    def rate(key):
+        return (vm_new.get(key, 0) - vm_old.get(key, 0)) / elapsed
+
+    values = {
+        "r": stat_new.get("procs_running", 0),
+        "b": stat_new.get("procs_blocked", 0),
+        "swpd": mem.get("SwapTotal", 0) - mem.get("SwapFree", 0),
+        "free": mem.get("MemFree", 0),
+        "buff": mem.get("Buffers", 0),
+        "cache": mem.get("Cached", 0) + mem.get("SReclaimable", 0),
+        "si": rate("pswpin") * page_kb,
+        "so": rate("pswpout") * page_kb,
+        "bi": rate("pgpgin"),
+        "bo": rate("pgpgout"),
+        "in": (stat_new.get("intr", 0) - stat_old.get("intr", 0)) / elapsed,
+        "cs": (stat_new.get("ctxt", 0) - stat_old.get("ctxt", 0)) / elapsed,
+        "us": (cpu[0] + cpu[1]) * 100 / cpu_total,
+        "sy": (cpu[2] + cpu[5] + cpu[6]) * 100 / cpu_total,
+        "id": cpu[3] * 100 / cpu_total,
+        "wa": cpu[4] * 100 / cpu_total,
+        "st": cpu[7] * 100 / cpu_total,
+    }
+    widths = {"swpd": 8, "free": 8, "buff": 8, "cache": 8, "in": 6, "cs": 6}
+    header = " ".join(f"{k:>{widths.get(k, 4)}}" for k in values)
+    row = " ".join(f"{round(v):>{widths.get(k, 4)}}" for k, v in values.items())
+    return (
+        "procs -----------------memory---------------- ---swap-- -----io---- ---system--- ------cpu-----\n"
+        f"{header}\n{row}"
+    )
+
+# Viste disponibili: callback -> (titolo, funzione di calcolo)
+PROC_STAT_VIEWS = {
+    "iostat": ("📊 STATISTICHE I/O DISCHI\n--------------------------", compute_iostat),
+    "vmstat": ("📊 STATISTICHE MEMORIA VIRTUALE\n-------------------------------", compute_vmstat),
+}
+
+# Risponde ai pulsanti iostat/vmstat calcolando le velocità dagli ultimi due snapshot del computer.
+# Se gli snapshot mancano o sono vecchi (o force=True) ne legge di nuovi prima di rispondere
+async def send_proc_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, view: str, force: bool = False):
+    query = update.callback_query
+    selected = context.user_data.get("selected_computer") if context.user_data else None
+    computer = find_computer_by_name(MONITORED_COMPUTERS, selected) if selected else None
+    if computer is None:
+        await query.edit_message_text("❗ Devi prima selezionare un computer.")
+        return
+
+    try:
+        pair = await ensure_snapshot_pair(computer, force)
+    except HostUnavailableError as e:
+        await query.edit_message_text(f"⛔ {e}")
+        return
+    except QueueFullError:
+        await query.edit_message_text(f"🚦 Troppe operazioni in coda per {selected}, riprova tra poco.")
+        return
+    except Exception:
+        await query.edit_message_text("❌ Il computer non è raggiungibile.")
+        return
+    if pair is None:
+        await query.edit_message_text("❌ Impossibile calcolare le statistiche: campioni non validi.")
+        return
+
+    previous, latest = pair
+    title, compute = PROC_STAT_VIEWS[view]
+    output = f"{title}\n{compute(previous, latest)}"
+    footer = (
+        f"\n<i>🕒 Media su {latest.uptime - previous.uptime:.0f} s, "
+        f"campione di {format_age(time.time() - latest.collected)} fa</i>"
+    )
+    text = f"<pre>{truncate_message(html.escape(output), html_tag_len=120)}</pre>{footer}"
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=get_refresh_keyboard(view))
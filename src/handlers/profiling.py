@@ -0,0 +1,199 @@
+import io
+import os
+import sys
+import time
+import html
+import asyncio
+import threading
+from asyncio.log import logger
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+from config.config import (
+    WATCHDOG_ENABLED, WATCHDOG_INTERVAL, WATCHDOG_LAG_THRESHOLD, PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL
+)
+from .utils import check_admin
+from .lifecycle import spawn
+from .charts import render_encoding_summary
+
+# Durata predefinita (secondi) di un campionamento con /profilo
+PROFILE_DEFAULT_SECONDS = 10
+# Numero di frame mostrati per ogni blocco nel riepilogo
+STACK_PREVIEW_FRAMES = 6
+
+# Blocco del loop rilevato dal watchdog, con lo stack del codice che lo stava bloccando
+@dataclass
+class LagEvent:
+    started: float           # epoch di inizio del blocco (ultimo battito ricevuto)
+    captured_after: float    # secondi di blocco al momento della cattura dello stack
+    duration: float = 0.0    # durata totale del blocco (nota quando il loop riparte)
+    stack: str = ""
+
+# Controllo del ritardo del loop asyncio: un task batte a intervalli regolari e misura quanto in ritardo
+# viene risvegliato; un thread separato si accorge quando i battiti si fermano e legge lo stack del thread
+# del loop mentre è ancora bloccato (dopo sarebbe troppo tardi per vedere il colpevole)
+class LoopWatchdog:
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.loop_thread_id: Optional[int] = None
+        self.last_beat = time.monotonic()
+        # Ritardi misurati sugli ultimi battiti (circa un minuto con l'intervallo predefinito)
+        self.lags: Deque[float] = deque(maxlen=600)
+        self.events: Deque[LagEvent] = deque(maxlen=20)
+        self.current: Optional[LagEvent] = None
+        self.stop = threading.Event()
+
+    # Task del loop: il ritardo è il tempo trascorso oltre l'intervallo richiesto
+    async def heartbeat(self):
+        # Il battito iniziale va registrato prima di rendere visibile il thread: altrimenti il controllo
+        # misurerebbe il tempo trascorso dalla creazione del watchdog e segnalerebbe un blocco inesistente
+        self.last_beat = time.monotonic()
+        self.loop_thread_id = threading.get_ident()
+        try:
+            while True:
+                start = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self.lags.append(max(now - start - self.interval, 0.0))
+                self.last_beat = now
+                event, self.current = self.current, None
+                if event is not None:
+                    event.duration = now - start - self.interval
+                    logger.warning(f"Loop asyncio bloccato per {event.duration:.2f} s")
+        finally:
+            # Senza battiti il thread di controllo segnalerebbe un blocco inesistente
+            self.stop.set()
+
+    # Thread di controllo: cattura lo stack una sola volta per blocco
+    def watch(self):
+        while not self.stop.wait(self.interval):
+            stalled = time.monotonic() - self.last_beat
+            if stalled < self.threshold or self.current is not None or self.loop_thread_id is None:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(format_frames(frame))
+            self.current = LagEvent(time.time() - stalled, stalled, stack=stack)
+            self.events.append(self.current)
+            logger.warning(f"Loop asyncio fermo da {stalled:.2f} s, stack del codice bloccante:\n{stack}")
+
+    def start(self):
+        spawn(self.heartbeat(), "bot", "watchdog del loop")
+        threading.Thread(target=self.watch, name="loop-watchdog", daemon=True).start()
+
+    # Percentile del ritardo misurato (secondi), None se non ci sono ancora battiti
+    def lag_percentile(self, q: float) -> Optional[float]:
+        if not self.lags:
+            return None
+        values = sorted(self.lags)
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+# Istanza condivisa
+WATCHDOG = LoopWatchdog(WATCHDOG_INTERVAL, WATCHDOG_LAG_THRESHOLD)
+
+# Righe "file:riga in funzione" dello stack, dalla chiamata più esterna alla più interna
+def format_frames(frame) -> List[str]:
+    lines = []
+    while frame is not None:
+        code = frame.f_code
+        lines.append(f"  {os.path.basename(code.co_filename)}:{frame.f_lineno} in {code.co_name}\n")
+        frame = frame.f_back
+    return lines[::-1]
+
+# Nome di un frame nel formato "collapsed stack" (modulo:funzione), senza il numero di riga
+# per raggruppare i campioni della stessa funzione
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}"
+
+# Campiona gli stack di tutti i thread del processo per la durata richiesta e li aggrega nel formato
+# "collapsed stack" (una riga "thread;frame;...;frame conteggio"), leggibile da flamegraph.pl e speedscope.
+# La funzione è bloccante: va eseguita in un thread separato
+def sample_stacks(seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL) -> Counter:
+    own_id = threading.get_ident()
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+    return stacks
+
+# Contenuto del file "collapsed stack", dalle righe più frequenti
+def render_collapsed(stacks: Counter) -> bytes:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()).encode()
+
+# Riepilogo del watchdog, delle funzioni più presenti nei campioni del thread del loop e delle ultime codifiche dei grafici
+def render_profile_summary(stacks: Counter, seconds: float) -> str:
+    lines = [f"🩺 <b>Profilo di {seconds:.0f} s</b>"]
+    p50, p99 = WATCHDOG.lag_percentile(0.5), WATCHDOG.lag_percentile(0.99)
+    if p50 is not None:
+        lines.append(f"Ritardo del loop: mediana {p50 * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms")
+    # Funzione più interna di ogni campione del thread principale (quello del loop)
+    main_thread = threading.main_thread().name
+    leaves: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        if frames[0] == main_thread:
+            leaves[frames[-1]] += count
+    total = sum(leaves.values())
+    if total:
+        lines.append("\n<b>Funzioni più presenti nel loop:</b>")
+        for label, count in leaves.most_common(5):
+            lines.append(f"• <code>{html.escape(label)}</code> {count * 100 / total:.0f}%")
+    blocks = [e for e in WATCHDOG.events if e.duration or e is WATCHDOG.current]
+    if blocks:
+        lines.append(f"\n<b>Ultimi blocchi del loop</b> (oltre {WATCHDOG.threshold:.1f} s):")
+        for event in list(blocks)[-3:]:
+            when = time.strftime("%H:%M:%S", time.localtime(event.started))
+            duration = f"{event.duration:.2f} s" if event.duration else "in corso"
+            stack = "".join(event.stack.splitlines(keepends=True)[-STACK_PREVIEW_FRAMES:])
+            lines.append(f"{when} — {duration}\n<pre>{html.escape(stack)}</pre>")
+    # Costo della codifica dei grafici, eseguita nei thread
+    encoding = render_encoding_summary()
+    if encoding:
+        lines.append(encoding)
+    return "\n".join(lines)
+
+# Comando /profilo [secondi]: campiona il processo in esecuzione e invia il file con gli stack aggregati
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_admin(update, context):
+        return
+    if update.message is None:
+        return
+    seconds = PROFILE_DEFAULT_SECONDS
+    if context.args and context.args[0].isdigit():
+        seconds = int(context.args[0])
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+    await update.message.reply_text(f"⏳ Campionamento in corso per {seconds} s...")
+    # Il campionamento avviene in un thread: il loop continua a lavorare normalmente e viene misurato
+    stacks = await asyncio.to_thread(sample_stacks, seconds)
+    buf = io.BytesIO(render_collapsed(stacks))
+    buf.name = f"profilo-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    await update.message.reply_document(buf, caption=f"{sum(stacks.values())} campioni, formato collapsed stack (flamegraph.pl, speedscope)")
+    await update.message.reply_text(render_profile_summary(stacks, seconds), parse_mode="HTML")
+
+# Avvia il watchdog appena l'applicazione è in esecuzione (serve il loop attivo)
+async def start_watchdog_job(context: ContextTypes.DEFAULT_TYPE):
+    WATCHDOG.start()
+
+# Registra l'avvio del watchdog del loop sulla job queue dell'applicazione
+def start_loop_watchdog(app: Application):
+    if not WATCHDOG_ENABLED:
+        return
+    if app.job_queue is None:
+        logger.warning("JobQueue non disponibile: il controllo del ritardo del loop è disattivato.")
+        return
+    app.job_queue.run_once(start_watchdog_job, when=0, name="loop_watchdog")
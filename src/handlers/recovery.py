@@ -0,0 +1,113 @@
+import asyncio
+from asyncio.log import logger
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+from telegram.error import TelegramError
+from telegram.ext import Application
+from config.config import MONITORED_COMPUTERS, STATE_RESTORE_MONITORS
+from .utils import find_computer_by_name
+from .state import STATE, NS_SELECTION, NS_MONITOR, NS_DASHBOARD, NS_HEALTH, NS_SNAPSHOT, NS_CACHE, split_pair_key
+from .history import SNAPSHOTS
+from .cache import COMMAND_CACHE
+from .health import BREAKER
+from .monitor import attach_monitor, monitor_state_key
+from .outbox import SEND_ALERT
+from .lifecycle import spawn
+
+# Ripristina i dati in memoria salvati prima del riavvio: selezioni degli utenti, stato dei computer,
+# ultimi output dei comandi e cache. Le voci di computer non più configurati vengono scartate
+def restore_memory(app: Application) -> Dict[str, int]:
+    names = {computer["name"] for computer in MONITORED_COMPUTERS}
+    restored = defaultdict(int)
+    for user_id, selected in STATE.load(NS_SELECTION).items():
+        if selected in names and user_id.lstrip("-").isdigit():
+            app.user_data[int(user_id)]["selected_computer"] = selected
+            restored["selezioni"] += 1
+        else:
+            STATE.delete(NS_SELECTION, user_id)
+    for host, values in STATE.load(NS_HEALTH).items():
+        if host in names:
+            BREAKER.restore(host, values)
+            restored["computer"] += 1
+        else:
+            STATE.delete(NS_HEALTH, host)
+    for key, snapshot in STATE.load(NS_SNAPSHOT).items():
+        host, command = split_pair_key(key)
+        if host in names:
+            SNAPSHOTS[(host, command)] = snapshot
+            restored["snapshot"] += 1
+        else:
+            STATE.delete(NS_SNAPSHOT, key)
+    # Le voci più vecchie entrano per prime, così restano le prime a essere eliminate
+    entries = sorted(STATE.load(NS_CACHE).items(), key=lambda item: item[1]["ts"])
+    for key, entry in entries:
+        host, command = split_pair_key(key)
+        if host in names:
+            COMMAND_CACHE.restore(host, command, entry["output"], entry["ts"])
+            restored["cache"] += 1
+        else:
+            STATE.delete(NS_CACHE, key)
+    return dict(restored)
+
+async def notify(app: Application, chat_id: int, text: str):
+    try:
+        await app.bot.send_message(chat_id=chat_id, text=text, rate_limit_args=SEND_ALERT)
+    except TelegramError as e:
+        logger.warning(f"Notifica di ripristino alla chat {chat_id} non riuscita: {e}")
+
+# Riavvia i monitoraggi dello stesso computer e tipo uno alla volta: solo il primo chiude gli script
+# rimasti in esecuzione dal processo precedente (il canale SSH originale non è recuperabile)
+async def resume_monitor_group(app: Application, host: str, monitor_type: str, entries: List[Dict[str, Any]]):
+    computer = find_computer_by_name(MONITORED_COMPUTERS, host)
+    for index, entry in enumerate(entries):
+        key = monitor_state_key(monitor_type, entry["user_id"], host)
+        connection = None
+        if computer is not None:
+            try:
+                connection = await attach_monitor(app.bot, computer, monitor_type, entry["user_id"], entry["chat_id"], cleanup=index == 0)
+            except Exception as e:
+                logger.warning(f"Ripristino del monitoraggio {monitor_type} di {host} non riuscito: {e}")
+        if connection is None:
+            STATE.delete(NS_MONITOR, key)
+            await notify(app, entry["chat_id"], f"❌ Impossibile riprendere il monitoraggio {monitor_type.upper()} di {host} dopo il riavvio del bot.")
+        else:
+            await notify(app, entry["chat_id"], f"🔄 Monitoraggio {monitor_type.upper()} di {host} ripreso dopo il riavvio del bot.")
+
+# Le dashboard non vengono riprese (l'aggiornamento periodico era legato al processo precedente):
+# il messaggio viene segnato come interrotto e i pulsanti rimossi
+async def close_stale_dashboards(app: Application):
+    for chat_id, dashboard in STATE.load(NS_DASHBOARD).items():
+        STATE.delete(NS_DASHBOARD, chat_id)
+        try:
+            await app.bot.edit_message_text(
+                chat_id=int(chat_id), message_id=dashboard["message_id"],
+                text="⏹️ Dashboard interrotta dal riavvio del bot: usa /dashboard per riprenderla.",
+                reply_markup=None, rate_limit_args=SEND_ALERT,
+            )
+        except TelegramError as e:
+            logger.warning(f"Dashboard della chat {chat_id} non aggiornata dopo il riavvio: {e}")
+
+async def resume_background(app: Application):
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+    for key, entry in STATE.load(NS_MONITOR).items():
+        if STATE_RESTORE_MONITORS:
+            groups[(entry["host"], entry["type"])].append(entry)
+        else:
+            STATE.delete(NS_MONITOR, key)
+    # I computer vengono ripresi in parallelo, ognuno passando dallo scheduler come un avvio normale
+    await asyncio.gather(
+        close_stale_dashboards(app),
+        *(resume_monitor_group(app, host, monitor_type, entries) for (host, monitor_type), entries in groups.items()),
+    )
+    if groups:
+        logger.info(f"Ripristino dopo il riavvio: {sum(len(e) for e in groups.values())} monitoraggi su {len(groups)} computer/tipi")
+
+# Chiamata all'avvio dell'applicazione (post_init): i dati in memoria vengono ripristinati subito,
+# i monitoraggi e le dashboard in background per non ritardare l'inizio del polling
+async def restore_state(app: Application):
+    if not STATE.enabled:
+        return
+    restored = restore_memory(app)
+    if restored:
+        logger.info(f"Stato ripristinato dopo il riavvio: {restored}")
+    spawn(resume_background(app), "bot", "ripristino dopo il riavvio")
@@ -0,0 +1,162 @@
+import time
+import heapq
+import asyncio
+import itertools
+import functools
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Tuple
+from config.config import SCHEDULER_MAX_PER_HOST, SCHEDULER_MAX_GLOBAL, SCHEDULER_QUEUE_LIMITS
+
+# Classi di priorità (valore più basso = servito prima)
+PRIORITY_INTERACTIVE = 0  # click di un admin
+PRIORITY_MONITOR = 1      # avvio dei monitoraggi live
+PRIORITY_BACKGROUND = 2   # pre-raccolta periodica
+PRIORITY_FANOUT = 3       # operazioni su tutti i computer (confronti, ricerche)
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_MONITOR: "monitor",
+    PRIORITY_BACKGROUND: "background",
+    PRIORITY_FANOUT: "fanout",
+}
+
+# Tempo (secondi) passato in coda dall'ultima operazione avviata nel task corrente
+LAST_QUEUE_WAIT: contextvars.ContextVar[float] = contextvars.ContextVar("LAST_QUEUE_WAIT", default=0.0)
+
+# Sollevata quando la coda della classe di priorità è piena: la richiesta viene rifiutata subito
+class QueueFullError(Exception):
+    pass
+
+# Scheduler centrale delle operazioni remote: limita le operazioni contemporanee per computer e
+# in totale, e serve le richieste in attesa in ordine di priorità (a parità, in ordine di arrivo)
+class JobScheduler:
+    def __init__(self, max_per_host: int, max_global: int, queue_limits: Dict[str, int]):
+        self.max_per_host = max_per_host
+        self.max_global = max_global
+        self.queue_limits = queue_limits
+        self.running_per_host: Dict[str, int] = {}
+        self.running = 0
+        # Heap delle richieste in attesa: (priorità, progressivo, computer, future)
+        self.waiting: List[Tuple[int, int, str, asyncio.Future]] = []
+        self.waiting_per_priority: Dict[int, int] = {}
+        self.counter = itertools.count()
+
+    # Indica se il computer ha ancora posti liberi (e se ce ne sono in totale)
+    def _has_capacity(self, host: str) -> bool:
+        return self.running < self.max_global and self.running_per_host.get(host, 0) < self.max_per_host
+
+    def _start(self, host: str):
+        self.running += 1
+        self.running_per_host[host] = self.running_per_host.get(host, 0) + 1
+
+    # Assegna i posti liberi alle richieste in attesa, dalla priorità più alta.
+    # Una richiesta per un computer già saturo non blocca quelle per gli altri computer
+    def _dispatch(self):
+        if not self.waiting or self.running >= self.max_global:
+            return
+        remaining = []
+        for entry in sorted(self.waiting):
+            priority, _, host, future = entry
+            if self._has_capacity(host):
+                self.waiting_per_priority[priority] -= 1
+                self._start(host)
+                future.set_result(None)
+            else:
+                remaining.append(entry)
+        heapq.heapify(remaining)
+        self.waiting = remaining
+
+    # Rimuove dalla coda una richiesta annullata prima di ottenere il posto
+    def _discard(self, future: asyncio.Future):
+        for idx, entry in enumerate(self.waiting):
+            if entry[3] is future:
+                self.waiting.pop(idx)
+                heapq.heapify(self.waiting)
+                self.waiting_per_priority[entry[0]] -= 1
+                return
+
+    # Attende un posto per il computer e restituisce il tempo passato in coda
+    async def acquire(self, host: str, priority: int) -> float:
+        # Percorso veloce: c'è capacità e nessuno è in attesa per lo stesso computer.
+        # Le richieste ancora in coda sono bloccate solo dal limite del proprio computer
+        if self._has_capacity(host) and not any(entry[2] == host for entry in self.waiting):
+            self._start(host)
+            LAST_QUEUE_WAIT.set(0.0)
+            return 0.0
+
+        limit = self.queue_limits.get(PRIORITY_NAMES.get(priority, ""), 50)
+        if self.waiting_per_priority.get(priority, 0) >= limit:
+            raise QueueFullError(f"Coda {PRIORITY_NAMES.get(priority, priority)} piena ({limit} richieste in attesa)")
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.counter), host, future))
+        self.waiting_per_priority[priority] = self.waiting_per_priority.get(priority, 0) + 1
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Se il posto era già stato assegnato lo restituisce, altrimenti toglie la richiesta dalla coda
+            if future.done() and not future.cancelled():
+                self.release(host)
+            else:
+                self._discard(future)
+            raise
+        wait = time.monotonic() - started
+        LAST_QUEUE_WAIT.set(wait)
+        return wait
+
+    # Libera il posto occupato sul computer e sveglia le richieste in attesa
+    def release(self, host: str):
+        self.running -= 1
+        self.running_per_host[host] -= 1
+        if not self.running_per_host[host]:
+            del self.running_per_host[host]
+        self._dispatch()
+
+    # Uso: async with SCHEDULER.slot(host, priorità): ...
+    # Solo per lavoro svolto nel loop: per le chiamate bloccanti in un thread usare run()
+    @asynccontextmanager
+    async def slot(self, host: str, priority: int):
+        await self.acquire(host, priority)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    # Esegue una funzione bloccante in un thread dopo aver ottenuto un posto per il computer.
+    # Il posto viene liberato quando il thread termina, non quando chi attende viene annullato
+    # (es. da asyncio.wait_for): un thread non si può interrompere e la connessione SSH resta aperta
+    # finché non finisce, quindi deve continuare a contare nei limiti del computer e globale
+    async def run(self, host: str, priority: int, func, *args) -> Any:
+        await self.acquire(host, priority)
+        loop = asyncio.get_running_loop()
+        # Come asyncio.to_thread: il thread eredita il contesto (traccia e fase correnti)
+        context = contextvars.copy_context()
+        try:
+            work = loop.run_in_executor(None, functools.partial(context.run, func, *args))
+        except BaseException:
+            self.release(host)
+            raise
+        work.add_done_callback(lambda finished: self._finish(host, finished))
+        # shield: l'annullamento di chi attende non annulla il future del thread (e quindi il suo callback)
+        return await asyncio.shield(work)
+
+    # Callback di fine lavoro del thread: libera il posto. L'eventuale errore di un lavoro
+    # il cui chiamante è già stato annullato viene letto per non essere segnalato come mai recuperato
+    def _finish(self, host: str, finished: asyncio.Future):
+        if not finished.cancelled():
+            finished.exception()
+        self.release(host)
+
+    # Statistiche correnti (operazioni in corso e richieste in coda per priorità)
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "running_per_host": dict(self.running_per_host),
+            "waiting": {PRIORITY_NAMES[p]: n for p, n in self.waiting_per_priority.items() if n},
+        }
+
+# Istanza condivisa da tutte le operazioni remote del bot
+SCHEDULER = JobScheduler(SCHEDULER_MAX_PER_HOST, SCHEDULER_MAX_GLOBAL, SCHEDULER_QUEUE_LIMITS)
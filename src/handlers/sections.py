@@ -71,8 +71,9 @@ async def show_utility_section(update: Update, context: ContextTypes.DEFAULT_TYP
 🧰 <b>Utilità di Sistema</b>
 
 Strumenti rapidi per la gestione e la diagnostica:
-• Visualizzazione ultimi log di sistema (journalctl)
+• Visualizzazione log di sistema (journalctl) a pagine, con le sole voci nuove dall'ultima visita
 • Visualizzazione ultimi comandi sudo eseguiti
+• Filtri per unità, priorità o testo con /journal unit=… prio=… grep=…
 • Uptime e carico medio del sistema
 
 <i>Seleziona un'opzione dal menu per accedere alle utilità</i>
@@ -87,6 +88,7 @@ Visualizza grafici generati in tempo reale dal sistema remoto:
 • Andamento utilizzo CPU nelle ultime 24 ore (richiede sysstat/sar)
 • Analisi dettagliata della RAM (pie chart su categorie memoria)
 • Distribuzione dei log di sistema per livello (INFO, ERROR, ecc.)
+• Confronto CPU/RAM tra tutti i computer (sovrapposto o a griglia)
 
 <i>Seleziona un grafico dal menu per ricevere l'immagine aggiornata</i>
 """
@@ -100,6 +102,7 @@ Attiva il monitoraggio live delle risorse critiche:
 • Notifiche automatiche quando la RAM supera la soglia critica
 • Notifiche automatiche quando la CPU supera la soglia critica
 • Visualizzazione processi responsabili in caso di allerta
+• Un solo messaggio all'inizio e al rientro di ogni allerta, con riepilogo periodico di quelle attive
 
 <i>Attiva o disattiva gli alert dal menu sottostante</i>
 """
@@ -0,0 +1,172 @@
+import time
+import itertools
+import threading
+from asyncio.log import logger
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Optional
+from config.config import REMOTE_SESSION_TIMEOUT, REMOTE_SESSION_RETRY, REMOTE_SESSION_IDLE_TIMEOUT
+from .deploy import ensure_remote_scripts, invalidate_remote_scripts, SCRIPT_NOT_FOUND
+from .lifecycle import REGISTRY, open_ssh_client
+from .tracing import span
+
+# Errore del worker remoto (script assente, risposta non valida, sessione chiusa):
+# non riguarda la raggiungibilità del computer, il comando può essere ripetuto con una connessione classica
+class SessionError(Exception):
+    pass
+
+# Il worker non ha risposto in tempo: il comando è lento o il worker è bloccato, ma il computer risponde.
+# Non viene ripetuto con una connessione classica (impiegherebbe altrettanto) e non conta come errore di connessione
+class SessionTimeout(SessionError):
+    pass
+
+# Sessione persistente verso scripts/admin_worker.sh: il worker resta attivo con le funzioni di linux_admin.sh
+# già caricate e riceve le richieste sullo stesso canale SSH, anche più di una alla volta (pipelining).
+# I metodi sono bloccanti: vanno eseguiti in un thread (tramite lo scheduler)
+class RemoteSession:
+    def __init__(self, computer: Dict[str, Any]):
+        self.name = computer["name"]
+        self.pending: Dict[str, Future] = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.closed = False
+
+        # La connessione resta nel registro delle risorse finché la sessione non viene chiusa
+        self.client, self.resource_id = open_ssh_client(computer, "sessione remota")
+        try:
+            remote_dir = ensure_remote_scripts(self.client, computer)
+            self.channel = self.client.get_transport().open_session()
+            self.channel.exec_command(f"bash {remote_dir}/scripts/admin_worker.sh {REMOTE_SESSION_IDLE_TIMEOUT}")
+            self.stdout = self.channel.makefile("rb")
+
+            # Il worker conferma con "READY" di aver caricato le funzioni
+            self.channel.settimeout(REMOTE_SESSION_TIMEOUT)
+            banner = self.stdout.readline()
+            if banner.strip() != b"READY":
+                # Script spariti dal computer: verranno reinviati alla prossima sessione
+                if not banner and self.channel.recv_exit_status() == SCRIPT_NOT_FOUND:
+                    invalidate_remote_scripts(self.name)
+                raise SessionError(f"worker non disponibile: {banner.decode(errors='replace').strip() or 'nessuna risposta'}")
+            self.channel.settimeout(None)
+        except BaseException:
+            REGISTRY.release(self.resource_id)
+            raise
+
+        self.reader = threading.Thread(target=self._read_responses, name=f"session-{self.name}", daemon=True)
+        self.reader.start()
+
+    # Thread di lettura: associa ogni risposta alla richiesta con lo stesso id
+    def _read_responses(self):
+        try:
+            while True:
+                header = self.stdout.readline()
+                if not header:
+                    break
+                parts = header.decode(errors="replace").split()
+                if len(parts) != 4 or parts[0] != "RES":
+                    raise SessionError(f"risposta non valida dal worker: {header[:80]!r}")
+                _, request_id, status, length = parts
+                payload = self.stdout.read(int(length)) if int(length) else b""
+                with self.lock:
+                    future = self.pending.pop(request_id, None)
+                # La richiesta potrebbe essere già scaduta: la risposta viene scartata
+                if future is not None:
+                    future.set_result(payload.decode(errors="replace"))
+        except Exception as e:
+            logger.info(f"Sessione remota con {self.name} interrotta: {e}")
+        finally:
+            self.close()
+
+    # Invia un comando di linux_admin.sh al worker e ne attende l'output
+    def request(self, command: str, timeout: float = REMOTE_SESSION_TIMEOUT) -> str:
+        future: Future = Future()
+        with self.lock:
+            if self.closed:
+                raise SessionError("sessione chiusa")
+            request_id = str(next(self.ids))
+            self.pending[request_id] = future
+            try:
+                self.channel.sendall(f"REQ {request_id} {command}\n".encode())
+            except OSError as e:
+                # Il canale è stato chiuso (ad esempio dal worker per inattività) mentre si inviava la richiesta
+                self.pending.pop(request_id, None)
+                raise SessionError(f"sessione chiusa: {e}")
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Il worker esegue una richiesta alla volta: le successive resterebbero in coda dietro quella bloccata.
+            # La sessione viene chiusa (il worker termina con il canale) e la prossima richiesta ne apre una nuova
+            logger.warning(f"Nessuna risposta dal worker di {self.name} per '{command}' in {timeout} s: sessione chiusa")
+            self.close()
+            raise SessionTimeout(f"nessuna risposta dal worker di {self.name} per '{command}'")
+
+    # Chiude la sessione: le richieste ancora in attesa falliscono e verranno ripetute senza worker
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending = list(self.pending.values())
+            self.pending.clear()
+        # Una sessione chiusa non viene più restituita da get_session
+        with SESSIONS_LOCK:
+            if SESSIONS.get(self.name) is self:
+                del SESSIONS[self.name]
+        for future in pending:
+            if not future.done():
+                future.set_exception(SessionError("sessione chiusa"))
+        REGISTRY.release(self.resource_id)
+
+# Sessioni attive per computer: {computer_name: RemoteSession}
+SESSIONS: Dict[str, RemoteSession] = {}
+# Computer su cui il worker non è disponibile: {computer_name: epoch dell'ultimo tentativo}
+UNSUPPORTED_HOSTS: Dict[str, float] = {}
+# Protegge solo i dizionari: l'apertura di una sessione (connessione, invio degli script, attesa di READY)
+# avviene sotto il lock del singolo computer, così un computer lento non blocca gli altri
+SESSIONS_LOCK = threading.Lock()
+SESSION_CREATE_LOCKS: Dict[str, threading.Lock] = {}
+
+def _active_session(name: str) -> Optional[RemoteSession]:
+    with SESSIONS_LOCK:
+        session = SESSIONS.get(name)
+    return session if session is not None and not session.closed else None
+
+# Restituisce la sessione del computer, aprendone una nuova se assente o chiusa
+def get_session(computer: Dict[str, Any]) -> RemoteSession:
+    name = computer["name"]
+    session = _active_session(name)
+    if session is not None:
+        return session
+    with SESSIONS_LOCK:
+        create_lock = SESSION_CREATE_LOCKS.setdefault(name, threading.Lock())
+    with create_lock:
+        # Un'altra richiesta potrebbe averla aperta nel frattempo
+        session = _active_session(name)
+        if session is not None:
+            return session
+        if time.time() - UNSUPPORTED_HOSTS.get(name, 0) < REMOTE_SESSION_RETRY:
+            raise SessionError("worker non disponibile su questo computer")
+        try:
+            session = RemoteSession(computer)
+        except SessionError:
+            UNSUPPORTED_HOSTS[name] = time.time()
+            raise
+        with SESSIONS_LOCK:
+            SESSIONS[name] = session
+        return session
+
+# Esegue un comando di linux_admin.sh tramite la sessione persistente del computer.
+# La funzione è bloccante: va eseguita tramite lo scheduler (run_on_host)
+def run_session_command(computer: Dict[str, Any], command: str) -> str:
+    session = get_session(computer)
+    with span("session.request") as current:
+        output = session.request(command)
+        current.set(bytes=len(output))
+        return output
+
+# Chiude tutte le sessioni aperte
+def close_sessions():
+    with SESSIONS_LOCK:
+        sessions = list(SESSIONS.values())
+        SESSIONS.clear()
+    for session in sessions:
+        session.close()
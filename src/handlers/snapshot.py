@@ -0,0 +1,337 @@
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
+from telegram import Update
+from telegram.ext import ContextTypes
+from config.config import MONITORED_COMPUTERS, SNAPSHOT_SECTIONS, PROCSTATS_MAX_AGE
+from .utils import find_computer_by_name, run_remote_command, reply_command_output
+from .history import get_snapshot, store_snapshot
+from .scheduler import PRIORITY_INTERACTIVE, QueueFullError
+from .health import HostUnavailableError
+
+# File letti per ogni sezione dello snapshot. Le sezioni vengono lette tutte in un'unica esecuzione,
+# ognuna preceduta da un'intestazione "==> sezione <==" per poterle separare
+SNAPSHOT_SOURCES = {
+    "pagesize": "getconf PAGESIZE",
+    "uptime": "cat /proc/uptime",
+    "loadavg": "cat /proc/loadavg",
+    "stat": "cat /proc/stat",
+    "vmstat": "cat /proc/vmstat",
+    "meminfo": "cat /proc/meminfo",
+    "diskstats": "cat /proc/diskstats",
+    "net_dev": "cat /proc/net/dev",
+    # Temperature in millesimi di grado: prima i sensori hwmon, poi le thermal zone
+    "thermal": "cat /sys/class/hwmon/hwmon*/temp*_input /sys/class/thermal/thermal_zone*/temp",
+    "df": "df -P -k /",
+}
+
+# Spazio occupato da un filesystem (valori in KB, come "df -k")
+@dataclass
+class FilesystemUsage:
+    mount: str
+    total_kb: int
+    used_kb: int
+    available_kb: int
+
+    @property
+    def used_percent(self) -> float:
+        return self.used_kb * 100 / self.total_kb if self.total_kb else 0.0
+
+# Stato di un computer letto in un'unica esecuzione remota, con i valori già convertiti
+@dataclass
+class HostSnapshot:
+    host: str
+    collected: float
+    uptime: float = 0.0
+    pagesize: int = 4096
+    loadavg: Tuple[float, float, float] = (0.0, 0.0, 0.0)
+    stat: Dict[str, Any] = field(default_factory=dict)
+    vmstat: Dict[str, int] = field(default_factory=dict)
+    meminfo: Dict[str, int] = field(default_factory=dict)
+    diskstats: Dict[str, List[int]] = field(default_factory=dict)
+    net_dev: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    temperatures: List[float] = field(default_factory=list)
+    filesystems: List[FilesystemUsage] = field(default_factory=list)
+
+    @property
+    def mem_total_kb(self) -> int:
+        return self.meminfo.get("MemTotal", 0)
+
+    @property
+    def mem_available_kb(self) -> int:
+        return self.meminfo.get("MemAvailable", self.meminfo.get("MemFree", 0))
+
+    @property
+    def mem_used_kb(self) -> int:
+        return self.mem_total_kb - self.mem_available_kb
+
+    @property
+    def mem_used_percent(self) -> float:
+        return self.mem_used_kb * 100 / self.mem_total_kb if self.mem_total_kb else 0.0
+
+    @property
+    def swap_used_percent(self) -> float:
+        total = self.meminfo.get("SwapTotal", 0)
+        return (total - self.meminfo.get("SwapFree", 0)) * 100 / total if total else 0.0
+
+    # Temperatura del primo sensore disponibile (come lo script linux_admin.sh)
+    @property
+    def temperature(self) -> Optional[float]:
+        return self.temperatures[0] if self.temperatures else None
+
+    @property
+    def root_filesystem(self) -> Optional[FilesystemUsage]:
+        return self.filesystems[0] if self.filesystems else None
+
+# Percentuale di CPU usata tra due snapshot (dall'avvio del sistema se previous è None)
+def cpu_usage_between(previous: Optional[HostSnapshot], latest: HostSnapshot) -> float:
+    new = latest.stat.get("cpu", [])
+    old = previous.stat.get("cpu", [0] * len(new)) if previous else [0] * len(new)
+    delta = [n - o for n, o in zip(new, old)] + [0] * 8
+    total = sum(delta[:8])
+    # idle e iowait sono tempo in cui la CPU non lavora
+    return (total - delta[3] - delta[4]) * 100 / total if total > 0 else 0.0
+
+# Velocità di rete (byte/s ricevuti e trasmessi) tra due snapshot, esclusa l'interfaccia di loopback
+def net_rates_between(previous: HostSnapshot, latest: HostSnapshot) -> Tuple[float, float]:
+    elapsed = latest.uptime - previous.uptime
+    if elapsed <= 0:
+        return 0.0, 0.0
+    rx = tx = 0
+    for iface, (new_rx, new_tx) in latest.net_dev.items():
+        old = previous.net_dev.get(iface)
+        if iface == "lo" or old is None:
+            continue
+        rx += max(new_rx - old[0], 0)
+        tx += max(new_tx - old[1], 0)
+    return rx / elapsed, tx / elapsed
+
+# Costruisce il comando che legge le sezioni indicate in un'unica esecuzione.
+# Gli errori (ad esempio sensori assenti) vengono scartati per non mescolarsi all'output
+def build_snapshot_command(sections: List[str]) -> str:
+    parts = [f"echo '==> {name} <=='; {SNAPSHOT_SOURCES[name]}" for name in sections if name in SNAPSHOT_SOURCES]
+    return "{ " + "; ".join(parts) + "; } 2>/dev/null"
+
+# Divide l'output del comando nelle singole sezioni
+def split_sections(output: str) -> Dict[str, List[str]]:
+    sections: Dict[str, List[str]] = {}
+    current: List[str] = []
+    for line in output.splitlines():
+        if line.startswith("==> ") and line.endswith(" <=="):
+            current = sections.setdefault(line[4:-4], [])
+        else:
+            current.append(line)
+    return sections
+
+def _parse_stat(snapshot: HostSnapshot, lines: List[str]):
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == "cpu":
+            snapshot.stat["cpu"] = [int(v) for v in parts[1:]]
+        elif parts[0] in ("intr", "ctxt", "procs_running", "procs_blocked"):
+            snapshot.stat[parts[0]] = int(parts[1])
+
+def _parse_key_values(lines: List[str], separator: Optional[str] = None) -> Dict[str, int]:
+    values = {}
+    for line in lines:
+        parts = line.split(separator, 1) if separator else line.split()
+        if len(parts) != 2:
+            continue
+        try:
+            values[parts[0].strip()] = int(parts[1].split()[0])
+        except (ValueError, IndexError):
+            continue
+    return values
+
+def _parse_diskstats(snapshot: HostSnapshot, lines: List[str]):
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 14:
+            snapshot.diskstats[parts[2]] = [int(v) for v in parts[3:14]]
+
+def _parse_net_dev(snapshot: HostSnapshot, lines: List[str]):
+    # Le prime due righe sono intestazioni; dopo "iface:" ci sono 8 campi in ricezione e 8 in trasmissione
+    for line in lines[2:]:
+        if ':' not in line:
+            continue
+        iface, counters = line.split(':', 1)
+        values = counters.split()
+        if len(values) >= 9:
+            snapshot.net_dev[iface.strip()] = (int(values[0]), int(values[8]))
+
+def _parse_thermal(snapshot: HostSnapshot, lines: List[str]):
+    for line in lines:
+        try:
+            snapshot.temperatures.append(int(line.strip()) / 1000)
+        except ValueError:
+            continue
+
+def _parse_df(snapshot: HostSnapshot, lines: List[str]):
+    # Formato POSIX (-P): filesystem, blocchi da 1K, usati, disponibili, percentuale, punto di montaggio
+    for line in lines[1:]:
+        parts = line.split()
+        if len(parts) >= 6 and parts[1].isdigit():
+            snapshot.filesystems.append(FilesystemUsage(parts[5], int(parts[1]), int(parts[2]), int(parts[3])))
+
+def _parse_loadavg(snapshot: HostSnapshot, lines: List[str]):
+    parts = lines[0].split() if lines else []
+    if len(parts) >= 3:
+        snapshot.loadavg = (float(parts[0]), float(parts[1]), float(parts[2]))
+
+def _parse_uptime(snapshot: HostSnapshot, lines: List[str]):
+    if lines and lines[0].strip():
+        snapshot.uptime = float(lines[0].split()[0])
+
+def _parse_pagesize(snapshot: HostSnapshot, lines: List[str]):
+    if lines and lines[0].strip().isdigit():
+        snapshot.pagesize = int(lines[0].strip())
+
+def _parse_vmstat(snapshot: HostSnapshot, lines: List[str]):
+    snapshot.vmstat = _parse_key_values(lines)
+
+def _parse_meminfo(snapshot: HostSnapshot, lines: List[str]):
+    snapshot.meminfo = _parse_key_values(lines, ':')
+
+# Funzione di conversione di ogni sezione
+SECTION_PARSERS = {
+    "pagesize": _parse_pagesize,
+    "uptime": _parse_uptime,
+    "loadavg": _parse_loadavg,
+    "stat": _parse_stat,
+    "vmstat": _parse_vmstat,
+    "meminfo": _parse_meminfo,
+    "diskstats": _parse_diskstats,
+    "net_dev": _parse_net_dev,
+    "thermal": _parse_thermal,
+    "df": _parse_df,
+}
+
+# Converte l'output di build_snapshot_command in un HostSnapshot
+def parse_snapshot(host: str, output: str, collected: Optional[float] = None) -> HostSnapshot:
+    snapshot = HostSnapshot(host=host, collected=collected if collected is not None else time.time())
+    for name, lines in split_sections(output).items():
+        parser = SECTION_PARSERS.get(name)
+        if parser:
+            parser(snapshot, lines)
+    return snapshot
+
+# Gli ultimi due snapshot di ogni computer: {computer_name: deque([snapshot, snapshot])}.
+# Servono alle viste pre-raccolte e ai comandi interattivi; gli alert restano sui campioni dei monitoraggi
+# (vedi AlertEngine in alerts.py)
+HOST_SNAPSHOTS: Dict[str, deque] = {}
+
+# Legge un nuovo snapshot dal computer (un'unica esecuzione remota) e lo aggiunge ai più recenti.
+# Ogni lettura aggiorna anche la vista "Risorse" pre-raccolta
+async def fetch_host_snapshot(computer: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                              sections: Optional[List[str]] = None) -> HostSnapshot:
+    output = await run_remote_command(computer, build_snapshot_command(sections or SNAPSHOT_SECTIONS), priority)
+    snapshot = parse_snapshot(computer["name"], output)
+    samples = HOST_SNAPSHOTS.setdefault(computer["name"], deque(maxlen=2))
+    # Il campione precedente serve per CPU e rete solo se recente, altrimenti si usano i valori dall'avvio
+    previous = samples[-1] if samples and snapshot.collected - samples[-1].collected <= PROCSTATS_MAX_AGE else None
+    samples.append(snapshot)
+    if sections is None:
+        store_snapshot(computer["name"], "resources", render_resources(previous, snapshot))
+    return snapshot
+
+# Restituisce lo snapshot più recente del computer (None se mai letto o più vecchio di max_age)
+def get_latest_snapshot(computer_name: str, max_age: Optional[float] = None) -> Optional[HostSnapshot]:
+    samples = HOST_SNAPSHOTS.get(computer_name)
+    if not samples:
+        return None
+    if max_age is not None and time.time() - samples[-1].collected > max_age:
+        return None
+    return samples[-1]
+
+# Restituisce la coppia (precedente, ultimo) se gli ultimi due snapshot sono utilizzabili per calcolare velocità
+def get_snapshot_pair(computer_name: str, max_age: float = PROCSTATS_MAX_AGE) -> Optional[Tuple[HostSnapshot, HostSnapshot]]:
+    samples = HOST_SNAPSHOTS.get(computer_name)
+    if not samples or len(samples) < 2:
+        return None
+    previous, latest = samples[0], samples[1]
+    if time.time() - latest.collected > max_age or latest.uptime <= previous.uptime:
+        return None
+    return previous, latest
+
+# Restituisce una coppia di snapshot recenti, leggendone di nuovi se mancano o sono vecchi (o se force=True):
+# servono due letture a un secondo di distanza per calcolare le velocità
+async def ensure_snapshot_pair(computer: Dict[str, Any], force: bool = False) -> Optional[Tuple[HostSnapshot, HostSnapshot]]:
+    name = computer["name"]
+    pair = None if force else get_snapshot_pair(name)
+    if pair is None:
+        if force or get_latest_snapshot(name, PROCSTATS_MAX_AGE) is None:
+            await fetch_host_snapshot(computer)
+            await asyncio.sleep(1)
+        await fetch_host_snapshot(computer)
+        pair = get_snapshot_pair(name)
+    return pair
+
+# Testo della vista "Risorse" (stesse sezioni di show_resources in linux_admin.sh)
+def render_resources(previous: Optional[HostSnapshot], latest: HostSnapshot) -> str:
+    lines = ["📊 MONITOR RISORSE SISTEMA", "----------------------------------------"]
+    temperature = f"{latest.temperature:.0f}°C" if latest.temperature is not None else "n/d"
+    lines += ["🖥️ CPU:", f"• Uso: {cpu_usage_between(previous, latest):.1f}%", f"• Temperatura: {temperature}"]
+
+    total_mb = latest.mem_total_kb // 1024
+    used_mb = latest.mem_used_kb // 1024
+    free_mb = latest.meminfo.get("MemFree", 0) // 1024
+    lines += [
+        "", "🧠 RAM:",
+        f"• Totale: {total_mb} MB",
+        f"• Usata: {used_mb} MB ({used_mb * 100 // total_mb if total_mb else 0}%)",
+        f"• Libera: {free_mb} MB ({free_mb * 100 // total_mb if total_mb else 0}%)",
+    ]
+
+    lines += ["", "🌐 RETE:"]
+    if previous is not None and latest.uptime > previous.uptime:
+        rx, tx = net_rates_between(previous, latest)
+        lines += [f"• Download: {rx * 8 / 1_000_000:.2f} Mb/s", f"• Upload: {tx * 8 / 1_000_000:.2f} Mb/s"]
+    else:
+        lines.append("• In attesa di un secondo campione")
+
+    root = latest.root_filesystem
+    if root is not None:
+        lines += [
+            "", "💾 DISCO PRINCIPALE:",
+            f"• Totale: {root.total_kb / 1024 ** 2:.1f}G",
+            f"• Usato: {root.used_kb / 1024 ** 2:.1f}G ({root.used_percent:.0f}%)",
+            f"• Libero: {root.available_kb / 1024 ** 2:.1f}G",
+        ]
+
+    lines.append(f"\nℹ️ Aggiornato: {time.strftime('%H:%M:%S', time.localtime(latest.collected))}")
+    return "\n".join(lines)
+
+# Risponde al pulsante "Risorse" usando gli snapshot: la vista pre-raccolta se disponibile,
+# altrimenti (o con force=True) una nuova lettura
+async def send_resources(update: Update, context: ContextTypes.DEFAULT_TYPE, force: bool = False):
+    query = update.callback_query
+    selected = context.user_data.get("selected_computer") if context.user_data else None
+    computer = find_computer_by_name(MONITORED_COMPUTERS, selected) if selected else None
+    if computer is None:
+        await query.edit_message_text("❗ Devi prima selezionare un computer.")
+        return
+
+    cached = None if force else get_snapshot(selected, "resources")
+    if cached:
+        await reply_command_output(update, "resources", cached["output"], True, age=time.time() - cached["ts"])
+        return
+
+    try:
+        pair = await ensure_snapshot_pair(computer, force)
+    except HostUnavailableError as e:
+        await query.edit_message_text(f"⛔ {e}")
+        return
+    except QueueFullError:
+        await query.edit_message_text(f"🚦 Troppe operazioni in coda per {selected}, riprova tra poco.")
+        return
+    except Exception:
+        await query.edit_message_text("❌ Il computer non è raggiungibile.")
+        return
+    if pair is None:
+        await query.edit_message_text("❌ Impossibile leggere le risorse: campioni non validi.")
+        return
+    await reply_command_output(update, "resources", render_resources(*pair), True)
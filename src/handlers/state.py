@@ -0,0 +1,143 @@
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from asyncio.log import logger
+from typing import Any, Dict, Optional, Tuple
+from telegram.ext import Application, ContextTypes
+from config.config import STATE_ENABLED, STATE_DB, STATE_FLUSH_INTERVAL
+
+# Sezioni dello stato salvato
+NS_SELECTION = "selection"    # computer selezionato da ogni utente: {user_id: computer}
+NS_MONITOR = "monitor"        # monitoraggi attivi: {"tipo:user_id:computer": {...}}
+NS_DASHBOARD = "dashboard"    # messaggi delle dashboard: {chat_id: {"message_id", "tag"}}
+NS_HEALTH = "health"          # stato del circuit breaker: {computer: {...}}
+NS_SNAPSHOT = "snapshot"      # ultimo output dei comandi: {"computer\tcomando": {"output", "ts"}}
+NS_CACHE = "cache"            # cache dei comandi: {"computer\tcomando": {"output", "ts"}}
+
+# Chiave composta (computer, comando) nel formato usato dal database
+def pair_key(computer_name: str, command: str) -> str:
+    return f"{computer_name}\t{command}"
+
+def split_pair_key(key: str) -> Tuple[str, str]:
+    computer_name, _, command = key.partition("\t")
+    return computer_name, command
+
+# Stato persistente su SQLite (in modalità WAL) con scrittura differita: le modifiche restano in memoria
+# e vengono scritte periodicamente in un'unica transazione, così il loop non attende mai il disco.
+# Per ogni chiave conta solo l'ultimo valore: più modifiche ravvicinate diventano una sola scrittura
+class StateStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.db: Optional[sqlite3.Connection] = None
+        # Modifiche non ancora scritte: {(sezione, chiave): valore JSON, o None per cancellare}
+        self.pending: Dict[Tuple[str, str], Optional[str]] = {}
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+
+    def open(self):
+        try:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Database dello stato {self.path} non disponibile ({e}): lo stato non verrà salvato.")
+            return
+        self.db = db
+
+    @property
+    def enabled(self) -> bool:
+        return self.db is not None
+
+    def put(self, namespace: str, key: Any, value: Any):
+        if self.db is None:
+            return
+        with self.lock:
+            self.pending[(namespace, str(key))] = json.dumps(value, ensure_ascii=False)
+
+    def delete(self, namespace: str, key: Any):
+        if self.db is None:
+            return
+        with self.lock:
+            self.pending[(namespace, str(key))] = None
+
+    # Contenuto della sezione, comprese le modifiche non ancora scritte: {chiave: valore}
+    def load(self, namespace: str) -> Dict[str, Any]:
+        if self.db is None:
+            return {}
+        with self.db_lock:
+            rows = self.db.execute("SELECT key, value FROM state WHERE namespace = ?", (namespace,)).fetchall()
+        result = {key: json.loads(value) for key, value in rows}
+        with self.lock:
+            pending = [(key, value) for (ns, key), value in self.pending.items() if ns == namespace]
+        for key, value in pending:
+            if value is None:
+                result.pop(key, None)
+            else:
+                result[key] = json.loads(value)
+        return result
+
+    # Scrive le modifiche accumulate. La funzione è bloccante: va eseguita in un thread
+    def flush(self) -> int:
+        if self.db is None:
+            return 0
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        now = time.time()
+        upserts = [(ns, key, value, now) for (ns, key), value in pending.items() if value is not None]
+        deletes = [(ns, key) for (ns, key), value in pending.items() if value is None]
+        try:
+            with self.db_lock, self.db:
+                self.db.executemany(
+                    "INSERT INTO state (namespace, key, value, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+                    upserts,
+                )
+                self.db.executemany("DELETE FROM state WHERE namespace = ? AND key = ?", deletes)
+        except sqlite3.Error as e:
+            # Le modifiche tornano in coda (senza sovrascrivere quelle arrivate nel frattempo)
+            with self.lock:
+                self.pending = {**pending, **self.pending}
+            logger.warning(f"Scrittura dello stato non riuscita: {e}")
+            return 0
+        return len(pending)
+
+    def close(self):
+        if self.db is None:
+            return
+        self.flush()
+        with self.db_lock:
+            self.db.close()
+        self.db = None
+
+# Istanza condivisa, aperta all'avvio del bot (start_state)
+STATE = StateStore(STATE_DB)
+
+# Job periodico: scrive sul database le modifiche accumulate
+async def flush_state_job(context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(STATE.flush)
+
+# Chiamata all'arresto dell'applicazione: scrive le ultime modifiche e chiude il database
+async def close_state(app: Application):
+    await asyncio.to_thread(STATE.close)
+
+# Apre il database dello stato e registra la scrittura periodica sulla job queue dell'applicazione
+def start_state(app: Application):
+    if not STATE_ENABLED:
+        return
+    STATE.open()
+    if not STATE.enabled:
+        return
+    if app.job_queue is None:
+        logger.warning("JobQueue non disponibile: lo stato verrà salvato solo all'arresto del bot.")
+        return
+    app.job_queue.run_repeating(flush_state_job, interval=STATE_FLUSH_INTERVAL, first=STATE_FLUSH_INTERVAL, name="state_flush")
@@ -0,0 +1,219 @@
+import json
+import time
+import inspect
+import uuid
+import queue
+import atexit
+import logging
+import functools
+import itertools
+import contextvars
+from asyncio.log import logger
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, List, Optional
+from telegram import Update
+from telegram.request import HTTPXRequest
+from config.config import TRACE_ENABLED, TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT
+
+# Fase di una richiesta: nome, posizione nell'albero delle fasi, tempi (ms dall'inizio della traccia) e attributi
+# (computer, comando, byte letti o inviati...)
+@dataclass
+class Span:
+    id: int
+    name: str
+    parent: Optional[int]
+    start: float
+    duration: float = 0.0
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+# Fase fittizia restituita quando non c'è una traccia attiva: gli attributi vengono ignorati
+class _NoSpan:
+    def set(self, **attrs):
+        pass
+
+NO_SPAN = _NoSpan()
+
+# Traccia di un update Telegram: l'id di correlazione accompagna tutte le fasi, anche quelle eseguite
+# nei thread dello scheduler (asyncio.to_thread copia il contesto) e nei task avviati durante la richiesta
+@dataclass
+class Trace:
+    kind: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started: float = field(default_factory=time.perf_counter)
+    timestamp: str = field(default_factory=lambda: datetime.now().isoformat(timespec="milliseconds"))
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    spans: List[Span] = field(default_factory=list)
+    ids: Any = field(default_factory=lambda: itertools.count(1))
+    status: str = "ok"
+    # Una volta scritta, la traccia non accetta altre fasi (es. da un monitoraggio avviato dalla richiesta)
+    closed: bool = False
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.id,
+            "kind": self.kind,
+            "ts": self.timestamp,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "status": self.status,
+            **self.attrs,
+            "spans": [
+                {"id": s.id, "parent": s.parent, "name": s.name, "start_ms": round(s.start, 2),
+                 "duration_ms": round(s.duration, 2), **s.attrs}
+                for s in sorted(self.spans, key=lambda s: s.start)
+            ],
+        }
+
+# Traccia e fase correnti del task (o del thread) in esecuzione
+CURRENT_TRACE: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+CURRENT_SPAN: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_span", default=None)
+
+# Id di correlazione della richiesta in corso (None fuori da una richiesta), utile nei messaggi di log
+def current_trace_id() -> Optional[str]:
+    trace = CURRENT_TRACE.get()
+    return trace.id if trace else None
+
+# Registra una fase della richiesta in corso: uso "with span("ssh.exec", host=...) as s: ... s.set(bytes=n)".
+# Fuori da una richiesta non registra nulla
+@contextmanager
+def span(name: str, **attrs):
+    trace = CURRENT_TRACE.get()
+    if trace is None or trace.closed:
+        yield NO_SPAN
+        return
+    current = Span(next(trace.ids), name, CURRENT_SPAN.get(), (time.perf_counter() - trace.started) * 1000, attrs=attrs)
+    token = CURRENT_SPAN.set(current.id)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        CURRENT_SPAN.reset(token)
+        current.duration = (time.perf_counter() - trace.started) * 1000 - current.start
+        if not trace.closed:
+            trace.spans.append(current)
+
+# Decoratore: registra ogni chiamata della funzione (normale o async) come fase con il nome indicato
+def spanned(name: str):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Tipo della richiesta, usato per raggruppare le tracce: "/comando", il prefisso della callback
+# ("select_computer", "journal", "CPU_graph"...) oppure "inline"
+def update_kind(update: Update) -> str:
+    if update.callback_query is not None and isinstance(update.callback_query.data, str):
+        return update.callback_query.data.split(":", 1)[0]
+    if update.message is not None and update.message.text and update.message.text.startswith("/"):
+        return update.message.text.split()[0].split("@", 1)[0]
+    if update.inline_query is not None:
+        return "inline"
+    return "update"
+
+# Scrittura delle tracce: le righe passano da una coda a un thread dedicato, così il loop non attende il disco
+TRACE_LOGGER = logging.getLogger("linuxadminbot.traces")
+TRACE_LOGGER.propagate = False
+TRACE_LISTENER: Optional[QueueListener] = None
+
+def write_trace(trace: Trace):
+    if TRACE_LISTENER is None:
+        return
+    try:
+        TRACE_LOGGER.info(json.dumps(trace.to_record(), ensure_ascii=False, default=str))
+    except Exception as e:
+        logger.warning(f"Scrittura della traccia {trace.id} non riuscita: {e}")
+
+# Decoratore per gli handler di Telegram: apre una traccia per l'update, con la fase "handler" come radice,
+# e la scrive alla fine della gestione
+def traced(handler):
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context, *args, **kwargs):
+        if TRACE_LISTENER is None or not isinstance(update, Update):
+            return await handler(update, context, *args, **kwargs)
+        trace = Trace(update_kind(update))
+        if update.effective_user:
+            trace.attrs["user_id"] = update.effective_user.id
+        if update.effective_chat:
+            trace.attrs["chat_id"] = update.effective_chat.id
+        if update.callback_query is not None and isinstance(update.callback_query.data, str):
+            trace.attrs["data"] = update.callback_query.data
+        token = CURRENT_TRACE.set(trace)
+        try:
+            with span("handler", handler=handler.__name__):
+                return await handler(update, context, *args, **kwargs)
+        except BaseException as e:
+            trace.status = type(e).__name__
+            raise
+        finally:
+            CURRENT_TRACE.reset(token)
+            trace.closed = True
+            write_trace(trace)
+    return wrapper
+
+# Dimensione (byte) del corpo di una richiesta all'API di Telegram, file compresi
+def request_size(request_data) -> int:
+    if request_data is None:
+        return 0
+    size = len(request_data.json_payload or b"")
+    if request_data.contains_files:
+        for part in request_data.multipart_data.values():
+            content = part[1] if isinstance(part, tuple) else part
+            if isinstance(content, (bytes, bytearray)):
+                size += len(content)
+    return size
+
+# Client HTTP del bot che registra ogni chiamata all'API di Telegram (sendPhoto, editMessageText...)
+# come fase della richiesta in corso, con i byte inviati e ricevuti
+class TracingRequest(HTTPXRequest):
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        with span(f"telegram.{url.rsplit('/', 1)[-1]}", bytes_out=request_size(request_data)) as current:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            current.set(status=code, bytes_in=len(payload))
+            return code, payload
+
+# Client HTTP da passare ad Application.builder().request(); stessa dimensione del pool di quello predefinito
+def build_request() -> HTTPXRequest:
+    return TracingRequest(connection_pool_size=256) if TRACE_ENABLED else HTTPXRequest(connection_pool_size=256)
+
+# Avvia la scrittura delle tracce sul file con rotazione
+def start_tracing():
+    global TRACE_LISTENER
+    if not TRACE_ENABLED or TRACE_LISTENER is not None:
+        return
+    try:
+        file_handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding="utf-8")
+    except OSError as e:
+        logger.warning(f"File delle tracce {TRACE_FILE} non disponibile ({e}): tracciamento disattivato.")
+        return
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    TRACE_LOGGER.addHandler(QueueHandler(records))
+    TRACE_LOGGER.setLevel(logging.INFO)
+    TRACE_LISTENER = QueueListener(records, file_handler)
+    TRACE_LISTENER.start()
+    # All'uscita vengono scritte le tracce ancora in coda
+    atexit.register(stop_tracing)
+
+# Scrive le tracce ancora in coda e ferma il thread di scrittura
+def stop_tracing():
+    global TRACE_LISTENER
+    listener, TRACE_LISTENER = TRACE_LISTENER, None
+    if listener is not None:
+        listener.stop()
@@ -1,46 +1,30 @@
 import asyncio
+import time
 from asyncio.log import logger
 from datetime import datetime
 import paramiko.ssh_exception 
 from paramiko.ssh_exception import NoValidConnectionsError
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from config.config import GIOVANNI, ANTONINO, MONITORED_COMPUTERS, MAX_TELEGRAM_MESSAGE_LENGTH, PATH_PRG
-from pathlib import Path
+from config.config import GIOVANNI, ANTONINO, MONITORED_COMPUTERS, MAX_TELEGRAM_MESSAGE_LENGTH, PATH_PRG, PRECOLLECT_ENABLED, PRECOLLECT_TARGETS, MUTATING_COMMANDS, REMOTE_SESSION_ENABLED
 import html
+from .history import get_snapshot, store_snapshot
+from .cache import COMMAND_CACHE
+from .scheduler import SCHEDULER, PRIORITY_INTERACTIVE, LAST_QUEUE_WAIT, QueueFullError
+from .health import BREAKER, CONNECTION_ERRORS, HostUnavailableError
+from .session import SessionError, SessionTimeout, run_session_command
+from .deploy import ensure_remote_scripts, invalidate_remote_scripts, SCRIPT_NOT_FOUND
+from .lifecycle import ssh_client
+from .tracing import span, spanned
 # Importa typing la gestione dei tipi di dati in python
 from typing import Dict, Any, List, Optional
 
 
 LIST_OF_ADMINS = [GIOVANNI, ANTONINO]  
 
-# Ottiene il percorso del progetto in modo dinamico sostituendo l'utente locale con l'utente SSH
-# 
-# Parametri:
-#   ssh_user (str): Nome dell'utente SSH a cui mappare il percorso
-#   local_path (Path): Percorso locale del progetto (oggetto Path)
-#
-# Ritorna:
-#   str: Percorso del progetto mappato per l'utente SSH, o il percorso originale se non è possibile mapparlo
-def get_ssh_project_path(ssh_user: str, local_path: Path) -> str:
-    # Divide il percorso in componenti
-    parts = local_path.parts
-    
-    # Cerca l'indice della cartella 'home' nel percorso
-    try:
-        home_idx = parts.index('home')
-        # Ricostruisce il percorso sostituendo l'utente locale dopo 'home' con ssh_user
-        # Esempio: /home/local_user/project -> /home/ssh_user/project
-        new_parts = parts[:home_idx+1] + (ssh_user,) + parts[home_idx+2:]
-        
-        # L'asterisco (*) converte la tupla in argomenti separati:
-        # Esempio: Path(*['home', 'ssh_user', 'project']) diventa Path('home', 'ssh_user', 'project')
-        # Equivalente a scrivere manualmente: Path('home', 'ssh_user', 'project')
-        return str(Path(*new_parts))
-    except ValueError:
-        # Se 'home' non è presente nel percorso, ritorna il percorso originale
-        # (caso in cui il progetto non è nella home directory)
-        return str(local_path)
+# Ultima interazione di un admin per ogni chat: {chat_id: epoch}.
+# Serve a fermare gli aggiornamenti automatici (es. dashboard) quando nessuno sta guardando
+CHAT_ACTIVITY: Dict[int, float] = {}
 
 def truncate_message(text, max_length=MAX_TELEGRAM_MESSAGE_LENGTH, html_tag_len=11):
     # Calcola lo spazio massimo disponibile per il contenuto, lasciando spazio per il tag HTML e il messaggio di troncamento
@@ -51,6 +35,7 @@ def truncate_message(text, max_length=MAX_TELEGRAM_MESSAGE_LENGTH, html_tag_len=
     # Altrimenti restituisce il testo originale
     return text
 
+@spanned("check_admin")
 async def check_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Middleware che verifica se l'utente è autorizzato 
     user = update.effective_user
@@ -117,6 +102,10 @@ async def check_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         return False
     
+    # Registra l'attività nella chat
+    if update.effective_chat:
+        CHAT_ACTIVITY[update.effective_chat.id] = time.time()
+
     # Log accesso autorizzato su file separato
     try:
         # Logga accessi admin autorizzati in un file dedicato.
@@ -130,7 +119,34 @@ async def check_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return True
 
 
-async def execute_bash_command(update: Update, command: str, is_callback: bool = False, context=None):
+# Invia l'output di un comando remoto formattato per Telegram.
+# Se age è indicato, l'output proviene da uno snapshot (o dalla cache, se from_cache) e ne viene mostrata l'età
+# queue_wait è il tempo passato in coda nello scheduler, mostrato se significativo
+async def reply_command_output(update: Update, command: str, output: str, is_callback: bool, age: Optional[float] = None,
+                               from_cache: bool = False, queue_wait: float = 0.0):
+    # Escape HTML special characters before wrapping in <pre> tags
+    escaped_output = html.escape(output)
+    escaped_output = truncate_message(escaped_output, html_tag_len=60)
+    escaped_output = f"<pre>{escaped_output}</pre>"
+    if age is not None and from_cache:
+        escaped_output += f"\n<i>🗄️ Risultato in cache da {format_age(age)}</i>"
+    elif age is not None:
+        escaped_output += f"\n<i>🕒 Dati raccolti {format_age(age)} fa</i>"
+    if queue_wait >= 0.5:
+        escaped_output += f"\n<i>⏳ In coda per {queue_wait:.1f} s</i>"
+
+    # Il pulsante di aggiornamento è disponibile solo per i comandi pre-raccolti o in cache
+    reply_markup = None
+    if (PRECOLLECT_ENABLED and command in PRECOLLECT_TARGETS) or COMMAND_CACHE.is_cacheable(command):
+        reply_markup = get_refresh_keyboard(command)
+
+    # Invio risposta differenziato tra callback e messaggi diretti
+    if is_callback and update.callback_query:
+        await update.callback_query.edit_message_text(escaped_output, parse_mode="HTML", reply_markup=reply_markup)
+    elif update.message:
+        await update.message.reply_text(escaped_output, parse_mode="HTML", reply_markup=reply_markup)
+
+async def execute_bash_command(update: Update, command: str, is_callback: bool = False, context=None, force: bool = False):
     # Recupera il computer selezionato dall'user_data del context
     selected = None
     if context is not None:
@@ -163,32 +179,54 @@ async def execute_bash_command(update: Update, command: str, is_callback: bool =
         # Interrompe l'esecuzione della funzione
         return False
 
+    # Per i comandi pre-raccolti in background risponde subito con l'ultimo snapshot disponibile,
+    # a meno che l'utente non abbia chiesto esplicitamente un aggiornamento
+    is_precollected = PRECOLLECT_ENABLED and command in PRECOLLECT_TARGETS
+    snapshot = get_snapshot(selected, command) if is_precollected and not force else None
+    if snapshot:
+        await reply_command_output(update, command, snapshot["output"], is_callback, age=time.time() - snapshot["ts"])
+        return True
+
+    # I comandi con dati poco variabili vengono serviti dalla cache finché il TTL non scade
+    if force:
+        COMMAND_CACHE.invalidate(selected, command)
+    cached = COMMAND_CACHE.get(selected, command)
+    if cached:
+        output, cached_at = cached
+        await reply_command_output(update, command, output, is_callback, age=time.time() - cached_at, from_cache=True)
+        return True
+
     try:
-        # Configurazione connessione SSH
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(computer["ip"], username=computer["user"], timeout=5)
-        
-        # Esegue lo script remoto passando il comando come parametro
-        remote_path = get_ssh_project_path(computer["user"], PATH_PRG)
-        script_path = f"{remote_path}/scripts/linux_admin.sh"
-        stdin, stdout, stderr = ssh.exec_command(f"bash {script_path} {command}")
-        
-        # Elaborazione output con gestione errori e formattazione per Telegram
-        output = stdout.read().decode() + stderr.read().decode()
-        
-        # Escape HTML special characters before wrapping in <pre> tags
-        escaped_output = html.escape(output)
-        escaped_output = truncate_message(escaped_output)
-        escaped_output = f"<pre>{escaped_output}</pre>"
-        
-        ssh.close()
+        # Esegue lo script remoto passando il comando come parametro, tramite lo scheduler centrale
+        output = await run_admin_command(computer, command, PRIORITY_INTERACTIVE)
+
+        # Aggiorna lo snapshot così che i click successivi rispondano con il dato appena raccolto
+        if is_precollected:
+            store_snapshot(selected, command, output)
+        # Un comando che modifica il sistema rende obsoleti i risultati in cache del computer
+        if command in MUTATING_COMMANDS:
+            COMMAND_CACHE.invalidate_host(selected)
+        COMMAND_CACHE.put(selected, command, output)
         
-        # Invio risposta differenziato tra callback e messaggi diretti
+        await reply_command_output(update, command, output, is_callback, queue_wait=LAST_QUEUE_WAIT.get())
+
+    # Computer noto come irraggiungibile: risponde subito con l'ultimo errore invece di attendere il timeout
+    except HostUnavailableError as e:
+        error_msg = f"⛔ {html.escape(str(e))}\nVerrà ricontrollato automaticamente."
         if is_callback and update.callback_query:
-            await update.callback_query.edit_message_text(escaped_output, parse_mode="HTML")
+            await update.callback_query.edit_message_text(error_msg, parse_mode="HTML")
         elif update.message:
-            await update.message.reply_text(escaped_output, parse_mode="HTML")
+            await update.message.reply_text(error_msg, parse_mode="HTML")
+        return False
+
+    # Troppe richieste in coda: rifiuta subito invece di far attendere l'utente
+    except QueueFullError:
+        error_msg = f"🚦 Troppe operazioni in coda per {selected}, riprova tra poco."
+        if is_callback and update.callback_query:
+            await update.callback_query.edit_message_text(error_msg)
+        elif update.message:
+            await update.message.reply_text(error_msg)
+        return False
     
     # Gestione errori specifici di connessione SSH
     except (NoValidConnectionsError, TimeoutError, OSError) as e:
@@ -226,10 +264,122 @@ async def is_host_reachable(ip):
         # Logga eventuali errori e restituisce False
         logger.warning(f"Ping fallito per {ip}: {e}")
         return False
+
+# Verifica se il computer è raggiungibile tenendo conto del suo stato di salute:
+# se è noto come irraggiungibile risponde subito, altrimenti esegue il ping e ne registra l'esito
+async def probe_host(computer: Dict[str, Any]) -> bool:
+    name = computer["name"]
+    if not BREAKER.allows(name):
+        return False
+    online = await is_host_reachable(computer["ip"])
+    if online:
+        BREAKER.record_probe_success(name)
+    else:
+        BREAKER.record_failure(name, TimeoutError("nessuna risposta al ping"))
+    return online
     
 # La funzione ricerca il computer scelto nella lista di computer monitorati [Lista di dizionari] e restituisce il primo dizionario trovato con il nome corrispondente.
 def find_computer_by_name(computers: List[Dict[str, Any]], target_name: str) -> Optional[Dict[str, Any]]:
     for computer in computers:
         if computer["name"] == target_name:
             return computer
-    return None
\ No newline at end of file
+    return None
+
+# Costruisce il comando remoto che esegue una funzione di linux_admin.sh dalla cartella remota degli script
+def build_admin_command(remote_dir: str, command: str) -> str:
+    return f"bash {remote_dir}/scripts/linux_admin.sh {command}"
+
+# Converte un'età in secondi in un testo leggibile (es. "45 s", "3 min", "2 h")
+def format_age(seconds: float) -> str:
+    if seconds < 60:
+        return f"{int(seconds)} s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} min"
+    return f"{int(seconds // 3600)} h"
+
+# Tastiera con il pulsante per forzare l'aggiornamento di un comando o grafico
+def get_refresh_keyboard(command: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Aggiorna", callback_data=f"refresh:{command}")]])
+
+# Restituisce i computer monitorati che hanno il tag indicato (tutti se il tag non è specificato)
+def get_computers_by_tag(tag: Optional[str] = None) -> List[Dict[str, Any]]:
+    if not tag:
+        return list(MONITORED_COMPUTERS)
+    return [computer for computer in MONITORED_COMPUTERS if tag in computer.get("tags", [])]
+
+# Esegue un comando sul computer remoto con una nuova connessione SSH e ne restituisce l'output.
+# La funzione è bloccante: va eseguita in un thread separato (vedi run_remote_command)
+def ssh_exec(computer: Dict[str, Any], command: str) -> str:
+    with ssh_client(computer, "comando") as ssh, span("ssh.exec") as current:
+        stdin, stdout, stderr = ssh.exec_command(command)
+        output = stdout.read().decode() + stderr.read().decode()
+        current.set(bytes=len(output))
+        return output
+
+# Esegue una funzione di linux_admin.sh con una nuova connessione SSH, inviando prima gli script se necessario.
+# Se gli script risultano spariti dal computer vengono inviati di nuovo e il comando viene ripetuto una volta.
+# La funzione è bloccante: va eseguita in un thread separato (vedi run_admin_command)
+def ssh_exec_admin(computer: Dict[str, Any], command: str) -> str:
+    with ssh_client(computer, f"comando {command}") as ssh:
+        for attempt in range(2):
+            remote_dir = ensure_remote_scripts(ssh, computer)
+            with span("ssh.exec") as current:
+                stdin, stdout, stderr = ssh.exec_command(build_admin_command(remote_dir, command))
+                output = stdout.read().decode() + stderr.read().decode()
+                current.set(bytes=len(output))
+            if attempt == 0 and stdout.channel.recv_exit_status() == SCRIPT_NOT_FOUND:
+                invalidate_remote_scripts(computer["name"])
+                continue
+            return output
+
+# Esegue un comando remoto passando a on_line ogni riga di output appena arriva.
+# La lettura si interrompe (e la connessione viene chiusa) quando on_line restituisce False.
+# La funzione è bloccante: va eseguita in un thread separato
+def ssh_stream_lines(computer: Dict[str, Any], command: str, on_line) -> None:
+    with ssh_client(computer, "lettura in streaming") as ssh:
+        stdin, stdout, stderr = ssh.exec_command(command)
+        for line in stdout:
+            if not on_line(line):
+                break
+
+# Esegue un'operazione SSH bloccante sul computer tramite lo scheduler centrale, aggiornandone lo stato di salute.
+# Se il computer è noto come irraggiungibile solleva subito HostUnavailableError, senza occupare posti nello scheduler
+async def run_on_host(computer: Dict[str, Any], priority: int, func, *args):
+    name = computer["name"]
+    BREAKER.check(name)
+    try:
+        with span("remote", host=name, op=func.__name__) as current:
+            result = await SCHEDULER.run(name, priority, func, *args)
+            current.set(queue_wait_ms=round(LAST_QUEUE_WAIT.get() * 1000, 2))
+            if isinstance(result, (str, bytes)):
+                current.set(bytes=len(result))
+    except CONNECTION_ERRORS as e:
+        BREAKER.record_failure(name, e)
+        raise
+    except BaseException:
+        # Errori non di connessione (coda piena, annullamento...): la prova in half-open non è conclusa
+        BREAKER.release_trial(name)
+        raise
+    BREAKER.record_success(name)
+    return result
+
+# Versione asincrona di ssh_exec: esegue il comando in un thread per non bloccare il loop di Telegram,
+# passando dallo scheduler centrale che applica priorità e limiti di concorrenza per computer
+async def run_remote_command(computer: Dict[str, Any], command: str, priority: int = PRIORITY_INTERACTIVE) -> str:
+    with span("command", host=computer["name"], command=command[:80]):
+        return await run_on_host(computer, priority, ssh_exec, computer, command)
+
+# Esegue una funzione di linux_admin.sh sul computer. Se la sessione persistente è attiva il comando
+# passa dal worker remoto (senza avviare un nuovo interprete bash); se il worker non è disponibile
+# si torna all'esecuzione classica dello script
+async def run_admin_command(computer: Dict[str, Any], command: str, priority: int = PRIORITY_INTERACTIVE) -> str:
+    with span("command", host=computer["name"], command=command):
+        if REMOTE_SESSION_ENABLED:
+            try:
+                return await run_on_host(computer, priority, run_session_command, computer, command)
+            except SessionTimeout:
+                # Il comando è lento, non il worker assente: ripeterlo senza sessione impiegherebbe altrettanto
+                raise
+            except SessionError as e:
+                logger.info(f"Sessione persistente non disponibile su {computer['name']} ({e}): uso l'esecuzione classica")
+        return await run_on_host(computer, priority, ssh_exec_admin, computer, command)
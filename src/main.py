@@ -1,10 +1,23 @@
 # Importa il modulo logging per la gestione dei log
 import logging
 # Importa la libreria per la gestione delle applicazioni Telegram
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler
 from config.config import BOT_TOKEN
 from handlers.button import button_handler
-from handlers.commands import menu, start
+from handlers.commands import menu, start, compare, connections_command
+from handlers.precollect import start_precollect
+from handlers.health import start_health_probes
+from handlers.alerts import start_alert_digest
+from handlers.anomaly import start_anomaly_detection
+from handlers.lifecycle import shutdown_resources, start_leak_check
+from handlers.profiling import profile_command, start_loop_watchdog
+from handlers.tracing import traced, build_request, start_tracing
+from handlers.outbox import OUTBOX
+from handlers.state import start_state, close_state
+from handlers.recovery import restore_state
+from handlers.journal import journal_command, search_command
+from handlers.dashboard import dashboard_command
+from handlers.picker import inline_host_search
 
 # Configura il logging per mostrare informazioni utili durante l'esecuzione
 logging.basicConfig(
@@ -18,13 +31,49 @@ def main():
     if not BOT_TOKEN:
         raise ValueError("BOT_TOKEN non è impostato. Fornisci un token valido in config/config.py.")
     
-    # Crea l'applicazione Telegram con il token fornito
-    app = Application.builder().token(BOT_TOKEN).build()
-    # Configurazione dei comandi del bot
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("menu", menu))
+    # Avvia la scrittura su file delle tracce delle richieste
+    start_tracing()
+    # Crea l'applicazione Telegram con il token fornito.
+    # Il client HTTP registra le chiamate all'API di Telegram nelle tracce delle richieste;
+    # tutti gli invii passano dalla coda dei messaggi in uscita, che rispetta i limiti di Telegram;
+    # all'avvio viene ripristinato lo stato salvato prima dell'ultimo riavvio (selezioni, monitoraggi...);
+    # all'arresto lo stato viene scritto su disco, poi vengono chiuse tutte le connessioni SSH e annullati i task ancora attivi
+    app = (
+        Application.builder().token(BOT_TOKEN)
+        .request(build_request())
+        .rate_limiter(OUTBOX)
+        .post_init(restore_state)
+        .post_stop(close_state)
+        .post_shutdown(shutdown_resources)
+        .build()
+    )
+    # Apre il database dello stato persistente (prima del polling, che lo ripristina in post_init)
+    start_state(app)
+    # Configurazione dei comandi del bot (ogni handler apre una traccia per l'update ricevuto)
+    app.add_handler(CommandHandler("start", traced(start)))
+    app.add_handler(CommandHandler("menu", traced(menu)))
+    app.add_handler(CommandHandler("confronto", traced(compare)))
+    app.add_handler(CommandHandler("journal", traced(journal_command)))
+    app.add_handler(CommandHandler("cerca", traced(search_command)))
+    app.add_handler(CommandHandler("dashboard", traced(dashboard_command)))
+    app.add_handler(CommandHandler("connessioni", traced(connections_command)))
+    app.add_handler(CommandHandler("profilo", traced(profile_command)))
+    # Ricerca inline dei computer (@bot nome)
+    app.add_handler(InlineQueryHandler(traced(inline_host_search)))
     # Aggiunge il gestore per le callback dei pulsanti inline
-    app.add_handler(CallbackQueryHandler(button_handler, pattern=".*")) # type: ignore
+    app.add_handler(CallbackQueryHandler(traced(button_handler), pattern=".*")) # type: ignore
+    # Avvia la pre-raccolta periodica dei dati in background
+    start_precollect(app)
+    # Avvia la verifica in background dei computer irraggiungibili
+    start_health_probes(app)
+    # Avvia il riepilogo periodico degli alert attivi
+    start_alert_digest(app)
+    # Avvia l'analisi periodica dello storico CPU/RAM alla ricerca di valori anomali
+    start_anomaly_detection(app)
+    # Avvia il controllo periodico delle connessioni SSH aperte fuori dal registro delle risorse
+    start_leak_check(app)
+    # Avvia il controllo del ritardo del loop, che salva lo stack del codice quando il bot si blocca
+    start_loop_watchdog(app)
     # Avvia il polling per ricevere gli aggiornamenti da Telegram
     app.run_polling()
 
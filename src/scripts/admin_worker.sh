@@ -0,0 +1,42 @@
+#!/bin/bash
+# Worker persistente: carica una sola volta le funzioni di linux_admin.sh e resta in attesa di richieste su stdin.
+# Evita di avviare un nuovo interprete bash (e di rileggere tutto lo script) a ogni comando del bot.
+#
+# Protocollo (una richiesta per riga, le risposte arrivano nello stesso ordine):
+#   richiesta: REQ <id> <comando>
+#   risposta:  RES <id> <codice di uscita> <lunghezza in byte>\n<output>
+#
+# Parametri:
+#   $1: secondi di inattività dopo i quali il worker termina (default 300)
+
+IDLE_TIMEOUT="${1:-300}"
+
+# Importa le funzioni senza eseguire il dispatcher
+source "$(dirname "${BASH_SOURCE[0]}")/linux_admin.sh"
+
+# Lunghezza in byte (e non in caratteri) del testo, necessaria per delimitare la risposta
+function byte_length() {
+    local LC_ALL=C
+    echo "${#1}"
+}
+
+# Segnala al bot che le funzioni sono state caricate
+echo "READY"
+
+while IFS=' ' read -r -t "$IDLE_TIMEOUT" tag id command; do
+    if [[ "$tag" != "REQ" || -z "$id" ]]; then
+        continue
+    fi
+    # Accetta solo nomi di comando semplici: il comando viene passato al dispatcher e mai valutato
+    if [[ ! "$command" =~ ^[A-Za-z_]+$ ]]; then
+        output="Comando non valido: $command"
+        status=1
+    else
+        # Il codice di uscita viene accodato all'output per conservare anche i ritorni a capo finali.
+        # stdin è /dev/null così che nessun comando possa leggere le richieste successive
+        output=$(dispatch_command "$command" < /dev/null 2>&1; printf '\n%d' "$?")
+        status="${output##*$'\n'}"
+        output="${output%$'\n'*}"
+    fi
+    printf 'RES %s %d %d\n%s' "$id" "$status" "$(byte_length "$output")" "$output"
+done
@@ -1,18 +1,62 @@
 #!/bin/bash
 
-THRESHOLD=95
-CHECK_INTERVAL=30
+# Argomenti: soglia oltre la quale viene mostrata la tabella dei processi (predefinita 95), valore di rientro
+# e intervallo minimo/massimo in secondi tra due controlli
+THRESHOLD=${1:-95}
+CLEAR=${2:-$THRESHOLD}
+MIN_INTERVAL=${3:-5}
+MAX_INTERVAL=${4:-60}
 MAX_PROCESSES=10
+# Secondi su cui viene misurato l'uso della CPU, già trascorsi al momento dell'attesa
+MEASURE_WINDOW=1
+# Vale 1 dal superamento della soglia finché il valore non scende sotto il rientro
+INCIDENT=0
+CLK_TCK=$(getconf CLK_TCK)
+
+# Calcola in INTERVAL l'attesa fino al prossimo controllo: massima finché il valore resta sotto metà soglia,
+# sempre più breve avvicinandosi alla soglia, minima sopra soglia e finché il valore non rientra
+next_interval() {
+    local value=$1
+    local start=$((THRESHOLD / 2))
+    if [[ $value -ge $THRESHOLD ]]; then
+        INCIDENT=1
+    elif [[ $value -lt $CLEAR ]]; then
+        INCIDENT=0
+    fi
+    if [[ $INCIDENT -eq 1 ]]; then
+        INTERVAL=$MIN_INTERVAL
+    elif [[ $value -le $start ]]; then
+        INTERVAL=$MAX_INTERVAL
+    else
+        INTERVAL=$((MAX_INTERVAL - (MAX_INTERVAL - MIN_INTERVAL) * (value - start) / (THRESHOLD - start)))
+    fi
+}
+
+# Tempi totali e di inattività della CPU (in tick, dalla riga "cpu" di /proc/stat): user, nice, system,
+# idle, iowait, irq, softirq, steal. Come con top, il tempo in attesa di I/O conta come CPU usata
+read_cpu_times() {
+    awk '/^cpu / {print $2 + $3 + $4 + $5 + $6 + $7 + $8 + $9, $5}' /proc/stat
+}
+
+# Tempo di CPU (ms) usato finora dallo script e dai comandi già terminati che ha eseguito (/proc/<pid>/stat)
+script_cpu_ms() {
+    awk -v tck="$CLK_TCK" '{print int(($14 + $15 + $16 + $17) * 1000 / tck)}' /proc/$$/stat
+}
+
+echo "Monitoraggio CPU attivo (soglia: ${THRESHOLD}%)"
 
 while true; do
-    echo "Monitoraggio CPU attivo (soglia: ${THRESHOLD}%)"
-    
-    # Calcola la percentuale di CPU usata (media su tutti i core):
-    # top -bn2: esegue top in modalità batch per 2 iterazioni
-    # grep: filtra la riga con le statistiche CPU
-    # tail: prende l'ultima lettura (più stabile)
-    # awk: calcola %CPU usata come 100 - %idle
-    CPU_PERCENT=$(top -bn2 | grep "Cpu(s)" | tail -n 1 | awk '{print 100 - $8}' | awk '{printf("%.0f", $1)}')
+    # Calcola la percentuale di CPU usata (media su tutti i core) confrontando due letture di /proc/stat
+    # a MEASURE_WINDOW secondi di distanza: molto più leggero di top -bn2, che impiega alcuni secondi di CPU
+    read -r TOTAL_BEFORE IDLE_BEFORE < <(read_cpu_times)
+    sleep $MEASURE_WINDOW
+    read -r TOTAL_AFTER IDLE_AFTER < <(read_cpu_times)
+    ELAPSED=$((TOTAL_AFTER - TOTAL_BEFORE))
+    if [[ $ELAPSED -gt 0 ]]; then
+        CPU_PERCENT=$(((100 * (ELAPSED - (IDLE_AFTER - IDLE_BEFORE)) + ELAPSED / 2) / ELAPSED))
+    else
+        CPU_PERCENT=0
+    fi
 
     # Se superata la soglia, mostra processi più affamati di CPU
     if [[ $CPU_PERCENT -gt $THRESHOLD ]]; then
@@ -34,6 +78,12 @@ while true; do
         echo "===END_MONITOR_BLOCK==="
     fi
 
-    # Attesa tra un check e l'altro
-    sleep $CHECK_INTERVAL
+    # Valore misurato, inviato a ogni controllo: le notifiche sono decise dal bot
+    echo "===SAMPLE=== cpu ${CPU_PERCENT}"
+
+    # Attesa tra un check e l'altro, adattata al valore misurato; il bot riceve l'intervallo scelto
+    # e il tempo di CPU consumato dallo script, per stimarne il costo sul computer
+    next_interval $CPU_PERCENT
+    echo "===STATS=== cpu ${INTERVAL} $(script_cpu_ms)"
+    sleep $((INTERVAL - MEASURE_WINDOW))
 done
\ No newline at end of file
@@ -443,59 +443,68 @@ function check_ssh_status() {
 
 ### DISPATCHER PRINCIPALE ###
 
-# Gestisce i diversi comandi e funzionalità
-case "$1" in
-    processes)
-        show_processes
-        ;;
-    loadavg)
-        show_loadavg
-        ;;
-    iostat)
-        show_iostat
-        ;;
-    vmstat)
-        show_vmstat
-        ;;
-    services)
-        show_services
-        ;;
-    resources)
-        show_resources
-        ;;
-    updates)
-        check_updates
-        ;;
-    dns)
-        show_dns
-        ;;
-    hardware)
-        hardware_info
-        ;;
-    network)
-        network_info
-        ;;
-    packages)
-        list_user_packages
-        ;;
-    logs)
-        show_logs
-        ;;
-    uptime)
-        show_uptime
-        ;;
-    info_kernel_os)
-        get_system_info
-        ;;
-    sudolog)
-        show_sudo_log
-        ;;
-    ssh)
-        check_ssh_status
-        ;;
-    *)
-        echo "Comando non valido. Opzioni disponibili:"
-        echo "processes | resources | updates | dns | hardware | network | packages | logs | uptime | system | loadavg | iostat | vmstat | services | sudolog | check_ssh_status"
-        exit 1
-        ;;
-esac
\ No newline at end of file
+# Gestisce i diversi comandi e funzionalità.
+# È una funzione per poter essere richiamata anche dal worker persistente (admin_worker.sh)
+function dispatch_command() {
+    case "$1" in
+        processes)
+            show_processes
+            ;;
+        loadavg)
+            show_loadavg
+            ;;
+        iostat)
+            show_iostat
+            ;;
+        vmstat)
+            show_vmstat
+            ;;
+        services)
+            show_services
+            ;;
+        resources)
+            show_resources
+            ;;
+        updates)
+            check_updates
+            ;;
+        dns)
+            show_dns
+            ;;
+        hardware)
+            hardware_info
+            ;;
+        network)
+            network_info
+            ;;
+        packages)
+            list_user_packages
+            ;;
+        logs)
+            show_logs
+            ;;
+        uptime)
+            show_uptime
+            ;;
+        info_kernel_os)
+            get_system_info
+            ;;
+        sudolog)
+            show_sudo_log
+            ;;
+        ssh)
+            check_ssh_status
+            ;;
+        *)
+            echo "Comando non valido. Opzioni disponibili:"
+            echo "processes | resources | updates | dns | hardware | network | packages | logs | uptime | system | loadavg | iostat | vmstat | services | sudolog | check_ssh_status"
+            return 1
+            ;;
+    esac
+}
+
+# Eseguito direttamente (e non importato con source): esegue il comando passato come argomento
+if [[ "${BASH_SOURCE[0]}" == "$0" ]]; then
+    dispatch_command "$1"
+    exit $?
+fi
\ No newline at end of file
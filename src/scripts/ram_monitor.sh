@@ -1,12 +1,45 @@
 #!/bin/bash
 
-THRESHOLD=95
-CHECK_INTERVAL=30
+# Argomenti: soglia oltre la quale viene mostrata la tabella dei processi (predefinita 95), valore di rientro
+# e intervallo minimo/massimo in secondi tra due controlli
+THRESHOLD=${1:-95}
+CLEAR=${2:-$THRESHOLD}
+MIN_INTERVAL=${3:-5}
+MAX_INTERVAL=${4:-60}
 MAX_PROCESSES=10
+# Secondi già trascorsi durante la misura (la lettura della RAM è istantanea)
+MEASURE_WINDOW=0
+# Vale 1 dal superamento della soglia finché il valore non scende sotto il rientro
+INCIDENT=0
+CLK_TCK=$(getconf CLK_TCK)
 
-while true; do
-    echo "Monitoraggio RAM attivo (soglia: ${THRESHOLD}%)"
+# Calcola in INTERVAL l'attesa fino al prossimo controllo: massima finché il valore resta sotto metà soglia,
+# sempre più breve avvicinandosi alla soglia, minima sopra soglia e finché il valore non rientra
+next_interval() {
+    local value=$1
+    local start=$((THRESHOLD / 2))
+    if [[ $value -ge $THRESHOLD ]]; then
+        INCIDENT=1
+    elif [[ $value -lt $CLEAR ]]; then
+        INCIDENT=0
+    fi
+    if [[ $INCIDENT -eq 1 ]]; then
+        INTERVAL=$MIN_INTERVAL
+    elif [[ $value -le $start ]]; then
+        INTERVAL=$MAX_INTERVAL
+    else
+        INTERVAL=$((MAX_INTERVAL - (MAX_INTERVAL - MIN_INTERVAL) * (value - start) / (THRESHOLD - start)))
+    fi
+}
+
+# Tempo di CPU (ms) usato finora dallo script e dai comandi già terminati che ha eseguito (/proc/<pid>/stat)
+script_cpu_ms() {
+    awk -v tck="$CLK_TCK" '{print int(($14 + $15 + $16 + $17) * 1000 / tck)}' /proc/$$/stat
+}
 
+echo "Monitoraggio RAM attivo (soglia: ${THRESHOLD}%)"
+
+while true; do
     # Calcola la percentuale di RAM usata:
     # free: mostra info memoria
     # awk: calcola % RAM usata come (totale - disponibile)/totale * 100
@@ -33,6 +66,12 @@ while true; do
         echo "===END_MONITOR_BLOCK==="
     fi
 
-    # Attesa tra un check e l'altro
-    sleep $CHECK_INTERVAL
+    # Valore misurato, inviato a ogni controllo: le notifiche sono decise dal bot
+    echo "===SAMPLE=== ram ${RAM_PERCENT}"
+
+    # Attesa tra un check e l'altro, adattata al valore misurato; il bot riceve l'intervallo scelto
+    # e il tempo di CPU consumato dallo script, per stimarne il costo sul computer
+    next_interval $RAM_PERCENT
+    echo "===STATS=== ram ${INTERVAL} $(script_cpu_ms)"
+    sleep $((INTERVAL - MEASURE_WINDOW))
 done
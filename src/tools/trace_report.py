@@ -0,0 +1,101 @@
+# Analisi offline delle tracce scritte dal bot (logs/traces.jsonl e file ruotati).
+# Per ogni tipo di richiesta (comando o callback) mostra la durata complessiva e le fasi più lente,
+# ordinate per tempo proprio (durata della fase esclusi i tempi delle fasi figlie).
+#
+# Uso: python tools/trace_report.py [file ...] [--kind CPU_graph] [--top 5]
+import sys
+import glob
+import json
+import argparse
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List
+
+DEFAULT_TRACE_FILE = Path(__file__).resolve().parent.parent / "logs/traces.jsonl"
+
+# Percentile (0-1) di una lista di valori, con il metodo del valore più vicino
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+# Righe JSON valide dei file indicati; i file ruotati (traces.jsonl.1, .2...) sono letti dal più vecchio
+def read_traces(paths: Iterable[Path]) -> Iterator[dict]:
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as trace_file:
+                for line in trace_file:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except OSError as e:
+            print(f"Impossibile leggere {path}: {e}", file=sys.stderr)
+
+def default_paths() -> List[Path]:
+    rotated = sorted(glob.glob(f"{DEFAULT_TRACE_FILE}.*"), key=lambda p: -int(p.rsplit(".", 1)[1]) if p.rsplit(".", 1)[1].isdigit() else 0)
+    return [Path(p) for p in rotated] + [DEFAULT_TRACE_FILE]
+
+# Tempo proprio di ogni fase: la sua durata meno quella delle fasi figlie (mai negativo, le figlie possono
+# essere concorrenti come nelle richieste a più computer)
+def self_times(spans: List[dict]) -> Dict[int, float]:
+    children: Dict[int, float] = defaultdict(float)
+    for span in spans:
+        if span.get("parent") is not None:
+            children[span["parent"]] += span["duration_ms"]
+    return {span["id"]: max(span["duration_ms"] - children.get(span["id"], 0.0), 0.0) for span in spans}
+
+# Aggrega le tracce per tipo di richiesta e, all'interno, per nome della fase
+def aggregate(traces: Iterable[dict], kind_filter: str = None):
+    kinds: Dict[str, dict] = {}
+    for trace in traces:
+        kind = trace.get("kind", "?")
+        if kind_filter and kind != kind_filter:
+            continue
+        entry = kinds.setdefault(kind, {"durations": [], "errors": 0, "stages": defaultdict(lambda: defaultdict(list))})
+        entry["durations"].append(trace.get("duration_ms", 0.0))
+        if trace.get("status", "ok") != "ok":
+            entry["errors"] += 1
+        spans = trace.get("spans", [])
+        own = self_times(spans)
+        for span in spans:
+            stage = entry["stages"][span["name"]]
+            stage["duration"].append(span["duration_ms"])
+            stage["self"].append(own[span["id"]])
+            for key in ("bytes", "bytes_in", "bytes_out"):
+                if key in span:
+                    stage["bytes"].append(span[key])
+            if "error" in span:
+                stage["errors"].append(span["error"])
+    return kinds
+
+def render_report(kinds: Dict[str, dict], top: int) -> str:
+    lines = []
+    # Tipi di richiesta dal più lento (p95)
+    for kind, entry in sorted(kinds.items(), key=lambda item: -percentile(item[1]["durations"], 0.95)):
+        durations = entry["durations"]
+        lines.append(
+            f"{kind}: {len(durations)} richieste, p50 {percentile(durations, 0.5):.0f} ms, "
+            f"p95 {percentile(durations, 0.95):.0f} ms, max {max(durations):.0f} ms, errori {entry['errors']}"
+        )
+        lines.append(f"  {'fase':<24}{'n':>6}{'proprio tot':>13}{'p50':>9}{'p95':>9}{'max':>9}{'byte medi':>12}  errori")
+        stages = sorted(entry["stages"].items(), key=lambda item: -sum(item[1]["self"]))
+        for name, stage in stages[:top]:
+            avg_bytes = f"{sum(stage['bytes']) / len(stage['bytes']):.0f}" if stage["bytes"] else "-"
+            lines.append(
+                f"  {name:<24}{len(stage['duration']):>6}{sum(stage['self']):>10.0f} ms"
+                f"{percentile(stage['duration'], 0.5):>7.0f}ms{percentile(stage['duration'], 0.95):>7.0f}ms"
+                f"{max(stage['duration']):>7.0f}ms{avg_bytes:>12}  {len(stage['errors'])}"
+            )
+        lines.append("")
+    return "\n".join(lines) if lines else "Nessuna traccia trovata."
+
+def main():
+    parser = argparse.ArgumentParser(description="Fasi più lente per tipo di richiesta, dalle tracce del bot")
+    parser.add_argument("files", nargs="*", type=Path, help=f"file JSONL delle tracce (predefinito {DEFAULT_TRACE_FILE} e file ruotati)")
+    parser.add_argument("--kind", help="mostra solo un tipo di richiesta (es. /menu, CPU_graph, select_computer)")
+    parser.add_argument("--top", type=int, default=5, help="numero di fasi mostrate per tipo (predefinito 5)")
+    args = parser.parse_args()
+    print(render_report(aggregate(read_traces(args.files or default_paths()), args.kind), args.top))
+
+if __name__ == "__main__":
+    main()